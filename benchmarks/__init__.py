@@ -0,0 +1,8 @@
+# benchmarks/__init__.py
+"""Performance benchmarks for PDF generation, finalize, bulk import and the list views.
+
+Run with `python manage.py run_benchmarks` or `python -m pytest benchmarks`.
+Both build a throwaway test database and media root, seed it at the requested
+scale, and compare wall time, query count and peak memory of every case with
+benchmarks/baseline.json.
+"""
@@ -0,0 +1,138 @@
+# benchmarks/cases.py
+"""The benchmark cases.
+
+Each case is prepared once (untimed) against the seeded data and returns the
+callable to time, plus an optional reset that runs untimed before every call.
+"""
+
+import os
+import shutil
+import uuid
+from django.conf import settings
+from django.core.files import File
+from django.test import Client
+from django.urls import reverse
+from clientdoc.models import BulkInvoiceUpload, ConfirmationDocument
+from clientdoc.pdf_generator import generate_invoice_pdf
+from clientdoc.spreadsheets import process_invoice_upload
+from . import fixtures
+
+PDF_LINE_COUNTS = (10, 100, 1000)
+UPLOAD_ROW_COUNTS = (1000, 10000)
+
+
+class Case:
+    """A named benchmark. prepare(data) returns (run, reset); repeat overrides the suite default."""
+
+    def __init__(self, name, prepare, repeat=None):
+        self.name = name
+        self.prepare = prepare
+        self.repeat = repeat
+
+    def __repr__(self):
+        return f"<Case {self.name}>"
+
+
+# --- PDF generation ---
+
+def pdf_case(lines):
+    def prepare(data):
+        invoice = fixtures.line_invoice(lines)
+        return (lambda: generate_invoice_pdf(invoice, data['company']).close()), None
+    return Case(f"generate_invoice_pdf[{lines}_lines]", prepare, repeat=3 if lines >= 1000 else None)
+
+
+def finalize_case(images):
+    def prepare(data):
+        invoice = fixtures.finalize_invoice(lines=20, images=images)
+        url = reverse('clientdoc:finalize_invoice_pdf', args=[invoice.id])
+        client = Client()
+
+        def reset():
+            # Cold bundle every time: no reusable sections, no bundle to return as is
+            shutil.rmtree(str(settings.RENDER_CACHE_DIR), ignore_errors=True)
+            ConfirmationDocument.objects.filter(invoice=invoice).update(
+                bundle_fingerprint=None, bundle_manifest=None, combined_pdf=None)
+
+        def run():
+            response = client.post(url, {'file_order': 'invoice,dc,transport,po,email'})
+            assert response.status_code == 302, response.status_code
+        return run, reset
+    return Case(f"finalize_invoice_pdf[{images}_images]", prepare, repeat=3)
+
+
+# --- Bulk import ---
+
+def upload_case(rows):
+    def prepare(data):
+        directory = os.path.join(str(settings.MEDIA_ROOT), 'bench_sheets')
+        state = {}
+
+        def reset():
+            path = os.path.join(directory, f"invoices_{rows}.xlsx")
+            fixtures.upload_sheet(path, rows, data, tag=f"BU{uuid.uuid4().hex[:6].upper()}")
+            with open(path, 'rb') as f:
+                state['record'] = BulkInvoiceUpload.objects.create(file=File(f, name=os.path.basename(path)))
+
+        def run():
+            record = state['record']
+            process_invoice_upload(record)
+            assert record.status == 'Processed', record.log[-500:]
+        return run, reset
+    return Case(f"process_invoice_upload[{rows}_rows]", prepare, repeat=1)
+
+
+# --- Views ---
+
+def view_case(name, url_name, params=None):
+    def prepare(data):
+        client = Client()
+        url = reverse(url_name)
+        query = params(data) if callable(params) else (params or {})
+
+        def run():
+            response = client.get(url, query)
+            assert response.status_code == 200, response.status_code
+            if response.streaming:
+                # Streamed bodies are produced lazily; include them in the timing
+                b''.join(response.streaming_content)
+        return run, None
+    return Case(name, prepare)
+
+
+def deepest_page(data):
+    return {'page': max(1, -(-data['invoice_count'] // 20))}
+
+
+# --- Model methods ---
+
+def gst_totals_case(lines):
+    def prepare(data):
+        invoice = fixtures.line_invoice(lines)
+        return invoice.calculate_gst_totals, None
+    return Case(f"calculate_gst_totals[{lines}_lines]", prepare)
+
+
+CASES = (
+    [pdf_case(lines) for lines in PDF_LINE_COUNTS]
+    + [finalize_case(0), finalize_case(6)]
+    + [upload_case(rows) for rows in UPLOAD_ROW_COUNTS]
+    + [
+        view_case('invoice_list[default]', 'clientdoc:invoice_list'),
+        # Matches a slice of the seeded locations ("BENCH-<n>-<CITY>") through location__name
+        view_case('invoice_list[search]', 'clientdoc:invoice_list', {'q': 'BENGALURU'}),
+        view_case('invoice_list[sort_total]', 'clientdoc:invoice_list', {'sort': '-total'}),
+        view_case('invoice_list[sort_az]', 'clientdoc:invoice_list', {'sort': 'az'}),
+        view_case('invoice_list[deep_page]', 'clientdoc:invoice_list', deepest_page),
+        view_case('download_sample_excel[invoice]', 'clientdoc:download_sample_excel', {'type': 'invoice'}),
+        view_case('download_sample_excel[item_export]', 'clientdoc:download_sample_excel', {'type': 'item', 'export': 'true'}),
+    ]
+    + [gst_totals_case(10), gst_totals_case(100)]
+)
+
+
+def select_cases(patterns=None):
+    """Cases whose name contains any of the patterns (all when none are given)."""
+    if not patterns:
+        return list(CASES)
+    return [case for case in CASES if any(p in case.name for p in patterns)]
@@ -0,0 +1,74 @@
+# benchmarks/conftest.py
+"""pytest entry for the benchmark suite: `python -m pytest benchmarks [--bench-scale N] [--bench-timing]`.
+
+Query counts are checked against the baseline on every run. Wall time, peak
+memory, the start-up budget and reader latency under contention depend on the
+machine, so they only fail the run with --bench-timing (on the machine that
+recorded benchmarks/baseline.json).
+"""
+
+import os
+import django
+import pytest
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('benchmarks')
+    group.addoption('--bench-scale', type=int, default=2000, help='Synthetic invoices seeded before the cases run')
+    group.addoption('--bench-repeat', type=int, default=5, help='Timed runs per case')
+    group.addoption('--bench-output', default=None, help='Results JSON (default bench_results.json next to manage.py)')
+    group.addoption('--bench-timing', action='store_true',
+                    help='Also fail on wall time, peak memory, start-up time and contention latency')
+    group.addoption('--bench-update-baseline', action='store_true', help='Store this run as benchmarks/baseline.json')
+
+
+def pytest_configure(config):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'transol.settings')
+    django.setup()
+
+
+def option(config, name, default):
+    # Options are only registered when pytest is pointed at benchmarks/ (initial conftest)
+    try:
+        return config.getoption(name)
+    except ValueError:
+        return default
+
+
+@pytest.fixture(scope='session')
+def bench_settings(pytestconfig):
+    from django.conf import settings
+    return {
+        'scale': option(pytestconfig, '--bench-scale', 2000),
+        'repeat': option(pytestconfig, '--bench-repeat', 5),
+        'output': option(pytestconfig, '--bench-output', None) or os.path.join(settings.BASE_DIR, 'bench_results.json'),
+        'update_baseline': option(pytestconfig, '--bench-update-baseline', False),
+        'timing': option(pytestconfig, '--bench-timing', False),
+    }
+
+
+@pytest.fixture(scope='session')
+def bench_data(bench_settings):
+    from .runner import bench_environment
+    with bench_environment(bench_settings['scale']) as data:
+        yield data
+
+
+@pytest.fixture(scope='session')
+def bench_baseline():
+    from .runner import load_baseline
+    return load_baseline()
+
+
+@pytest.fixture(scope='session')
+def bench_results(bench_settings, bench_data):
+    """Collects every case's row; written out (and optionally made the baseline) at the end."""
+    from .runner import save_results, suite_meta, update_baseline
+    results = {'meta': {}, 'cases': {}}
+    yield results
+    if not results['cases']:
+        return
+    results['meta'] = suite_meta(bench_settings['scale'], bench_settings['repeat'], 42)
+    save_results(results, bench_settings['output'])
+    if bench_settings['update_baseline']:
+        update_baseline(results, merge=True)
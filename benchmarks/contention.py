@@ -0,0 +1,149 @@
+# benchmarks/contention.py
+"""Reader latency and lock errors while an importer writes, per SQLite profile.
+
+An importer thread commits invoice-sized batches back to back, an editor
+thread does read-then-write transactions (the calculate_total pattern), and
+reader threads run list-page style queries. The 'journal' profile is the old
+setup (rollback journal, deferred BEGIN, 30s timeout); 'wal' is the
+clientdoc.sqlite backend (its pragmas and BEGIN IMMEDIATE).
+"""
+
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from clientdoc.sqlite.base import DEFAULT_PRAGMAS, apply_pragmas
+
+PROFILES = {
+    'journal': {'pragmas': {'journal_mode': 'DELETE'}, 'begin': 'BEGIN'},
+    'wal': {'pragmas': DEFAULT_PRAGMAS, 'begin': 'BEGIN IMMEDIATE'},
+}
+
+SEED_ROWS = 20000
+BATCH_ROWS = 200
+
+
+def _connect(path, profile):
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    apply_pragmas(conn, PROFILES[profile]['pragmas'])
+    return conn
+
+
+def _seed(path, profile):
+    conn = _connect(path, profile)
+    conn.execute('CREATE TABLE invoice (id INTEGER PRIMARY KEY, buyer TEXT, status TEXT, total REAL, remark TEXT)')
+    conn.execute('CREATE INDEX invoice_buyer ON invoice (buyer)')
+    conn.execute('BEGIN')
+    conn.executemany(
+        'INSERT INTO invoice (buyer, status, total, remark) VALUES (?, ?, ?, ?)',
+        ((f"buyer-{i % 300}", 'DRF', i * 1.5, 'x' * 200) for i in range(SEED_ROWS)),
+    )
+    conn.execute('COMMIT')
+    conn.close()
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_contention(profile, seconds=3.0, readers=4):
+    """Runs the workload for `seconds` on a fresh database; returns the result row."""
+    directory = tempfile.mkdtemp(prefix='clientdoc-contention-')
+    path = os.path.join(directory, 'contention.sqlite3')
+    begin = PROFILES[profile]['begin']
+    stop = threading.Event()
+    latencies, errors, commits = [], {'reader': 0, 'importer': 0, 'editor': 0}, {'importer': 0, 'editor': 0}
+    lock = threading.Lock()
+
+    def importer():
+        conn = _connect(path, profile)
+        rows = [(f"buyer-{i % 300}", 'DRF', 10.0, 'y' * 200) for i in range(BATCH_ROWS)]
+        while not stop.is_set():
+            try:
+                conn.execute(begin)
+                conn.executemany('INSERT INTO invoice (buyer, status, total, remark) VALUES (?, ?, ?, ?)', rows)
+                conn.execute("UPDATE invoice SET status = 'FIN' WHERE id IN (SELECT id FROM invoice ORDER BY id DESC LIMIT ?)", (BATCH_ROWS,))
+                conn.execute('COMMIT')
+                commits['importer'] += 1
+            except sqlite3.OperationalError:
+                errors['importer'] += 1
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+        conn.close()
+
+    def editor():
+        conn = _connect(path, profile)
+        rng = random.Random(1)
+        while not stop.is_set():
+            try:
+                conn.execute(begin)
+                invoice_id = rng.randint(1, SEED_ROWS)
+                total = conn.execute('SELECT total FROM invoice WHERE id = ?', (invoice_id,)).fetchone()[0]
+                conn.execute('UPDATE invoice SET total = ? WHERE id = ?', (total + 1, invoice_id))
+                conn.execute('COMMIT')
+                commits['editor'] += 1
+            except sqlite3.OperationalError:
+                errors['editor'] += 1
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+            time.sleep(0.005)
+        conn.close()
+
+    def reader(seed):
+        conn = _connect(path, profile)
+        rng = random.Random(seed)
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                conn.execute(
+                    'SELECT id, buyer, total FROM invoice WHERE buyer = ? ORDER BY id DESC LIMIT 25',
+                    (f"buyer-{rng.randrange(300)}",),
+                ).fetchall()
+                conn.execute('SELECT COUNT(*), SUM(total) FROM invoice WHERE status = ?', ('FIN',)).fetchone()
+            except sqlite3.OperationalError:
+                with lock:
+                    errors['reader'] += 1
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - started)
+        conn.close()
+
+    try:
+        _seed(path, profile)
+        threads = [threading.Thread(target=importer), threading.Thread(target=editor)]
+        threads += [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return {
+        'profile': profile,
+        'reads': len(latencies),
+        'read_p50_ms': _percentile(latencies, 0.50) * 1000 if latencies else None,
+        'read_p99_ms': _percentile(latencies, 0.99) * 1000 if latencies else None,
+        'read_max_ms': max(latencies) * 1000 if latencies else None,
+        'read_mean_ms': statistics.mean(latencies) * 1000 if latencies else None,
+        'importer_commits': commits['importer'],
+        'editor_commits': commits['editor'],
+        'errors': dict(errors),
+    }
+
+
+def format_contention(row):
+    def ms(value):
+        return f"{value:8.2f}" if value is not None else '       -'
+    return (f"{row['profile']:<8} reads {row['reads']:>7}  p50 {ms(row['read_p50_ms'])} ms  p99 {ms(row['read_p99_ms'])} ms  "
+            f"max {ms(row['read_max_ms'])} ms  import commits {row['importer_commits']:>5}  "
+            f"edits {row['editor_commits']:>5}  lock errors {sum(row['errors'].values())}")
@@ -0,0 +1,92 @@
+# benchmarks/fixtures.py
+"""Data the benchmark cases run against (created inside the throwaway test database)."""
+
+import io
+import os
+from decimal import Decimal
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from PIL import Image, ImageDraw
+import openpyxl
+from clientdoc.management.commands.benchmark_pdf_engines import build_invoice
+from clientdoc.models import (
+    OurCompanyProfile, Buyer, StoreLocation, Item, SalesInvoice, ConfirmationDocument, PackedImage,
+)
+
+PREFIX = 'BENCH'
+
+
+def seed_dataset(scale, seed=42):
+    """Seeds `scale` synthetic invoices plus the master data the cases need."""
+    call_command('seed_synthetic', invoices=scale, prefix=PREFIX, seed=seed, stdout=io.StringIO())
+    company = OurCompanyProfile.objects.create(
+        name="Benchmark Digital Solutions", address="14 Residency Road, Bengaluru",
+        gstin="29ABCDE1234F1Z5", contact_number="080-41234567",
+    )
+    return {
+        'scale': scale,
+        'company': company,
+        'invoice_count': SalesInvoice.objects.count(),
+        'buyers': list(Buyer.objects.order_by('pk').values_list('name', flat=True)[:50]),
+        'locations': list(StoreLocation.objects.order_by('pk').values_list('name', flat=True)[:200]),
+        'items': list(Item.objects.order_by('pk').values_list('name', 'price')[:500]),
+    }
+
+
+def line_invoice(lines):
+    """An invoice (with DC and transport charges) of exactly `lines` line items."""
+    return build_invoice(lines)
+
+
+def photo(seed, size=(2400, 1800)):
+    """A noisy JPEG roughly as heavy to decode and downscale as a phone photo."""
+    noise = Image.effect_noise(size, 40 + seed % 20)
+    img = Image.merge('RGB', (noise, noise.rotate(90, expand=False), noise.transpose(Image.FLIP_LEFT_RIGHT)))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([200, 200, size[0] - 200, size[1] - 200], outline=(255, 255, 255), width=12)
+    out = io.BytesIO()
+    img.save(out, 'JPEG', quality=85)
+    return out.getvalue()
+
+
+def finalize_invoice(lines=20, images=0):
+    """An invoice ready to finalize: confirmation document plus `images` packed photos."""
+    invoice = build_invoice(lines)
+    confirmation = ConfirmationDocument.objects.create(invoice=invoice)
+    for n in range(images):
+        packed = PackedImage(confirmation=confirmation, notes=f"Carton {n + 1}")
+        packed.image.save(f"bench_{invoice.pk}_{n}.jpg", ContentFile(photo(n)), save=True)
+    return invoice
+
+
+def upload_sheet(path, rows, data, tag, lines_per_invoice=5):
+    """Writes a bulk invoice sheet of `rows` rows, grouped into invoices by tally number.
+
+    Tally numbers carry `tag` so every run creates fresh invoices instead of
+    updating the previous run's. PDF generation is off; the case measures parsing
+    and the database work.
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Invoices")
+    ws.append(['Buyer Name', 'Location Name', 'Item Name', 'Item Description', 'Quantity', 'Unit Rate'] + [''] * 32)
+    buyers, locations, items = data['buyers'], data['locations'], data['items']
+    for n in range(rows):
+        group = n // lines_per_invoice
+        first = n % lines_per_invoice == 0
+        item_name, price = items[(n * 7) % len(items)]
+        row = [''] * 38
+        row[0] = buyers[group % len(buyers)]
+        row[1] = locations[group % len(locations)]
+        row[2] = item_name
+        row[4] = 1 + n % 9
+        row[5] = float(price)
+        row[9] = float(Decimal('450.00') + group % 5 * 100) if first and group % 2 == 0 else None
+        row[11] = 'Yes'
+        row[12] = 'No'
+        row[13] = f"{tag}-{group:06d}"
+        row[14] = '2025-03-01'
+        row[27] = "Handle with care" if first and group % 3 == 0 else None
+        ws.append(row)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    wb.save(path)
+    return path
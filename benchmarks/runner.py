@@ -0,0 +1,215 @@
+# benchmarks/runner.py
+"""Runs benchmark cases and compares their results with a stored baseline.
+
+Each case is timed `repeat` times (median wall time), then run once more under
+tracemalloc with query capture for the peak memory and query count, so the
+instrumentation does not skew the timings.
+"""
+
+import gc
+import json
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+import django
+from django.db import connection
+from django.test.utils import (
+    override_settings, setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+from clientdoc import metrics
+from clientdoc.routers import execute_wrapper
+from clientdoc.perf import measure_peak_memory
+from . import fixtures
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# A case regresses when it is this much slower / bigger than the baseline...
+DEFAULT_THRESHOLDS = {
+    'time_ratio': 1.30,
+    'memory_ratio': 1.30,
+    'extra_queries': 0,
+    # ...and by more than these absolute amounts (timer and allocator noise on tiny cases)
+    'time_slack_seconds': 0.02,
+    'memory_slack_bytes': 512 * 1024,
+}
+
+
+class QueryCounter:
+    """connection.execute_wrapper that only counts (CaptureQueriesContext keeps at most 9000)."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def bench_environment(scale, seed=42):
+    """Test database, temporary media root and seeded data; yields the fixture data.
+
+    Background pre-rendering is off so renders only happen inside the cases;
+    query budgets are strict, so a view breaking its @query_budget fails its case.
+    """
+    media_root = tempfile.mkdtemp(prefix='clientdoc-bench-')
+    setup_test_environment()
+    # Every alias: the reporting database becomes a mirror of the test database
+    old_config = setup_databases(verbosity=0, interactive=False, serialized_aliases=set())
+    try:
+        with override_settings(
+            MEDIA_ROOT=media_root,
+            RENDER_CACHE_DIR=os.path.join(media_root, 'render_cache'),
+            PRERENDER_ENABLED=False,
+            PDF_LINEARIZE=False,
+            QUERY_BUDGET_STRICT=True,
+            METRICS_DB=os.path.join(media_root, 'metrics.sqlite3'),
+            # Fragment versions must not carry over from the development cache
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        ):
+            started = time.perf_counter()
+            data = fixtures.seed_dataset(scale, seed=seed)
+            data['seed_seconds'] = time.perf_counter() - started
+            try:
+                yield data
+            finally:
+                metrics.flush()
+    finally:
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def run_case(case, data, repeat=5):
+    """Times one case; returns its result row."""
+    run, reset = case.prepare(data)
+    repeat = max(1, case.repeat or repeat)
+
+    timings = []
+    for _ in range(repeat):
+        if reset:
+            reset()
+        gc.collect()
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+
+    if reset:
+        reset()
+    gc.collect()
+    queries = QueryCounter()
+    with execute_wrapper(queries):
+        _, stats = measure_peak_memory(run)
+
+    return {
+        'wall_seconds': round(statistics.median(timings), 5),
+        'min_seconds': round(min(timings), 5),
+        'runs': len(timings),
+        'queries': queries.count,
+        'peak_bytes': stats['peak_traced_bytes'],
+    }
+
+
+def run_suite(cases, scale, repeat=5, seed=42, progress=None):
+    """Runs the cases in a fresh environment; returns the results document."""
+    results = {}
+    with bench_environment(scale, seed=seed) as data:
+        if progress:
+            progress(f"Seeded {data['invoice_count']} invoices in {data['seed_seconds']:.1f}s")
+        for case in cases:
+            results[case.name] = run_case(case, data, repeat=repeat)
+            if progress:
+                progress(format_row(case.name, results[case.name]))
+    return {'meta': suite_meta(scale, repeat, seed), 'cases': results}
+
+
+def suite_meta(scale, repeat, seed):
+    return {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'scale': scale,
+        'seed': seed,
+        'repeat': repeat,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'machine': f"{platform.system()} {platform.machine()}",
+        'database': connection.vendor,
+    }
+
+
+def compare(results, baseline, thresholds=None, timing=True):
+    """Checks every case against the baseline; returns a list of (name, status, notes).
+
+    status is 'ok', 'regressed', 'new' (not in the baseline) or 'faster'. Query
+    counts are always checked; timing=False skips wall time and peak memory,
+    which only compare on the machine that recorded the baseline.
+    """
+    limits = dict(DEFAULT_THRESHOLDS)
+    limits.update(baseline.get('thresholds', {}))
+    limits.update(thresholds or {})
+
+    report = []
+    for name, current in results['cases'].items():
+        base = baseline.get('cases', {}).get(name)
+        if base is None:
+            report.append((name, 'new', []))
+            continue
+        notes = []
+        allowed = max(base['wall_seconds'] * limits['time_ratio'], base['wall_seconds'] + limits['time_slack_seconds'])
+        if timing and current['wall_seconds'] > allowed:
+            notes.append(f"time {base['wall_seconds']:.3f}s -> {current['wall_seconds']:.3f}s")
+        if current['queries'] > base['queries'] + limits['extra_queries']:
+            notes.append(f"queries {base['queries']} -> {current['queries']}")
+        allowed = max(base['peak_bytes'] * limits['memory_ratio'], base['peak_bytes'] + limits['memory_slack_bytes'])
+        if timing and current['peak_bytes'] > allowed:
+            notes.append(f"memory {format_bytes(base['peak_bytes'])} -> {format_bytes(current['peak_bytes'])}")
+        if notes:
+            report.append((name, 'regressed', notes))
+        elif timing and current['wall_seconds'] * limits['time_ratio'] < base['wall_seconds']:
+            report.append((name, 'faster', [f"time {base['wall_seconds']:.3f}s -> {current['wall_seconds']:.3f}s"]))
+        else:
+            report.append((name, 'ok', []))
+    return report
+
+
+def load_baseline(path=BASELINE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_results(results, path, thresholds=None):
+    """Writes a results document (also the baseline format); keeps the thresholds block if given."""
+    document = dict(results)
+    if thresholds:
+        document['thresholds'] = thresholds
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def update_baseline(results, path=BASELINE_PATH, merge=False):
+    """Stores results as the baseline; merge keeps the cases this run did not include."""
+    baseline = load_baseline(path)
+    cases = dict(baseline.get('cases', {})) if merge else {}
+    cases.update(results['cases'])
+    save_results(dict(results, cases=cases), path, thresholds=baseline.get('thresholds'))
+
+
+def format_bytes(num):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(num) < 1024:
+            return f"{num:.1f} {unit}"
+        num /= 1024
+    return f"{num:.1f} TB"
+
+
+def format_row(name, row):
+    return f"{name:<44}{row['wall_seconds']:>10.4f}s{row['queries']:>8} q{format_bytes(row['peak_bytes']):>12}"
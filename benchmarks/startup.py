@@ -0,0 +1,62 @@
+# benchmarks/startup.py
+"""Import-time budget of a worker start, measured with `python -X importtime`.
+
+A worker (and every manage.py command) runs django.setup() and loads the
+URLconf, which imports views.py. The PDF, Excel and merge libraries must not
+be part of that: they are imported by the service modules on first use.
+"""
+
+import os
+import re
+import subprocess
+import sys
+from django.conf import settings
+
+STARTUP_CODE = 'import django; django.setup(); import transol.urls'
+# Only ever imported on demand (render, bundle, upload, import_data)
+HEAVY_MODULES = ('openpyxl', 'reportlab', 'PyPDF2', 'pikepdf', 'weasyprint', 'pandas', 'numpy', 'num2words')
+# Measured about 0.27s here; the slack absorbs slower disks and Python builds
+STARTUP_BUDGET_SECONDS = 0.5
+
+_LINE_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def parse_importtime(output):
+    """{module: (self_us, cumulative_us)} from -X importtime output."""
+    modules = {}
+    for line in output.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            modules[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+    return modules
+
+
+def measure_startup(code=STARTUP_CODE, runs=3):
+    """Fastest of `runs` cold imports of `code` in a fresh interpreter.
+
+    Returns {'seconds': total import time, 'modules': parse_importtime(...)}.
+    """
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'transol.settings')
+    best = None
+    for _ in range(max(1, runs)):
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            cwd=str(settings.BASE_DIR), env=env, capture_output=True, text=True, check=True,
+        )
+        modules = parse_importtime(proc.stderr)
+        seconds = sum(self_us for self_us, _ in modules.values()) / 1e6
+        if best is None or seconds < best['seconds']:
+            best = {'seconds': seconds, 'modules': modules}
+    return best
+
+
+def heavy_imports(modules):
+    """Top-level packages of HEAVY_MODULES that were imported."""
+    return sorted({name.split('.')[0] for name in modules} & set(HEAVY_MODULES))
+
+
+def slowest(modules, limit=10):
+    """[(module, cumulative seconds)] of the slowest imports, packages included."""
+    ranked = sorted(modules.items(), key=lambda item: item[1][1], reverse=True)
+    return [(name, cumulative / 1e6) for name, (_, cumulative) in ranked[:limit]]
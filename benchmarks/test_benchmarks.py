@@ -0,0 +1,21 @@
+# benchmarks/test_benchmarks.py
+"""One test per benchmark case; fails when the case regressed against benchmarks/baseline.json.
+
+Without --bench-timing only more queries than the baseline count as a regression.
+"""
+
+import pytest
+from .cases import CASES
+from .runner import compare, format_row, run_case
+
+
+@pytest.mark.parametrize('case', CASES, ids=lambda case: case.name)
+def test_benchmark(case, bench_settings, bench_data, bench_results, bench_baseline):
+    row = run_case(case, bench_data, repeat=bench_settings['repeat'])
+    bench_results['cases'][case.name] = row
+    print(format_row(case.name, row))
+
+    [(name, status, notes)] = compare({'cases': {case.name: row}}, bench_baseline, timing=bench_settings['timing'])
+    if status == 'new':
+        pytest.skip(f"{name} is not in the baseline yet")
+    assert status != 'regressed', f"{name} regressed: {'; '.join(notes)}"
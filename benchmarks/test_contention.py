@@ -0,0 +1,19 @@
+# benchmarks/test_contention.py
+"""Readers keep answering while the importer writes, and concurrent edits queue instead of failing."""
+
+from .contention import format_contention, run_contention
+
+
+def test_sqlite_contention(bench_settings):
+    journal = run_contention('journal')
+    wal = run_contention('wal')
+    print(format_contention(journal))
+    print(format_contention(wal))
+
+    assert not any(wal['errors'].values()), f"lock errors with the WAL profile: {wal['errors']}"
+    assert wal['editor_commits'] > 0
+    if bench_settings['timing']:
+        assert wal['read_p99_ms'] < journal['read_p99_ms'] / 2, (
+            f"readers still wait behind the importer: p99 {wal['read_p99_ms']:.1f} ms "
+            f"(rollback journal: {journal['read_p99_ms']:.1f} ms)"
+        )
@@ -0,0 +1,17 @@
+# benchmarks/test_startup.py
+"""Worker start-up stays free of the heavy libraries and within its import-time budget."""
+
+from .startup import STARTUP_BUDGET_SECONDS, heavy_imports, measure_startup, slowest
+
+
+def test_startup_imports(bench_settings):
+    result = measure_startup()
+    print(f"startup imports: {result['seconds']:.3f}s")
+    assert not heavy_imports(result['modules']), (
+        f"{', '.join(heavy_imports(result['modules']))} imported at start-up; import it where it is used"
+    )
+    if bench_settings['timing']:
+        slow = ', '.join(f"{name} {seconds:.3f}s" for name, seconds in slowest(result['modules'], 5))
+        assert result['seconds'] <= STARTUP_BUDGET_SECONDS, (
+            f"start-up imports took {result['seconds']:.3f}s, budget is {STARTUP_BUDGET_SECONDS}s (slowest: {slow})"
+        )
@@ -0,0 +1,172 @@
+# clientdoc/admission.py
+"""Admission control for PDF rendering.
+
+RENDER_CONCURRENCY RenderSlot rows form a token pool shared by every worker
+process through the database. A render takes a RenderTicket, waits its turn
+(first come, first served) and runs only while holding a slot, so a burst of
+image-heavy bundles cannot push the box into swap. Tickets record how long
+they queued and how long they rendered, and are deleted RENDER_TICKET_KEEP_HOURS
+after they finish.
+
+A slot expires RENDER_LEASE_TTL_SECONDS after it was last renewed, which
+frees the slots of renders that died; holders keep theirs with holding_slot.
+
+Tickets and slots only work across processes when their rows are committed:
+take them outside any transaction.
+"""
+
+import time
+import logging
+from contextlib import contextmanager
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from .leases import Heartbeat
+from .metrics import render_queue_wait_seconds
+
+logger = logging.getLogger(__name__)
+
+# Seconds between clean-ups of old tickets in one process
+PRUNE_INTERVAL_SECONDS = 600
+_pruned_at = None
+
+
+def render_concurrency():
+    return max(1, getattr(settings, 'RENDER_CONCURRENCY', 2))
+
+
+def slot_ttl():
+    return getattr(settings, 'RENDER_LEASE_TTL_SECONDS', 60)
+
+
+def _stale_before(now):
+    # Waiting browsers poll every few seconds; one that stopped has gone away
+    return now - timedelta(seconds=getattr(settings, 'RENDER_TICKET_STALE_SECONDS', 30))
+
+
+def _ensure_slots(limit):
+    from .models import RenderSlot
+    if RenderSlot.objects.filter(number__lt=limit).count() < limit:
+        RenderSlot.objects.bulk_create([RenderSlot(number=n) for n in range(limit)], ignore_conflicts=True)
+
+
+def _free_slots(now, limit):
+    from .models import RenderSlot
+    held = RenderSlot.objects.filter(number__lt=limit, ticket__isnull=False, expires_at__gt=now).count()
+    return limit - held
+
+
+def prune_tickets(now=None):
+    """Deletes tickets that finished, or were left behind, over RENDER_TICKET_KEEP_HOURS ago."""
+    from .models import RenderTicket
+    now = now or timezone.now()
+    cutoff = now - timedelta(hours=getattr(settings, 'RENDER_TICKET_KEEP_HOURS', 24))
+    deleted, _ = RenderTicket.objects.filter(
+        Q(finished_at__lt=cutoff)
+        # Never finished: a client that stopped polling, or a render whose process died
+        | Q(finished_at__isnull=True, started_at__isnull=True, last_seen_at__lt=cutoff)
+        | Q(finished_at__isnull=True, started_at__lt=cutoff)
+    ).delete()
+    return deleted
+
+
+def create_ticket(kind, invoice=None, params=None):
+    """Queues a render ticket; every few minutes clears out old ones first."""
+    from .models import RenderTicket
+    global _pruned_at
+    if _pruned_at is None or time.monotonic() - _pruned_at > PRUNE_INTERVAL_SECONDS:
+        _pruned_at = time.monotonic()
+        prune_tickets()
+    return RenderTicket.objects.create(kind=kind, invoice=invoice, params=params or {})
+
+
+def queue_position(ticket, now=None):
+    """1-based position among live queued tickets."""
+    from .models import RenderTicket
+    now = now or timezone.now()
+    ahead = RenderTicket.objects.filter(status='WAI', id__lt=ticket.id, last_seen_at__gte=_stale_before(now)).count()
+    return ahead + 1
+
+
+def try_admit(ticket):
+    """Starts a queued ticket if a slot is free and no live ticket is ahead of it."""
+    from .models import RenderSlot
+    now = timezone.now()
+    limit = render_concurrency()
+    _ensure_slots(limit)
+    if queue_position(ticket, now) > _free_slots(now, limit):
+        return False
+
+    # Expired slots belong to renders that died without releasing them
+    expires_at = now + timedelta(seconds=slot_ttl())
+    for number in range(limit):
+        taken = RenderSlot.objects.filter(number=number).filter(
+            Q(ticket__isnull=True) | Q(expires_at__lte=now)
+        ).update(ticket=ticket, expires_at=expires_at)
+        if taken:
+            ticket.status = 'RUN'
+            ticket.started_at = now
+            ticket.wait_seconds = (now - ticket.created_at).total_seconds()
+            ticket.save(update_fields=['status', 'started_at', 'wait_seconds'])
+            render_queue_wait_seconds.observe(ticket.wait_seconds, kind=ticket.kind)
+            return True
+    return False
+
+
+def renew_slot(ticket):
+    """Pushes back the expiry of the ticket's slot. Returns False if it no longer holds one."""
+    from .models import RenderSlot
+    expires_at = timezone.now() + timedelta(seconds=slot_ttl())
+    return bool(RenderSlot.objects.filter(ticket=ticket).update(expires_at=expires_at))
+
+
+def holding_slot(ticket):
+    """Context manager that keeps an admitted ticket's slot from expiring while it renders."""
+    return Heartbeat(f"render slot of ticket {ticket.id}", lambda: renew_slot(ticket), slot_ttl() / 3)
+
+
+def touch(ticket):
+    """Marks a queued ticket's client as still waiting."""
+    ticket.last_seen_at = timezone.now()
+    ticket.save(update_fields=['last_seen_at'])
+
+
+def finish(ticket, error=None):
+    """Releases the ticket's slot and records its timings."""
+    from .models import RenderSlot
+    now = timezone.now()
+    RenderSlot.objects.filter(ticket=ticket).update(ticket=None, expires_at=None)
+    if ticket.status == 'RUN':
+        ticket.render_seconds = (now - ticket.started_at).total_seconds()
+        ticket.status = 'ERR' if error else 'DON'
+    else:
+        ticket.status = 'ABN'
+    ticket.finished_at = now
+    ticket.error = (str(error) or type(error).__name__) if error else ''
+    ticket.save(update_fields=['status', 'finished_at', 'render_seconds', 'error'])
+    logger.info(
+        f"Render ticket {ticket.id} ({ticket.get_kind_display()}): {ticket.get_status_display()}, "
+        f"queued {ticket.wait_seconds or 0:.2f}s, rendered {ticket.render_seconds or 0:.2f}s"
+    )
+
+
+@contextmanager
+def render_slot(kind, invoice=None, poll_interval=0.5):
+    """Blocks until a render slot is free and holds it for the with-block.
+
+    For callers without a browser to poll (bulk uploads, the pre-renderer). Call it
+    outside any transaction: inside one, other processes don't see the ticket
+    and the wait holds the caller's locks.
+    """
+    ticket = create_ticket(kind, invoice)
+    try:
+        while not try_admit(ticket):
+            time.sleep(poll_interval)
+            touch(ticket)
+        with holding_slot(ticket):
+            yield ticket
+    except BaseException as e:
+        finish(ticket, error=e)
+        raise
+    finish(ticket)
@@ -0,0 +1,51 @@
+# clientdoc/bulk.py
+"""Raw multi-row inserts for bulk loads (seeding, imports).
+
+bulk_create spends most of its time preparing each value of each model
+instance. insert_rows takes plain tuples in `fields` order: on PostgreSQL it
+streams them with COPY FROM STDIN, elsewhere it runs one executemany INSERT.
+No signals run and no primary keys come back.
+"""
+
+import io
+from django.db import connections, router
+
+
+def _copy_psycopg3(cursor, sql, rows):
+    with cursor.copy(sql) as copy:
+        for row in rows:
+            copy.write_row(row)
+
+
+def _csv_field(value):
+    # CSV COPY reads an unquoted empty field as NULL and a quoted one as ''
+    if value is None:
+        return ''
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _copy_psycopg2(cursor, sql, rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(','.join(_csv_field(value) for value in row) + '\n')
+    buffer.seek(0)
+    cursor.copy_expert(sql + " WITH (FORMAT csv)", buffer)
+
+
+def insert_rows(model, fields, rows, using=None):
+    """Inserts `rows` (tuples of `fields` values, foreign keys as ids) into model's table."""
+    connection = connections[using or router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    columns = ', '.join(quote(model._meta.get_field(name).column) for name in fields)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            raw = cursor.cursor
+            sql = f"COPY {table} ({columns}) FROM STDIN"
+            if hasattr(raw, 'copy'):
+                _copy_psycopg3(raw, sql, rows)
+            else:
+                _copy_psycopg2(raw, sql, rows)
+        else:
+            placeholders = ', '.join(['%s'] * len(fields))
+            cursor.executemany(f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", rows)
@@ -0,0 +1,349 @@
+# clientdoc/bundles.py
+"""Assembly of the combined confirmation bundle (invoice, DC, transport, PO, email, images)."""
+
+import os
+import logging
+import tempfile
+from django.conf import settings
+from django.utils import timezone
+from PyPDF2 import PdfMerger, PdfReader
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
+from .pdf_generator import new_pdf_buffer
+from .leases import run_leased
+from .metrics import bundle_bytes, bundle_pages, bundle_sections, bundle_requests
+from .render_cache import cached_section, section_fingerprint, uploaded_fingerprint, images_fingerprint, bundle_fingerprint
+from .images import bundle_image_path, build_derivatives, find_duplicates, SLOT_MAX_HEIGHT_PT
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FILE_ORDER = ['invoice', 'dc', 'transport', 'po', 'email']
+
+
+def generate_packed_images_pdf(confirmation):
+    """Generates a PDF page for packed images."""
+    images = confirmation.packedimage_set.all()
+    if not images.exists():
+        return None
+
+    buffer = new_pdf_buffer()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    margin = 50
+    img_width = width - (2 * margin)
+    img_height = SLOT_MAX_HEIGHT_PT
+    spacing = 20
+    y = height - margin
+
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(margin, y, "Packed Goods Images")
+    y -= 40
+
+    # Track unique image paths to prevent duplicates
+    seen_images = set()
+    images = list(images)
+    # Hashes come with the derivatives; build any that are missing so near-duplicates can be skipped
+    build_derivatives(images)
+    duplicates = find_duplicates(images)
+
+    for image_obj in images:
+        if image_obj.id in duplicates:
+            continue
+
+        # Skip duplicate images based on file path
+        try:
+            img_path = image_obj.image.path
+
+            # Check if we've already processed this image
+            if img_path in seen_images:
+                continue
+
+            seen_images.add(img_path)
+
+        except Exception:
+            # If path access fails, skip this image
+            continue
+
+        if y < margin + img_height + spacing:
+            c.showPage()
+            y = height - margin - 20
+
+        try:
+            # Embed the print-size derivative rather than the full-resolution upload
+            img = ImageReader(bundle_image_path(image_obj))
+
+            aspect = img.getSize()[1] / img.getSize()[0]
+            current_img_height = img_width * aspect
+
+            if current_img_height > img_height:
+                current_img_height = img_height
+
+            c.drawImage(img, margin, y - current_img_height, width=img_width, height=current_img_height)
+
+            c.setFont("Helvetica", 10)
+            notes_y = y - current_img_height - 10
+            c.drawString(margin, notes_y, f"Notes: {image_obj.notes or 'N/A'}")
+
+            y -= (current_img_height + spacing + 20)
+
+        except Exception as e:
+            logger.error(f"Error drawing image {image_obj.id} to PDF: {e}")
+            c.setFont("Helvetica-Bold", 12)
+            c.drawString(margin, y, f"Error loading image {image_obj.id}: {e}")
+            y -= 30
+
+    c.save()
+    buffer.seek(0)
+    return buffer
+
+
+def append_uploaded_pdf(merger, field_file):
+    """Appends an uploaded PDF by path. Returns False if the file is missing or not a readable PDF."""
+    if not field_file:
+        return False
+    try:
+        PdfReader(field_file.path)
+        merger.append(field_file.path)
+        return True
+    except Exception as e:
+        logger.warning(f"Skipping unreadable PDF {field_file.name}: {e}")
+        return False
+
+
+class BundleBuilder:
+    """Assembles the bundle section by section and records a manifest of what went where.
+
+    A section whose fingerprint matches one in the previous bundle's manifest is
+    copied page-for-page from that file instead of being rendered and merged again.
+    """
+
+    def __init__(self, previous_path=None, previous_manifest=None):
+        self.merger = PdfMerger()
+        self.sections = []
+        self.reused = []
+        self.previous_path = previous_path
+        self.previous = {}
+        if previous_path and previous_manifest:
+            self.previous = {(s['section'], s['fingerprint']): s for s in previous_manifest.get('sections', [])}
+
+    def add(self, section, fingerprint, append):
+        """Adds a section, reusing previous pages when the fingerprint is unchanged.
+
+        append(merger) appends freshly built pages and returns False if there was
+        nothing usable. Returns True if the section is in the bundle.
+        """
+        start = len(self.merger.pages)
+        reusable = self.previous.get((section, fingerprint))
+        if reusable and reusable['pages']:
+            self.merger.append(self.previous_path, pages=(reusable['start'], reusable['start'] + reusable['pages']))
+            self.reused.append(section)
+        elif append(self.merger) is False:
+            return False
+        self.sections.append({
+            'section': section,
+            'fingerprint': fingerprint,
+            'start': start,
+            'pages': len(self.merger.pages) - start,
+        })
+        return True
+
+
+def _append_path(path):
+    def append(merger):
+        merger.append(path)
+    return append
+
+
+def _append_uploaded(field_file):
+    return lambda merger: append_uploaded_pdf(merger, field_file)
+
+
+def _append_images(confirmation):
+    def append(merger):
+        images_pdf_buffer = generate_packed_images_pdf(confirmation)
+        if not images_pdf_buffer:
+            return False
+        merger.append(images_pdf_buffer)
+    return append
+
+
+def _append_generated(invoice, section, company_profile, fingerprint):
+    # Rendered (through spooled buffers) only when the render cache misses
+    return lambda merger: merger.append(cached_section(invoice, section, company_profile, fingerprint=fingerprint)[0])
+
+
+def build_bundle(builder, invoice, confirmation, company_profile, file_order=None):
+    """Adds the sections in file_order to builder, packed images always last."""
+    for file_type in (file_order or DEFAULT_FILE_ORDER):
+        if file_type == 'invoice':
+            # Uploaded custom invoice wins; fall back to the generated one if it is corrupt
+            uploaded = confirmation.uploaded_invoice
+            if uploaded and builder.add('invoice', uploaded_fingerprint(uploaded), _append_uploaded(uploaded)):
+                continue
+            fingerprint = section_fingerprint(invoice, 'invoice', company_profile)
+            builder.add('invoice', fingerprint, _append_generated(invoice, 'invoice', company_profile, fingerprint))
+
+        elif file_type == 'dc':
+            uploaded = confirmation.uploaded_dc
+            if uploaded:
+                builder.add('dc', uploaded_fingerprint(uploaded), _append_uploaded(uploaded))
+            elif hasattr(invoice, 'deliverychallan'):
+                fingerprint = section_fingerprint(invoice, 'dc', company_profile)
+                builder.add('dc', fingerprint, _append_generated(invoice, 'dc', company_profile, fingerprint))
+
+        elif file_type == 'transport' and hasattr(invoice, 'transportcharges'):
+            fingerprint = section_fingerprint(invoice, 'transport', company_profile)
+            builder.add('transport', fingerprint, _append_generated(invoice, 'transport', company_profile, fingerprint))
+
+        elif file_type == 'po' and confirmation.po_file:
+            builder.add('po', uploaded_fingerprint(confirmation.po_file), _append_uploaded(confirmation.po_file))
+
+        elif file_type == 'email' and confirmation.approval_email_file:
+            builder.add('email', uploaded_fingerprint(confirmation.approval_email_file), _append_uploaded(confirmation.approval_email_file))
+
+    if confirmation.packedimage_set.exists():
+        builder.add('images', images_fingerprint(confirmation), _append_images(confirmation))
+    return builder
+
+
+def previous_bundle(confirmation):
+    """(path, manifest) of the stored bundle if its pages can be reused, else (None, None)."""
+    manifest = confirmation.bundle_manifest
+    name = confirmation.combined_pdf.name
+    if not manifest or not name or not confirmation.combined_pdf.storage.exists(name):
+        return None, None
+    return confirmation.combined_pdf.path, manifest
+
+
+def combined_pdf_name(invoice):
+    """Storage name of the combined bundle for an invoice."""
+    suffix = invoice.tally_invoice_number or invoice.app_invoice_number or str(invoice.id)
+    return f"confirmations/confirmation_invoice_{suffix}.pdf"
+
+
+def linearize_pdf(path):
+    """Rewrites a PDF in place as linearized ("fast web view") with compressed object streams.
+
+    Viewers can then show page 1 from the first bytes of a ranged download
+    instead of waiting for the trailer at the end of the file. Linearizing is
+    optional: returns False (leaving the file untouched) when pikepdf is not
+    installed or fails on the file.
+    """
+    try:
+        import pikepdf
+    except ImportError:
+        logger.warning("PDF linearization requested but pikepdf is not installed; writing a regular PDF")
+        return False
+
+    tmp_path = f"{path}.linearizing"
+    try:
+        with pikepdf.open(path) as pdf:
+            pdf.save(
+                tmp_path,
+                linearize=True,
+                object_stream_mode=pikepdf.ObjectStreamMode.generate,
+                compress_streams=True,
+            )
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.warning(f"Could not linearize {path}; keeping the regular PDF: {e}")
+        return False
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return True
+
+
+def _current_bundle(confirmation, fingerprint):
+    """Storage name of the stored bundle if it was built from the same inputs, else None."""
+    name = type(confirmation).all_objects.filter(
+        pk=confirmation.pk, bundle_fingerprint=fingerprint).values_list('combined_pdf', flat=True).first()
+    if name and confirmation.combined_pdf.storage.exists(name):
+        return name
+    return None
+
+
+def write_combined_pdf(invoice, confirmation, company_profile, file_order=None, linearize=None):
+    """Renders the bundle and writes the merge straight into the storage file.
+
+    Runs under a per-invoice render lease: a concurrent finalize (double-click,
+    second user, bulk upload) waits, and if it asked for the same inputs it gets
+    the bundle just written instead of rendering it again. An existing bundle
+    with the same fingerprint is returned as is. linearize=None follows the
+    PDF_LINEARIZE setting. Returns the storage name saved on the confirmation.
+    """
+    file_order = file_order or DEFAULT_FILE_ORDER
+    if linearize is None:
+        linearize = getattr(settings, 'PDF_LINEARIZE', False)
+    fingerprint = bundle_fingerprint(invoice, confirmation, company_profile, file_order, linearized=linearize)
+
+    name, reused = run_leased(
+        f"bundle:{invoice.id}", fingerprint,
+        work=lambda: _write_bundle(invoice, confirmation, company_profile, file_order, linearize, fingerprint),
+        reuse=lambda: _current_bundle(confirmation, fingerprint),
+    )
+    bundle_requests.inc(result='current' if reused else 'built')
+    if reused:
+        logger.info(f"Bundle for invoice {invoice.id} is up to date; reusing {name}")
+        confirmation.refresh_from_db(fields=['combined_pdf', 'bundle_fingerprint', 'bundle_manifest', 'bundle_generated_at'])
+    return name
+
+
+def _write_bundle(invoice, confirmation, company_profile, file_order, linearize, fingerprint):
+    """Builds the bundle into a temporary file next to the destination, then renames it into place.
+
+    The merged PDF is never held as a single bytes object: PdfMerger streams into
+    the temporary file, and unchanged sections are copied from the old bundle,
+    which stays intact (and readable by downloads) until the rename.
+    """
+    # Another holder may have replaced the bundle while we waited for the lease
+    confirmation.refresh_from_db(fields=['combined_pdf', 'bundle_manifest'])
+    previous_path, previous_manifest = previous_bundle(confirmation)
+    builder = BundleBuilder(previous_path, previous_manifest)
+
+    name = combined_pdf_name(invoice)
+    path = confirmation.combined_pdf.storage.path(name)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.pdf')
+    try:
+        try:
+            build_bundle(builder, invoice, confirmation, company_profile, file_order)
+            with os.fdopen(fd, 'wb') as f:
+                builder.merger.write(f)
+        finally:
+            builder.merger.close()
+        if linearize and not linearize_pdf(tmp_path):
+            # Stored as the regular PDF it is, so a later linearized request rebuilds it instead of reusing it
+            linearize = False
+            fingerprint = bundle_fingerprint(invoice, confirmation, company_profile, file_order)
+        os.chmod(tmp_path, confirmation.combined_pdf.storage.file_permissions_mode or 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    bundle_bytes.observe(os.path.getsize(path))
+    bundle_pages.observe(sum(section['pages'] for section in builder.sections))
+    bundle_sections.inc(len(builder.reused), result='reused')
+    bundle_sections.inc(len(builder.sections) - len(builder.reused), result='built')
+    if builder.reused:
+        logger.info(f"Bundle for invoice {invoice.id}: reused {', '.join(builder.reused)} from the previous bundle")
+    if previous_path and previous_path != path and os.path.exists(previous_path):
+        # Invoice number changed since the last bundle; the old file is superseded
+        os.remove(previous_path)
+
+    manifest = {
+        'file_order': list(file_order),
+        'linearized': bool(linearize),
+        'sections': builder.sections,
+    }
+    confirmation.combined_pdf.name = name
+    confirmation.bundle_manifest = manifest
+    confirmation.bundle_fingerprint = fingerprint
+    confirmation.bundle_generated_at = timezone.now()
+    # Only the bundle fields: the rest of this instance may be older than the row
+    confirmation.save(update_fields=['combined_pdf', 'bundle_manifest', 'bundle_fingerprint', 'bundle_generated_at'])
+    return name
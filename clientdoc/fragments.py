@@ -0,0 +1,82 @@
+# clientdoc/fragments.py
+"""Rendered page fragments cached under per-model version numbers.
+
+Every versioned model has a version number in the cache. Saves and deletes
+bump it once their transaction commits (see signals.py). A fragment's key
+includes the current versions of the models it shows, so any change makes
+its old entry unreachable. Nothing is deleted; old entries just expire. On a
+hit the view skips both its queries and its template rendering.
+
+The version numbers have to be shared by every process that writes
+(workers, prerender_worker, imports), so use the file or Redis backend
+with more than one process; locmem only suits a single one.
+"""
+
+import time
+import hashlib
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.safestring import mark_safe
+from .metrics import fragment_cache_lookups
+
+
+def fragments_enabled():
+    return getattr(settings, 'FRAGMENT_CACHE_ENABLED', True)
+
+
+def _cache():
+    return caches[getattr(settings, 'FRAGMENT_CACHE_ALIAS', 'default')]
+
+
+def _version_key(model):
+    return f"fragver:{model._meta.label_lower}"
+
+
+def _fresh_version():
+    # Never restart at 1 after an eviction: that could bring back fragments stored under an old 1
+    return time.time_ns()
+
+
+def bump_versions(*models):
+    """Invalidates every fragment showing these models (now, or when the current transaction commits)."""
+    if not fragments_enabled():
+        return
+    transaction.on_commit(lambda: _bump(models))
+
+
+def _bump(models):
+    cache = _cache()
+    for model in models:
+        key = _version_key(model)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _fresh_version(), None)
+
+
+def model_versions(models):
+    """The current version numbers of models, creating missing ones."""
+    cache = _cache()
+    keys = [_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _fresh_version(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def cached_fragment(name, models, vary, render):
+    """HTML from render(), cached under name, the versions of `models` and the `vary` values."""
+    if not fragments_enabled():
+        return mark_safe(render())
+    cache = _cache()
+    digest = hashlib.md5(repr((model_versions(models), vary)).encode()).hexdigest()
+    key = f"fragment:{name}:{digest}"
+    html = cache.get(key)
+    fragment_cache_lookups.inc(fragment=name, result='miss' if html is None else 'hit')
+    if html is None:
+        html = render()
+        cache.set(key, html, getattr(settings, 'FRAGMENT_CACHE_SECONDS', 600))
+    return mark_safe(html)
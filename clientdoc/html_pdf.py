@@ -0,0 +1,111 @@
+# clientdoc/html_pdf.py
+"""WeasyPrint renderer for the HTML print templates (an alternative to pdf_generator).
+
+WeasyPrint is imported on first use. The FontConfiguration and every parsed
+stylesheet are kept for the life of the process: scanning fonts and parsing
+CSS cost more than laying out a one-page invoice. The <style> blocks of the
+print templates are lifted out of the rendered HTML and parsed once per
+distinct text. Renders within a process are serialized, since the shared font
+configuration is not thread-safe (cross-process concurrency is bounded by
+clientdoc.admission).
+"""
+
+import os
+import re
+import hashlib
+import mimetypes
+import threading
+from urllib.parse import unquote, urlparse
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.template.loader import render_to_string
+from .pdf_generator import new_pdf_buffer
+from .print_context import invoice_print_context, dc_print_context, transport_print_context
+
+BASE_STYLESHEET = 'clientdoc/css/pdf_styles.css'
+
+_STYLE_RE = re.compile(r'<style[^>]*>(.*?)</style>', re.S | re.I)
+
+_render_lock = threading.RLock()
+_font_config = None
+_stylesheets = {}
+
+
+def font_config():
+    """The process-wide FontConfiguration."""
+    global _font_config
+    with _render_lock:
+        if _font_config is None:
+            from weasyprint.text.fonts import FontConfiguration
+            _font_config = FontConfiguration()
+        return _font_config
+
+
+def _local_path(url):
+    """Maps /media/... and /static/... URLs onto files, so no HTTP round trip to ourselves."""
+    path = unquote(urlparse(url).path)
+    media_url = '/' + settings.MEDIA_URL.lstrip('/')
+    static_url = '/' + settings.STATIC_URL.lstrip('/')
+    if path.startswith(media_url):
+        return os.path.join(str(settings.MEDIA_ROOT), path[len(media_url):])
+    if path.startswith(static_url):
+        return finders.find(path[len(static_url):])
+    return None
+
+
+def url_fetcher(url, *args, **kwargs):
+    from weasyprint import default_url_fetcher
+    path = _local_path(url) if url.startswith(('file:', '/')) else None
+    if path and os.path.exists(path):
+        return {
+            'file_obj': open(path, 'rb'),
+            'filename': path,
+            'mime_type': mimetypes.guess_type(path)[0],
+            'redirected_url': url,
+        }
+    return default_url_fetcher(url, *args, **kwargs)
+
+
+def parsed_css(text):
+    """Parsed stylesheet for a CSS string, cached per process."""
+    key = hashlib.sha1(text.encode()).hexdigest()
+    with _render_lock:
+        css = _stylesheets.get(key)
+        if css is None:
+            from weasyprint import CSS
+            css = CSS(string=text, font_config=font_config(), url_fetcher=url_fetcher, base_url='file:///')
+            _stylesheets[key] = css
+        return css
+
+
+def base_stylesheets():
+    path = finders.find(BASE_STYLESHEET)
+    if not path:
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [parsed_css(f.read())]
+
+
+def render_html_pdf(template_name, context):
+    """Renders a template to PDF. Returns a spooled buffer positioned at 0."""
+    from weasyprint import HTML
+    html = render_to_string(template_name, context)
+    with _render_lock:
+        stylesheets = base_stylesheets() + [parsed_css(text) for text in _STYLE_RE.findall(html)]
+        buffer = new_pdf_buffer()
+        HTML(string=_STYLE_RE.sub('', html), base_url='file:///', url_fetcher=url_fetcher).write_pdf(
+            buffer, stylesheets=stylesheets, font_config=font_config())
+    buffer.seek(0)
+    return buffer
+
+
+def generate_invoice_html_pdf(invoice, company):
+    return render_html_pdf('clientdoc/invoice_print_template.html', invoice_print_context(invoice, company))
+
+
+def generate_dc_html_pdf(invoice, dc, company):
+    return render_html_pdf('clientdoc/dc_print_template.html', dc_print_context(invoice, dc, company))
+
+
+def generate_transport_html_pdf(invoice, transport, company):
+    return render_html_pdf('clientdoc/transport_print_template.html', transport_print_context(invoice, transport, company))
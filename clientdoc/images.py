@@ -0,0 +1,168 @@
+# clientdoc/images.py
+"""Print-size derivatives, thumbnails and perceptual hashes for packed images."""
+
+import os
+import logging
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Packed image slot on the A4 images page (points, see bundles.generate_packed_images_pdf)
+SLOT_WIDTH_PT = 495
+SLOT_MAX_HEIGHT_PT = 250
+THUMBNAIL_SIZE = (320, 320)
+JPEG_QUALITY = 82
+HASH_SIZE = 8
+FLAT_HASH = '0' * 16
+
+
+def _open_oriented(path):
+    """Opens an image with EXIF orientation applied, as RGB."""
+    img = Image.open(path)
+    # JPEG draft mode decodes at a reduced scale, far cheaper than a full 12 MP decode
+    dpi = getattr(settings, 'PACKED_IMAGE_DPI', 200)
+    img.draft('RGB', (int(SLOT_WIDTH_PT / 72 * dpi), int(SLOT_WIDTH_PT / 72 * dpi)))
+    img = ImageOps.exif_transpose(img)
+    if img.mode in ('RGBA', 'LA', 'P'):
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        img = background
+    elif img.mode != 'RGB':
+        img = img.convert('RGB')
+    return img
+
+
+def print_size_for(width, height, dpi):
+    """Pixel size needed to draw an image of width x height in the PDF slot at dpi."""
+    aspect = height / width
+    drawn_w = SLOT_WIDTH_PT
+    drawn_h = min(SLOT_WIDTH_PT * aspect, SLOT_MAX_HEIGHT_PT)
+    target_w = drawn_w / 72 * dpi
+    target_h = drawn_h / 72 * dpi
+    # Keep the aspect ratio; scale so both drawn axes still get the requested DPI
+    scale = min(1.0, max(target_w / width, target_h / height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _to_jpeg(img):
+    out = BytesIO()
+    img.save(out, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+    return out.getvalue()
+
+
+def dhash(img):
+    """64-bit difference hash of a PIL image, as 16 hex chars.
+
+    Robust to rescaling and recompression, so the same photo saved under a
+    different name or re-encoded by a phone hashes identically or within a few bits.
+    """
+    small = img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{bits:016x}"
+
+
+def dhash_file(path):
+    """Perceptual hash of an image file (EXIF orientation applied)."""
+    # Same reduction as the stored thumbnail so hashes of upload and thumbnail agree
+    with Image.open(path) as img:
+        img.draft('RGB', THUMBNAIL_SIZE)
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail(THUMBNAIL_SIZE, Image.LANCZOS)
+        return dhash(img)
+
+
+def hamming(hash_a, hash_b):
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count('1')
+
+
+def find_duplicates(images):
+    """Maps image id -> earlier PackedImage it is a (near-)duplicate of.
+
+    Images compare in the given order, so the first upload of a photo is kept
+    and later copies are flagged. Images without a usable hash are never flagged.
+    """
+    max_distance = getattr(settings, 'PACKED_IMAGE_DUPLICATE_DISTANCE', 6)
+    kept = []
+    duplicates = {}
+    for packed_image in images:
+        # A flat (blank/single-colour) frame hashes to all zeros and says nothing about content
+        if not packed_image.phash or packed_image.phash == FLAT_HASH:
+            continue
+        original = next((k for k in kept if hamming(k.phash, packed_image.phash) <= max_distance), None)
+        if original:
+            duplicates[packed_image.id] = original
+        else:
+            kept.append(packed_image)
+    return duplicates
+
+
+def delete_derivatives(packed_image):
+    """Removes the derivative files of a packed image (the original is untouched)."""
+    for field in (packed_image.print_image, packed_image.thumbnail):
+        if field:
+            field.delete(save=False)
+
+
+def ensure_derivatives(packed_image):
+    """Builds the print JPEG and thumbnail if missing or built from an older upload.
+
+    Returns True if derivatives are current after the call.
+    """
+    if not packed_image.image:
+        return False
+    source = packed_image.image.name
+    if (packed_image.derivatives_source == source and packed_image.print_image
+            and packed_image.thumbnail and packed_image.print_image.storage.exists(packed_image.print_image.name)):
+        if not packed_image.phash:
+            # Derivatives predate hashing; the thumbnail is enough to hash from
+            packed_image.phash = dhash_file(packed_image.thumbnail.path)
+            packed_image.save(update_fields=['phash'])
+        return True
+
+    try:
+        img = _open_oriented(packed_image.image.path)
+    except Exception as e:
+        logger.error(f"Cannot build derivatives for image {packed_image.id}: {e}")
+        return False
+
+    dpi = getattr(settings, 'PACKED_IMAGE_DPI', 200)
+    print_img = img.resize(print_size_for(img.width, img.height, dpi), Image.LANCZOS)
+    thumb = img.copy()
+    thumb.thumbnail(THUMBNAIL_SIZE, Image.LANCZOS)
+
+    delete_derivatives(packed_image)
+    stem = os.path.splitext(os.path.basename(source))[0]
+    packed_image.print_image.save(f"{stem}.jpg", ContentFile(_to_jpeg(print_img)), save=False)
+    packed_image.thumbnail.save(f"{stem}.jpg", ContentFile(_to_jpeg(thumb)), save=False)
+    packed_image.derivatives_source = source
+    packed_image.phash = dhash(thumb)
+    packed_image.save(update_fields=['print_image', 'thumbnail', 'derivatives_source', 'phash'])
+    return True
+
+
+def build_derivatives(images):
+    """Best-effort derivative build after an upload; failures fall back to the original at bundle time."""
+    for packed_image in images:
+        try:
+            ensure_derivatives(packed_image)
+        except Exception as e:
+            logger.error(f"Derivative build failed for image {packed_image.id}: {e}")
+
+
+def bundle_image_path(packed_image):
+    """Path of the file to embed in the bundle: the print derivative, else the original."""
+    try:
+        if ensure_derivatives(packed_image):
+            return packed_image.print_image.path
+    except Exception as e:
+        logger.error(f"Using original for image {packed_image.id}: {e}")
+    return packed_image.image.path
@@ -0,0 +1,126 @@
+# clientdoc/leases.py
+"""Expiring DB leases that stop two threads or processes rendering the same output at once.
+
+A lease is one RenderLease row per key. The holder deletes it when done, and a
+crashed holder's lease simply expires after RENDER_LEASE_TTL_SECONDS. While the
+work runs a Heartbeat thread keeps pushing the expiry back, so the TTL only
+bounds how long a crash blocks the key, not how long a render may take. Callers
+that find the lease taken wait and reuse the holder's result when it is what
+they need (same fingerprint) instead of repeating the work.
+
+A lease only excludes other processes once its row is committed, so it is
+taken in its own transaction; taking one inside a caller's transaction raises
+(durable atomic) rather than waiting there with the caller's locks held.
+"""
+
+import time
+import uuid
+import logging
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def lease_ttl():
+    return getattr(settings, 'RENDER_LEASE_TTL_SECONDS', 60)
+
+
+def acquire_lease(key, fingerprint='', ttl=None):
+    """Returns a holder token if the lease on key was free (or expired), else None."""
+    from .models import RenderLease
+    holder = uuid.uuid4().hex
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=ttl or lease_ttl())
+    try:
+        with transaction.atomic(durable=True):
+            taken_over = RenderLease.objects.filter(key=key, expires_at__lte=now).update(
+                holder=holder, fingerprint=fingerprint, acquired_at=now, expires_at=expires_at)
+            if not taken_over:
+                RenderLease.objects.create(key=key, fingerprint=fingerprint, holder=holder, acquired_at=now, expires_at=expires_at)
+    except IntegrityError:
+        return None
+    if taken_over:
+        logger.warning(f"Took over expired render lease {key}")
+    return holder
+
+
+def renew_lease(key, holder, ttl=None):
+    """Pushes the lease's expiry back by the TTL. Returns False if it is no longer held."""
+    from .models import RenderLease
+    expires_at = timezone.now() + timedelta(seconds=ttl or lease_ttl())
+    return bool(RenderLease.objects.filter(key=key, holder=holder).update(expires_at=expires_at))
+
+
+def release_lease(key, holder):
+    from .models import RenderLease
+    RenderLease.objects.filter(key=key, holder=holder).delete()
+
+
+class Heartbeat:
+    """Daemon thread that calls renew() every interval seconds for the with-block.
+
+    Keeps an expiring row (a lease, a render slot) alive while its holder works.
+    Stops early if renew() reports the row is gone. Renewing on a third of the
+    TTL leaves two missed beats (a busy database) before the row expires.
+    """
+
+    def __init__(self, name, renew, interval):
+        self.name = name
+        self.renew = renew
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"heartbeat {name}", daemon=True)
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    if not self.renew():
+                        logger.warning(f"Lost {self.name} before its work finished")
+                        return
+                except DatabaseError as e:
+                    logger.warning(f"Could not renew {self.name}: {e}")
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_leased(key, fingerprint, work, reuse, ttl=None, poll_interval=0.25):
+    """Runs work() under the lease on key, unless someone else produces the result first.
+
+    reuse() returns the finished result if it already exists, else None. It is
+    checked before and after taking the lease and while waiting for another
+    holder. Returns (result, reused).
+    """
+    waited = False
+    while True:
+        result = reuse()
+        if result is not None:
+            if waited:
+                logger.info(f"Reused result of a concurrent render for {key}")
+            return result, True
+        holder = acquire_lease(key, fingerprint, ttl)
+        if holder:
+            try:
+                # The previous holder may have finished between the check and the acquire
+                result = reuse()
+                if result is not None:
+                    return result, True
+                renew_every = (ttl or lease_ttl()) / 3
+                with Heartbeat(f"render lease {key}", lambda: renew_lease(key, holder, ttl), renew_every):
+                    return work(), False
+            finally:
+                release_lease(key, holder)
+        waited = True
+        time.sleep(poll_interval)
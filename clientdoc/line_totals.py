@@ -0,0 +1,147 @@
+# clientdoc/line_totals.py
+"""Per-invoice line aggregates: item_count, total_qty and taxable_total.
+
+The InvoiceItem signals move them by each line's contribution as lines are
+saved and deleted (see signals.py), so nothing has to walk invoiceitem_set to
+count, add up quantities or total the taxable value. Paths that skip signals
+(raw inserts, bulk_create) call refresh_line_totals for the invoices they
+touched. Imports defer the per-line updates (deferred_line_totals) since
+every group ends in calculate_gst_totals, which saves the totals anyway, and
+verify_line_totals repairs any drift.
+
+The SQL side works in integer paise with half-even rounding, the same as
+InvoiceItem.taxable_value, so the two always agree to the paisa.
+"""
+
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+from django.db.models import BigIntegerField, Case, Count, F, Q, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Round
+from django.db.models.lookups import Exact, GreaterThan, LessThan
+from .models import SalesInvoice, LINE_TOTAL_FIELDS
+from .fragments import bump_versions
+
+_deferred = threading.local()
+
+
+def paise(expression):
+    """SQL for a two-place decimal in whole hundredths: rupees to paise, a 0.18 rate to 18."""
+    return Cast(Round(expression * Value(100)), BigIntegerField())
+
+
+def _half_even_div(numerator, divisor):
+    """numerator / divisor in integers, rounded half to even."""
+    quotient = Cast(numerator / Value(divisor), BigIntegerField())
+    remainder = numerator - quotient * Value(divisor)
+    odd = quotient - Cast(quotient / Value(2), BigIntegerField()) * Value(2)
+    half = divisor // 2
+    return Case(
+        When(GreaterThan(remainder, half), then=quotient + Value(1)),
+        When(LessThan(remainder, -half), then=quotient - Value(1)),
+        When(Q(Exact(remainder, half)) & ~Q(Exact(odd, 0)), then=quotient + Value(1)),
+        When(Q(Exact(remainder, -half)) & ~Q(Exact(odd, 0)), then=quotient - Value(1)),
+        default=quotient,
+        output_field=BigIntegerField(),
+    )
+
+
+def line_taxable_paise(prefix=''):
+    """SQL for a line's taxable value in paise (InvoiceItem.taxable_value * 100); prefix reaches it through a join."""
+    gross = Cast(F(f'{prefix}quantity'), BigIntegerField()) * paise(F(f'{prefix}price'))
+    discount_value = paise(F(f'{prefix}discount_value'))
+    # gross paise * discount in hundredths of a percent = discount in 1/10000 paise
+    discount = Case(
+        When(Exact(F(f'{prefix}discount_type'), 'Percentage'), then=_half_even_div(gross * discount_value, 10000)),
+        default=discount_value,
+        output_field=BigIntegerField(),
+    )
+    return Case(
+        When(GreaterThan(gross - discount, 0), then=gross - discount),
+        default=Value(0),
+        output_field=BigIntegerField(),
+    )
+
+
+def line_contribution(line):
+    """(item_count, total_qty, taxable_total) that one line adds to its invoice."""
+    return 1, line.quantity, line.taxable_value
+
+
+def move_line_totals(invoice_id, count, qty, taxable):
+    """Adds a change in lines to the invoice's stored totals, in the database."""
+    if not (count or qty or taxable):
+        return
+    SalesInvoice.all_objects.filter(pk=invoice_id).update(
+        item_count=F('item_count') + count,
+        total_qty=F('total_qty') + qty,
+        taxable_total=F('taxable_total') + taxable,
+    )
+
+
+def find_drift(invoice_ids=None, chunk_size=5000):
+    """Yields invoices whose stored line totals differ from their lines, set to the right values.
+
+    One aggregate query over invoices joined to their lines (soft-deleted invoices included).
+    """
+    queryset = SalesInvoice.all_objects.only('id', *LINE_TOTAL_FIELDS).annotate(
+        actual_count=Count('invoiceitem'),
+        actual_qty=Coalesce(Sum('invoiceitem__quantity'), 0),
+        actual_paise=Coalesce(Sum(line_taxable_paise('invoiceitem__')), 0, output_field=BigIntegerField()),
+    ).order_by()
+    if invoice_ids is not None:
+        queryset = queryset.filter(pk__in=invoice_ids)
+    for invoice in queryset.iterator(chunk_size=chunk_size):
+        actual = (invoice.actual_count, invoice.actual_qty, Decimal(invoice.actual_paise) / 100)
+        if (invoice.item_count, invoice.total_qty, invoice.taxable_total) != actual:
+            invoice.item_count, invoice.total_qty, invoice.taxable_total = actual
+            yield invoice
+
+
+def refresh_line_totals(invoice_ids=None, batch_size=1000):
+    """Rewrites the line totals that have drifted (of invoice_ids, or all invoices); returns them."""
+    if invoice_ids is None:
+        drifted = list(find_drift())
+    else:
+        invoice_ids = list(invoice_ids)
+        drifted = []
+        for start in range(0, len(invoice_ids), batch_size):
+            drifted.extend(find_drift(invoice_ids[start:start + batch_size]))
+    if drifted:
+        SalesInvoice.all_objects.bulk_update(drifted, LINE_TOTAL_FIELDS, batch_size=batch_size)
+        bump_versions(SalesInvoice)
+    return drifted
+
+
+def settle_line_totals(invoice_id):
+    """calculate_gst_totals is saving the invoice's totals: nothing left to refresh for it."""
+    invoice_ids = getattr(_deferred, 'invoice_ids', None)
+    if invoice_ids is not None:
+        invoice_ids.discard(invoice_id)
+
+
+def deferring_line_totals(invoice_id):
+    """Inside deferred_line_totals, notes the invoice for the refresh at the end and returns True."""
+    invoice_ids = getattr(_deferred, 'invoice_ids', None)
+    if invoice_ids is None:
+        return False
+    invoice_ids.add(invoice_id)
+    return True
+
+
+@contextmanager
+def deferred_line_totals():
+    """Skips the per-line updates in the block; invoices calculate_gst_totals didn't save are refreshed at the end.
+
+    Also works as a decorator.
+    """
+    if getattr(_deferred, 'invoice_ids', None) is not None:
+        yield
+        return
+    _deferred.invoice_ids = set()
+    try:
+        yield
+    finally:
+        invoice_ids, _deferred.invoice_ids = _deferred.invoice_ids, None
+        if invoice_ids:
+            refresh_line_totals(invoice_ids)
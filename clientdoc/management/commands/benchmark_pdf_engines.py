@@ -0,0 +1,97 @@
+import time
+import uuid
+from decimal import Decimal
+from statistics import median
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from clientdoc.models import (
+    OurCompanyProfile, StoreLocation, Buyer, Item, SalesInvoice, InvoiceItem, DeliveryChallan, TransportCharges,
+)
+from clientdoc.line_totals import refresh_line_totals
+from clientdoc.pdf_generator import generate_invoice_pdf, generate_dc_pdf, generate_transport_pdf
+
+ENGINES = ('reportlab', 'weasyprint')
+
+
+def build_invoice(lines):
+    """Creates an invoice with the given number of lines (call inside a rolled-back transaction)."""
+    tag = uuid.uuid4().hex[:8]
+    location = StoreLocation.objects.create(name=f"Bench Site {tag}", address="12 MG Road, Bengaluru", state_code='29')
+    buyer = Buyer.objects.create(name=f"Bench Buyer {tag}", address="Whitefield, Bengaluru")
+    items = Item.objects.bulk_create([
+        Item(name=f"Bench Item {tag} {n}", description=f"Printer consumable, variant {n}", price=Decimal('149.50') + n)
+        for n in range(lines)
+    ])
+    invoice = SalesInvoice.objects.create(location=location, buyer=buyer, tally_invoice_number=f"BENCH-{tag}", status='TRP')
+    InvoiceItem.objects.bulk_create([
+        InvoiceItem(invoice=invoice, item=item, quantity=1 + n % 7, price=item.price, description=item.description, gst_rate=Decimal('18.00'))
+        for n, item in enumerate(items)
+    ])
+    refresh_line_totals([invoice.pk])
+    DeliveryChallan.objects.create(invoice=invoice)
+    TransportCharges.objects.create(invoice=invoice, charges=Decimal('850.00'))
+    invoice.calculate_gst_totals()
+    return invoice
+
+
+def renderers(engine):
+    if engine == 'weasyprint':
+        import weasyprint  # noqa: F401  (fail early when Pango is missing)
+        from clientdoc import html_pdf
+        return {
+            'invoice': html_pdf.generate_invoice_html_pdf,
+            'dc': lambda inv, company: html_pdf.generate_dc_html_pdf(inv, inv.deliverychallan, company),
+            'transport': lambda inv, company: html_pdf.generate_transport_html_pdf(inv, inv.transportcharges, company),
+        }
+    return {
+        'invoice': generate_invoice_pdf,
+        'dc': lambda inv, company: generate_dc_pdf(inv, inv.deliverychallan, company),
+        'transport': lambda inv, company: generate_transport_pdf(inv, inv.transportcharges, company),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Times the ReportLab and WeasyPrint renderers on invoices of 10/100/1000 lines (data is rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', default='10,100,1000', help='Comma separated line counts')
+        parser.add_argument('--repeat', type=int, default=3, help='Warm renders per case')
+        parser.add_argument('--engines', default=','.join(ENGINES))
+        parser.add_argument('--documents', default='invoice,dc', help='Any of invoice, dc, transport')
+
+    def handle(self, *args, **options):
+        line_counts = [int(n) for n in options['lines'].split(',') if n]
+        documents = [d for d in options['documents'].split(',') if d]
+        company = OurCompanyProfile.objects.first() or OurCompanyProfile(name="Benchmark Co", address="Bengaluru")
+
+        engines = []
+        for engine in options['engines'].split(','):
+            try:
+                engines.append((engine, renderers(engine)))
+            except (ImportError, OSError) as e:
+                # WeasyPrint needs Pango; report instead of failing the whole run
+                self.stderr.write(f"{engine}: unavailable ({e})")
+
+        self.stdout.write(f"{'engine':<11}{'document':<10}{'lines':>6}{'first (s)':>11}{'warm (s)':>10}{'KB':>8}")
+        with transaction.atomic():
+            for lines in line_counts:
+                invoice = build_invoice(lines)
+                for engine, render in engines:
+                    for document in documents:
+                        self.report(engine, document, lines, render[document], invoice, company, options['repeat'])
+            transaction.set_rollback(True)
+
+    def report(self, engine, document, lines, render, invoice, company, repeat):
+        started = time.perf_counter()
+        buffer = render(invoice, company)
+        first = time.perf_counter() - started
+        size = len(buffer.read())
+        buffer.close()
+
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            render(invoice, company).close()
+            timings.append(time.perf_counter() - started)
+        warm = median(timings) if timings else first
+        self.stdout.write(f"{engine:<11}{document:<10}{lines:>6}{first:>11.3f}{warm:>10.3f}{size / 1024:>8.0f}")
@@ -0,0 +1,169 @@
+import os
+import time
+from collections import Counter
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, FileField, Q
+from clientdoc.models import MediaBlob
+from clientdoc.storage import blob_grace_cutoff, is_blob_name
+
+
+def iter_media_files(root):
+    """Yields (relative_name, size, mtime) for every file under root, without building a full listing."""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        st = entry.stat(follow_symlinks=False)
+                        rel = os.path.relpath(entry.path, root).replace(os.sep, '/')
+                        yield rel, st.st_size, st.st_mtime
+        except FileNotFoundError:
+            continue
+
+
+def format_bytes(num):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if num < 1024:
+            return f"{num:.1f} {unit}"
+        num /= 1024
+    return f"{num:.1f} TB"
+
+
+class Command(BaseCommand):
+    help = 'Finds media files that no FileField/ImageField references any more and deletes them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Files deleted per batch')
+        parser.add_argument('--min-age-hours', type=float, default=24,
+                            help='Skip files newer than this (uploads still being saved)')
+        parser.add_argument('--list', action='store_true', help='Print every orphaned file')
+
+    def handle(self, *args, **options):
+        root = str(settings.MEDIA_ROOT)
+        if not os.path.isdir(root):
+            self.stdout.write(self.style.WARNING(f"Media root {root} does not exist."))
+            return
+
+        started = time.monotonic()
+        live = self.live_references()
+        self.stdout.write(f"{len(live)} live file references loaded in {time.monotonic() - started:.1f}s")
+
+        cutoff = time.time() - options['min_age_hours'] * 3600
+        dry_run = options['dry_run']
+        batch = []
+        scanned = orphan_count = orphan_bytes = 0
+
+        for name, size, mtime in iter_media_files(root):
+            scanned += 1
+            if name in live or mtime > cutoff:
+                continue
+            orphan_count += 1
+            orphan_bytes += size
+            if options['list']:
+                self.stdout.write(f"  {name} ({format_bytes(size)})")
+            batch.append(name)
+            if len(batch) >= options['batch_size']:
+                self.delete_batch(root, batch, dry_run)
+                batch = []
+        if batch:
+            self.delete_batch(root, batch, dry_run)
+
+        self.reconcile_blobs(options['batch_size'], dry_run)
+
+        verb = 'Would reclaim' if dry_run else 'Reclaimed'
+        self.stdout.write(self.style.SUCCESS(
+            f"Scanned {scanned} files in {time.monotonic() - started:.1f}s. "
+            f"{verb} {format_bytes(orphan_bytes)} from {orphan_count} orphaned files."
+        ))
+
+    def file_fields(self):
+        """[(model, [FileField, ...])] of every model storing files."""
+        found = []
+        for model in apps.get_models():
+            fields = [f for f in model._meta.concrete_fields if isinstance(f, FileField)]
+            if fields:
+                found.append((model, fields))
+        return found
+
+    def live_references(self):
+        """Set of every stored file name."""
+        live = set()
+        for model, fields in self.file_fields():
+            # _base_manager includes soft-deleted rows, which can still be restored
+            for values in model._base_manager.values_list(*[f.attname for f in fields]).iterator(chunk_size=5000):
+                live.update(name for name in values if name)
+        return live
+
+    def reference_counts(self, names):
+        """How many rows reference each of names right now."""
+        counts = Counter()
+        for model, fields in self.file_fields():
+            for field in fields:
+                rows = (model._base_manager.filter(**{f'{field.attname}__in': names})
+                        .values_list(field.attname).annotate(n=Count('pk')).order_by())
+                counts.update(dict(rows))
+        return counts
+
+    def delete_batch(self, root, names, dry_run):
+        if dry_run:
+            return
+        # The scan's reference set is minutes old by now: re-check this batch against the rows
+        referenced = self.reference_counts(names)
+        names = [name for name in names if not referenced[name]]
+        blob_names = [name for name in names if is_blob_name(name)]
+        removable = [name for name in names if not is_blob_name(name)]
+        if blob_names:
+            removable += self.remove_unreferenced_blobs(blob_names)
+        for name in removable:
+            try:
+                os.remove(os.path.join(root, name))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self.stderr.write(f"Could not delete {name}: {e}")
+
+    def remove_unreferenced_blobs(self, names):
+        """Deletes the index rows of blobs nothing references or is uploading; returns the blobs whose files can go."""
+        with transaction.atomic():
+            rows = MediaBlob.objects.select_for_update().filter(name__in=names)
+            indexed = set(rows.values_list('name', flat=True))
+            unreferenced = set(rows.filter(refcount__lte=0).filter(
+                Q(saved_at__isnull=True) | Q(saved_at__lt=blob_grace_cutoff())).values_list('name', flat=True))
+            MediaBlob.objects.filter(name__in=unreferenced).delete()
+        # Blob files without a row are orphans as well
+        return [name for name in names if name in unreferenced or name not in indexed]
+
+    def reconcile_blobs(self, batch_size, dry_run):
+        """Brings MediaBlob refcounts back in line with the actual references (bulk updates bypass signals).
+
+        Each batch is counted with its rows locked, so references added or dropped
+        while the command runs are neither lost nor counted twice.
+        """
+        fixed = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                blobs = list(MediaBlob.objects.select_for_update().filter(id__gt=last_id)
+                             .only('id', 'name', 'refcount').order_by('id')[:batch_size])
+                if not blobs:
+                    break
+                last_id = blobs[-1].id
+                actual = self.reference_counts([blob.name for blob in blobs])
+                drifted = []
+                for blob in blobs:
+                    if blob.refcount != actual[blob.name]:
+                        blob.refcount = actual[blob.name]
+                        drifted.append(blob)
+                if drifted and not dry_run:
+                    MediaBlob.objects.bulk_update(drifted, ['refcount'])
+                fixed += len(drifted)
+        if fixed:
+            self.stdout.write(f"{'Would fix' if dry_run else 'Fixed'} refcount on {fixed} blobs")
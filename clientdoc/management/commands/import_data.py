@@ -1,4 +1,3 @@
-import pandas as pd
 from django.core.management.base import BaseCommand
 from clientdoc.models import Item, ItemCategory, StoreLocation
 
@@ -10,6 +9,8 @@ class Command(BaseCommand):
         self.import_items()
 
     def import_locations(self):
+        # Imported here so loading the command (e.g. `help import_data`) doesn't pull in pandas
+        import pandas as pd
         try:
             df = pd.read_excel('Imports/client_location.xlsx')
             count = 0
@@ -34,6 +35,7 @@ class Command(BaseCommand):
             self.stdout.write(self.style.ERROR(f'Error importing locations: {e}'))
 
     def import_items(self):
+        import pandas as pd
         try:
             df = pd.read_excel('Imports/Transcend Digital Solutions Products.xlsx')
             count = 0
@@ -3,6 +3,7 @@ from io import StringIO
 from django.core.management.base import BaseCommand
 from django.db import transaction
 from clientdoc.models import StoreLocation
+from clientdoc.fragments import bump_versions
 
 class Command(BaseCommand):
     help = 'Imports store data from embedded CSV data'
@@ -57,6 +58,8 @@ P713,PT-MALL OF ASIA-BENGALURU,"Pantaloons, Gf, Mall of Asia, Phoneix mall of As
         if stores_to_create:
             with transaction.atomic():
                 StoreLocation.objects.bulk_create(stores_to_create)
+            # bulk_create sends no post_save
+            bump_versions(StoreLocation)
             self.stdout.write(self.style.SUCCESS(f"Successfully created {len(stores_to_create)} new StoreLocation records."))
         else:
             self.stdout.write(self.style.SUCCESS("No new stores to create. All listed stores already exist."))
@@ -0,0 +1,33 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from clientdoc.prerender import prerender_enabled, run_due_jobs, seconds_until_next_job
+
+
+class Command(BaseCommand):
+    help = 'Runs queued speculative section renders (unless PRERENDER_IN_PROCESS runs them in the web process)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run the jobs that are due now and exit')
+        parser.add_argument('--max-sleep', type=float, default=5, help='Longest wait between queue checks (seconds)')
+
+    def handle(self, *args, **options):
+        if not prerender_enabled():
+            self.stderr.write(self.style.WARNING(
+                "PRERENDER_ENABLED is off, so nothing queues new jobs; set it for the server and this worker."))
+        if options['once']:
+            ran = run_due_jobs()
+            self.stdout.write(self.style.SUCCESS(f"Ran {ran} pre-render jobs."))
+            return
+
+        self.stdout.write("Pre-render worker started. Ctrl+C to stop.")
+        try:
+            while True:
+                close_old_connections()
+                ran = run_due_jobs()
+                if ran:
+                    self.stdout.write(f"Ran {ran} pre-render jobs")
+                wait = seconds_until_next_job()
+                time.sleep(options['max_sleep'] if wait is None else min(max(wait, 0.1), options['max_sleep']))
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped.")
@@ -0,0 +1,130 @@
+import time
+from decimal import Decimal
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections, router, transaction
+from django.db.models import F, Max, Min
+from clientdoc.fragments import bump_versions
+from clientdoc.line_totals import line_taxable_paise, paise
+from clientdoc.models import SalesInvoice, InvoiceItem, OurCompanyProfile, GST_TOTAL_FIELDS, TRANSPORT_GST_RATE
+
+TWO_PLACES = Decimal('0.01')
+
+
+def half_even_sql(numerator, divisor):
+    """SQL for integer numerator / divisor rounded half to even, like Decimal.quantize."""
+    quotient = f"(({numerator}) / {divisor})"
+    remainder = f"(({numerator}) - {quotient} * {divisor})"
+    half = divisor // 2
+    # MOD, not %: the query runs with params, so drivers would read % as a placeholder
+    return (f"CASE WHEN {remainder} > {half} THEN {quotient} + 1 "
+            f"WHEN {remainder} < -{half} THEN {quotient} - 1 "
+            f"WHEN {remainder} = {half} AND MOD({quotient}, 2) <> 0 THEN {quotient} + 1 "
+            f"WHEN {remainder} = -{half} AND MOD({quotient}, 2) <> 0 THEN {quotient} - 1 "
+            f"ELSE {quotient} END")
+
+
+class Command(BaseCommand):
+    help = ("Recomputes every invoice's CGST/SGST/IGST and grand total in SQL (after GST rate or company state "
+            "changes), with the same arithmetic as SalesInvoice.calculate_gst_totals")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Invoices aggregated and written per batch')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Invoices written per bulk update')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the invoices that would change')
+        parser.add_argument('--list', action='store_true', help='Print every changed invoice')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        self.company_state = self.company_state_code()
+        self.dry_run, self.list_changes = options['dry_run'], options['list']
+        self.batch_size = options['batch_size']
+        bounds = SalesInvoice.all_objects.aggregate(low=Min('pk'), high=Max('pk'))
+        if bounds['low'] is None:
+            self.stdout.write("No invoices.")
+            return
+
+        scanned = changed = 0
+        chunk_size = options['chunk_size']
+        for low in range(bounds['low'], bounds['high'] + 1, chunk_size):
+            high = low + chunk_size
+            line_totals = self.line_totals(low, high)
+            invoices = SalesInvoice.all_objects.filter(pk__gte=low, pk__lt=high).values(
+                'pk', 'location_id', 'location__state_code', 'buyer__gstin', 'location__gstin', 'transportcharges__charges',
+                *GST_TOTAL_FIELDS,
+            ).order_by()
+            rows = list(invoices)
+            scanned += len(rows)
+            changed += self.write_chunk(rows, line_totals)
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  {scanned} invoices, {changed} changed ({time.monotonic() - started:.1f}s)")
+
+        if changed and not self.dry_run:
+            bump_versions(SalesInvoice)
+        verb = 'Would update' if self.dry_run else 'Updated'
+        self.stdout.write(self.style.SUCCESS(
+            f"Recomputed {scanned} invoices in {time.monotonic() - started:.1f}s. {verb} {changed}."
+        ))
+
+    def company_state_code(self):
+        """The state calculate_gst_totals compares place of supply with."""
+        profile = OurCompanyProfile.objects.only('state_code').first()
+        if profile and profile.state_code:
+            return profile.state_code
+        return getattr(settings, 'COMPANY_STATE_CODE', '29')
+
+    def line_totals(self, low, high):
+        """{invoice id: (taxable, tax, half tax) in paise} for invoices low <= id < high, in one aggregate query.
+
+        Tax and its CGST/SGST half are rounded per line, as calculate_gst_totals does. Each rounding
+        reads a column computed in the CTE before it: as nested ORM expressions they compile to megabytes of SQL.
+        """
+        lines = InvoiceItem.objects.filter(invoice_id__gte=low, invoice_id__lt=high).annotate(
+            taxable=line_taxable_paise(),
+            # 0.18 -> 18: tax paise = taxable paise * rate / 100
+            rate=paise(F('gst_rate')),
+        ).values_list('invoice_id', 'taxable', 'rate').order_by()
+        lines_sql, params = lines.query.sql_with_params()
+        # MATERIALIZED: a flattened CTE would inline each column into every CASE branch reading it
+        sql = (f"WITH lines AS MATERIALIZED ({lines_sql}), "
+               f"taxed AS MATERIALIZED (SELECT invoice_id, taxable, {half_even_sql('taxable * rate', 100)} AS tax "
+               f"FROM lines) "
+               f"SELECT invoice_id, SUM(taxable), SUM(tax), SUM({half_even_sql('tax', 2)}) "
+               f"FROM taxed GROUP BY invoice_id")
+        with connections[router.db_for_read(InvoiceItem)].cursor() as cursor:
+            cursor.execute(sql, params)
+            return {invoice_id: totals for invoice_id, *totals in cursor.fetchall()}
+
+    def write_chunk(self, rows, line_totals):
+        """Writes the invoices whose stored totals differ; returns how many."""
+        changed = []
+        for row in rows:
+            place_of_supply = row['place_of_supply'] or (row['location__state_code'] if row['location_id'] else '29')
+            customer_gstin = row['customer_gstin'] or row['buyer__gstin'] or row['location__gstin']
+            taxable, tax, half_tax = (Decimal(paise) / 100 for paise in line_totals.get(row['pk'], (0, 0, 0)))
+
+            charges = row['transportcharges__charges']
+            if charges and charges > 0:
+                transport_tax = (charges * TRANSPORT_GST_RATE).quantize(TWO_PLACES)
+                taxable += charges
+                tax += transport_tax
+                half_tax += (transport_tax / Decimal('2.00')).quantize(TWO_PLACES)
+
+            values = {'place_of_supply': place_of_supply, 'customer_gstin': customer_gstin, 'total': taxable + tax}
+            if place_of_supply != self.company_state:
+                values.update(cgst_total=Decimal('0.00'), sgst_total=Decimal('0.00'), igst_total=tax)
+            else:
+                values.update(cgst_total=half_tax, sgst_total=half_tax, igst_total=Decimal('0.00'))
+            if row['amount_in_words'] and all(row[name] == value for name, value in values.items()):
+                continue
+
+            invoice = SalesInvoice(pk=row['pk'], tax_amount_in_words=row['tax_amount_in_words'], **values)
+            invoice.set_amounts_in_words(tax)
+            changed.append(invoice)
+            if self.list_changes:
+                self.stdout.write(f"  Invoice {invoice.pk}: total {row['total']} -> {invoice.total}")
+
+        if changed and not self.dry_run:
+            with transaction.atomic():
+                SalesInvoice.all_objects.bulk_update(changed, GST_TOTAL_FIELDS, batch_size=self.batch_size)
+        return len(changed)
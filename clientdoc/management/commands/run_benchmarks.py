@@ -0,0 +1,79 @@
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ('Runs the benchmarks/ suite on a throwaway database and compares wall time, '
+            'query count and peak memory with benchmarks/baseline.json')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, default=2000, help='Synthetic invoices seeded before the cases run')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per case (slow cases use fewer)')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--only', action='append', default=[], help='Run cases whose name contains this (repeatable)')
+        parser.add_argument('--output', default=os.path.join(settings.BASE_DIR, 'bench_results.json'),
+                            help='Where to write this run\'s results')
+        parser.add_argument('--baseline', default=None, help='Baseline to compare with (default benchmarks/baseline.json)')
+        parser.add_argument('--update-baseline', action='store_true', help='Store this run as the new baseline')
+        parser.add_argument('--time-ratio', type=float, default=None, help='Allowed slowdown, e.g. 1.3 for +30%%')
+        parser.add_argument('--memory-ratio', type=float, default=None, help='Allowed peak memory growth, e.g. 1.3')
+        parser.add_argument('--extra-queries', type=int, default=None, help='Allowed additional queries per case')
+        parser.add_argument('--no-fail', action='store_true', help='Report regressions without a non-zero exit')
+        parser.add_argument('--list', action='store_true', help='List the cases and exit')
+        parser.add_argument('--contention', type=float, nargs='?', const=3.0, default=None, metavar='SECONDS',
+                            help='Instead of the cases, compare reader latency under a concurrent importer per SQLite profile')
+
+    def handle(self, *args, **options):
+        # Lives next to manage.py rather than in the app, so it is imported only when used
+        from benchmarks.cases import select_cases
+        from benchmarks.runner import BASELINE_PATH, compare, load_baseline, run_suite, save_results, update_baseline
+
+        if options['contention'] is not None:
+            from benchmarks.contention import PROFILES, format_contention, run_contention
+            for profile in PROFILES:
+                self.stdout.write(format_contention(run_contention(profile, seconds=options['contention'])))
+            return
+
+        cases = select_cases(options['only'])
+        if options['list']:
+            for case in cases:
+                self.stdout.write(case.name)
+            return
+        if not cases:
+            raise CommandError(f"No benchmark matches {options['only']}")
+
+        self.stdout.write(f"{'case':<44}{'median':>11}{'queries':>10}{'peak mem':>12}")
+        results = run_suite(cases, options['scale'], repeat=options['repeat'], seed=options['seed'], progress=self.stdout.write)
+        save_results(results, options['output'])
+        self.stdout.write(f"Results written to {options['output']}")
+
+        baseline_path = options['baseline'] or BASELINE_PATH
+        baseline = load_baseline(baseline_path)
+        if options['update_baseline']:
+            # A partial run (--only) replaces just the cases it ran
+            update_baseline(results, baseline_path, merge=bool(options['only']))
+            self.stdout.write(self.style.SUCCESS(f"Baseline updated: {baseline_path}"))
+            return
+        if not baseline:
+            self.stdout.write(self.style.WARNING(f"No baseline at {baseline_path}; run with --update-baseline to create one."))
+            return
+        if baseline.get('meta', {}).get('scale') != options['scale']:
+            self.stdout.write(self.style.WARNING(
+                f"Baseline was recorded at scale {baseline.get('meta', {}).get('scale')}, this run used {options['scale']}."
+            ))
+
+        thresholds = {key: options[key] for key in ('time_ratio', 'memory_ratio', 'extra_queries') if options[key] is not None}
+        report = compare(results, baseline, thresholds)
+        regressions = [entry for entry in report if entry[1] == 'regressed']
+        for name, status, notes in report:
+            if status == 'regressed':
+                self.stdout.write(self.style.ERROR(f"REGRESSED {name}: {'; '.join(notes)}"))
+            elif status == 'faster':
+                self.stdout.write(self.style.SUCCESS(f"faster    {name}: {'; '.join(notes)}"))
+            elif status == 'new':
+                self.stdout.write(f"new       {name} (not in baseline)")
+
+        if regressions and not options['no_fail']:
+            raise CommandError(f"{len(regressions)} of {len(report)} benchmarks regressed against {baseline_path}")
+        self.stdout.write(self.style.SUCCESS(f"{len(report) - len(regressions)} of {len(report)} benchmarks within thresholds."))
@@ -0,0 +1,277 @@
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageDraw
+from clientdoc.bulk import insert_rows
+from clientdoc.fragments import bump_versions
+from clientdoc.models import (
+    STATE_CODE_MAP, ItemCategory, Item, Buyer, StoreLocation, SalesInvoice, InvoiceItem,
+    DeliveryChallan, TransportCharges, ConfirmationDocument, PackedImage,
+)
+
+CITIES = {
+    'Karnataka': ['Bengaluru', 'Mysuru', 'Mangaluru', 'Hubballi', 'Shivamogga'],
+    'Maharashtra': ['Mumbai', 'Pune', 'Nagpur', 'Nashik'],
+    'Tamil Nadu': ['Chennai', 'Coimbatore', 'Madurai'],
+    'Kerala': ['Kochi', 'Thiruvananthapuram', 'Kozhikode'],
+    'Telangana': ['Hyderabad', 'Warangal'],
+    'Andhra Pradesh': ['Visakhapatnam', 'Vijayawada'],
+    'Delhi': ['New Delhi'],
+    'Gujarat': ['Ahmedabad', 'Surat', 'Vadodara'],
+    'West Bengal': ['Kolkata'],
+    'Uttar Pradesh': ['Lucknow', 'Noida'],
+}
+# Most business is in the home state, which decides CGST/SGST vs IGST
+STATE_WEIGHTS = {'Karnataka': 50, 'Maharashtra': 10, 'Tamil Nadu': 10, 'Kerala': 6, 'Telangana': 8,
+                 'Andhra Pradesh': 4, 'Delhi': 4, 'Gujarat': 3, 'West Bengal': 3, 'Uttar Pradesh': 2}
+CATEGORIES = ['Acrylic', 'Vinyl', 'Flex', 'Sunboard', 'Backlit', 'Canvas', 'Standee', 'Fabric']
+ITEM_KINDS = ['Printing', 'Signage', 'Banner', 'Sticker', 'Display Board', 'Poster', 'Installation']
+GST_RATES = [Decimal('0.18')] * 8 + [Decimal('0.12'), Decimal('0.05'), Decimal('0.28')]
+STATUSES = [('DRF', 10), ('DC', 15), ('TRP', 20), ('FIN', 55)]
+QUANTITIES = [1, 2, 3, 4, 5, 10, 20, 50]
+QUANTITY_WEIGHTS = [30, 20, 12, 8, 10, 10, 6, 4]
+PLACEHOLDER_IMAGES = 8
+# Fixed origin so the same seed produces the same dates on any day
+EPOCH = datetime(2024, 1, 1, 9, 0)
+TWO_PLACES = Decimal('0.01')
+
+
+LINE_FIELDS = ['invoice', 'item', 'quantity', 'price', 'description',
+               'quantity_shipped', 'quantity_billed', 'discount_type', 'discount_value', 'gst_rate']
+
+
+class Command(BaseCommand):
+    help = 'Bulk-generates a large, reproducible synthetic dataset for load and scale testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--invoices', type=int, default=10000)
+        parser.add_argument('--buyers', type=int, default=200)
+        parser.add_argument('--locations', type=int, default=1000)
+        parser.add_argument('--items', type=int, default=2000)
+        parser.add_argument('--images-per-invoice', type=float, default=0,
+                            help='Average placeholder packed images per transported/finalized invoice')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Invoices created per transaction')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--prefix', default='SYN', help='Prefix of generated names and invoice numbers')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.prefix = options['prefix']
+        self.chunk_size = options['chunk_size']
+        if SalesInvoice.all_objects.filter(app_invoice_number__startswith=f"{self.prefix}-").exists() \
+                or Buyer.all_objects.filter(name__startswith=f"{self.prefix} ").exists():
+            raise CommandError(f"Data with prefix {self.prefix!r} already exists; pass another --prefix.")
+
+        self.tz = timezone.get_current_timezone() if settings.USE_TZ else None
+        started = time.monotonic()
+        with transaction.atomic():
+            categories = self.seed_categories()
+            buyers = self.seed_buyers(options['buyers'])
+            locations = self.seed_locations(options['locations'])
+            items = self.seed_items(options['items'], categories)
+        self.stdout.write(f"Master data ready in {time.monotonic() - started:.1f}s")
+
+        images = self.placeholder_images() if options['images_per_invoice'] > 0 else []
+        # A few items and buyers account for most of the volume
+        self.rng.shuffle(items)
+        self.rng.shuffle(buyers)
+
+        total = options['invoices']
+        lines = 0
+        for offset in range(0, total, self.chunk_size):
+            count = min(self.chunk_size, total - offset)
+            with transaction.atomic():
+                lines += self.seed_invoices(offset, count, buyers, locations, items, images, options['images_per_invoice'])
+            elapsed = time.monotonic() - started
+            done = offset + count
+            self.stdout.write(f"  {done}/{total} invoices, {lines} lines ({done / elapsed:.0f} invoices/s)")
+
+        # Bulk inserts send no post_save, so cached lists and dashboards are invalidated here
+        bump_versions(ItemCategory, Item, Buyer, StoreLocation, SalesInvoice, InvoiceItem,
+                      DeliveryChallan, TransportCharges, ConfirmationDocument)
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {total} invoices with {lines} lines in {time.monotonic() - started:.1f}s (seed {options['seed']})."
+        ))
+
+    # --- Master data ---
+
+    def seed_categories(self):
+        return ItemCategory.objects.bulk_create([ItemCategory(name=f"{self.prefix} {name}") for name in CATEGORIES])
+
+    def pick_state(self):
+        states = list(STATE_WEIGHTS)
+        return self.rng.choices(states, weights=[STATE_WEIGHTS[s] for s in states])[0]
+
+    def gstin(self, state_code):
+        letters = ''.join(self.rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(5))
+        return f"{state_code}{letters}{self.rng.randint(1000, 9999)}{self.rng.choice('ABCDEFGH')}1Z{self.rng.randint(1, 9)}"
+
+    def seed_buyers(self, count):
+        buyers = []
+        for n in range(count):
+            state = self.pick_state()
+            code = STATE_CODE_MAP[state]
+            buyers.append(Buyer(
+                name=f"{self.prefix} Buyer {n:05d} Retail Pvt Ltd",
+                address=f"{self.rng.randint(1, 400)}, Industrial Area, {self.rng.choice(CITIES[state])}",
+                gstin=self.gstin(code), state=state, state_code=code,
+                pincode=str(self.rng.randint(110001, 695999)),
+            ))
+        return Buyer.objects.bulk_create(buyers, batch_size=self.chunk_size)
+
+    def seed_locations(self, count):
+        locations = []
+        for n in range(count):
+            state = self.pick_state()
+            city = self.rng.choice(CITIES[state])
+            locations.append(StoreLocation(
+                name=f"{self.prefix}-{n:05d}-{city.upper()}",
+                site_code=f"S{n:05d}",
+                address=f"Shop {self.rng.randint(1, 80)}, {self.rng.choice(['Main Road', 'Mall', 'High Street', 'Market'])}, {city}",
+                city=city, state=state, state_code=STATE_CODE_MAP[state],
+                pincode=str(self.rng.randint(110001, 695999)),
+                priority=self.rng.choice(['P1', 'P2', 'P2', 'P3', 'P3', 'P4']),
+            ))
+        return StoreLocation.objects.bulk_create(locations, batch_size=self.chunk_size)
+
+    def seed_items(self, count, categories):
+        items = []
+        for n in range(count):
+            category = self.rng.choice(categories)
+            kind = self.rng.choice(ITEM_KINDS)
+            items.append(Item(
+                name=f"{self.prefix} {kind} {n:05d}",
+                category=category,
+                description=f"{category.name.split(' ', 1)[1]} {kind.lower()}, {self.rng.randint(1, 12)}x{self.rng.randint(1, 8)} ft",
+                article_code=f"{self.prefix}{n:06d}",
+                price=Decimal(self.rng.randint(50, 25000)),
+                gst_rate=self.rng.choice(GST_RATES),
+            ))
+        return Item.objects.bulk_create(items, batch_size=self.chunk_size)
+
+    def placeholder_images(self):
+        """A handful of small JPEGs under media/ that every synthetic packed image points at."""
+        names = []
+        directory = os.path.join(str(settings.MEDIA_ROOT), 'packed_images', 'synthetic')
+        os.makedirs(directory, exist_ok=True)
+        for n in range(PLACEHOLDER_IMAGES):
+            name = f"packed_images/synthetic/placeholder_{n}.jpg"
+            path = os.path.join(str(settings.MEDIA_ROOT), name)
+            if not os.path.exists(path):
+                img = Image.new('RGB', (640, 480), (40 + n * 25, 90, 160 - n * 12))
+                draw = ImageDraw.Draw(img)
+                for k in range(0, 640, 40):
+                    draw.line([(k, 0), (640 - k, 480)], fill=(230, 230, 230), width=2)
+                draw.text((20, 20), f"Packed goods placeholder {n}", fill=(255, 255, 255))
+                img.save(path, 'JPEG', quality=80)
+            names.append(name)
+        return names
+
+    # --- Invoices ---
+
+    def pick_index(self, size):
+        # Pareto-distributed popularity: low indexes (after shuffling) are the best sellers
+        return min(size - 1, int(self.rng.paretovariate(1.16)) - 1)
+
+    def make_lines(self, items):
+        """(item, quantity, discount %) per line; most invoices have a handful, a few have dozens."""
+        count = min(60, max(1, int(self.rng.lognormvariate(1.1, 0.75))))
+        lines = []
+        for _ in range(count):
+            item = items[self.pick_index(len(items))]
+            quantity = self.rng.choices(QUANTITIES, weights=QUANTITY_WEIGHTS)[0]
+            discount = Decimal(self.rng.choice([5, 10])) if self.rng.random() < 0.15 else Decimal('0.00')
+            lines.append((item, quantity, discount))
+        return lines
+
+    def totals(self, lines, charges, inter_state):
+        """Same arithmetic as SalesInvoice.calculate_gst_totals, without a query per invoice.
+
+        Also returns the lines' taxable value, which the InvoiceItem signals would have added up.
+        """
+        cgst = sgst = igst = grand = Decimal('0.00')
+        taxed = []
+        for item, quantity, discount in lines:
+            gross = (Decimal(quantity) * item.price).quantize(TWO_PLACES)
+            taxable = gross - (gross * (discount / Decimal('100.00'))).quantize(TWO_PLACES)
+            taxed.append((max(taxable, Decimal('0.00')), item.gst_rate))
+        line_taxable = sum((taxable for taxable, _ in taxed), Decimal('0.00'))
+        if charges:
+            taxed.append((charges, Decimal('0.18')))
+        for taxable, rate in taxed:
+            tax = (taxable * rate).quantize(TWO_PLACES)
+            if inter_state:
+                igst += tax
+            else:
+                half = (tax / Decimal('2.00')).quantize(TWO_PLACES)
+                cgst += half
+                sgst += half
+            grand += taxable + tax
+        return grand, cgst, sgst, igst, line_taxable
+
+    def seed_invoices(self, offset, count, buyers, locations, items, images, images_per_invoice):
+        rng = self.rng
+        statuses = [s for s, _ in STATUSES]
+        status_weights = [w for _, w in STATUSES]
+        company_state = getattr(settings, 'COMPANY_STATE_CODE', '29')
+
+        invoices, invoice_lines, charges_list = [], [], []
+        for n in range(offset, offset + count):
+            location = rng.choice(locations)
+            buyer = buyers[self.pick_index(len(buyers))]
+            status = rng.choices(statuses, weights=status_weights)[0]
+            date = EPOCH + timedelta(minutes=rng.randint(0, 2 * 365 * 24 * 60))
+            if self.tz:
+                date = timezone.make_aware(date, self.tz)
+            lines = self.make_lines(items)
+            charges = Decimal(rng.choice([350, 500, 750, 1200, 2500])) if status in ('TRP', 'FIN') else None
+            grand, cgst, sgst, igst, line_taxable = self.totals(lines, charges, location.state_code != company_state)
+            invoices.append(SalesInvoice(
+                location=location, buyer=buyer, status=status, date=date, created_at=date,
+                app_invoice_number=f"{self.prefix}-{n + 1:07d}",
+                tally_invoice_number=f"{self.prefix}/{date:%y}/{n + 1}" if status != 'DRF' else None,
+                buyers_order_no=f"PO-{rng.randint(100000, 999999)}", buyers_order_date=date - timedelta(days=rng.randint(1, 20)),
+                delivery_note_date=date, place_of_supply=location.state_code, customer_gstin=buyer.gstin,
+                destination=location.city, dispatched_through=rng.choice(['Road', 'Courier', 'Self']),
+                total=grand, cgst_total=cgst, sgst_total=sgst, igst_total=igst,
+                # Lines go in through insert_rows, which sends no signals
+                item_count=len(lines), total_qty=sum(quantity for _, quantity, _ in lines), taxable_total=line_taxable,
+            ))
+            invoice_lines.append(lines)
+            charges_list.append(charges)
+
+        SalesInvoice.objects.bulk_create(invoices, batch_size=self.chunk_size)
+
+        line_rows, dcs, transports, confirmations = [], [], [], []
+        for invoice, lines, charges in zip(invoices, invoice_lines, charges_list):
+            for item, quantity, discount in lines:
+                line_rows.append((invoice.pk, item.pk, quantity, item.price, item.description,
+                                  quantity, quantity, 'Percentage', discount, item.gst_rate))
+            if invoice.status != 'DRF':
+                dcs.append(DeliveryChallan(invoice=invoice, date=invoice.date, created_at=invoice.date,
+                                           notes=f"Vehicle KA{rng.randint(1, 70):02d} {rng.randint(1000, 9999)}"))
+            if charges is not None:
+                transports.append(TransportCharges(invoice=invoice, date=invoice.date, created_at=invoice.date,
+                                                   charges=charges, description='Local transport'))
+                confirmations.append(ConfirmationDocument(invoice=invoice, date=invoice.date, created_at=invoice.date))
+
+        insert_rows(InvoiceItem, LINE_FIELDS, line_rows)
+        DeliveryChallan.objects.bulk_create(dcs, batch_size=self.chunk_size)
+        TransportCharges.objects.bulk_create(transports, batch_size=self.chunk_size)
+        ConfirmationDocument.objects.bulk_create(confirmations, batch_size=self.chunk_size)
+
+        if images:
+            packed = []
+            for confirmation in confirmations:
+                # Poisson-ish count around the requested average
+                for _ in range(int(rng.expovariate(1 / images_per_invoice) + 0.5)):
+                    packed.append(PackedImage(confirmation=confirmation, image=rng.choice(images),
+                                              notes=rng.choice(['', 'Front view', 'Packed and sealed', 'Label visible'])))
+            PackedImage.objects.bulk_create(packed, batch_size=self.chunk_size)
+        return len(line_rows)
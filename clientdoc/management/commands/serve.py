@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+import socket
+import signal
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from clientdoc.serving import STOP_SIGNALS, StaticMediaApplication, run_worker
+
+
+class Command(BaseCommand):
+    help = 'Runs the app on the waitress WSGI server with several workers and threads (use instead of runserver)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default=getattr(settings, 'SERVE_HOST', '127.0.0.1'), help='Address to listen on')
+        parser.add_argument('--port', type=int, default=getattr(settings, 'SERVE_PORT', 8000))
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'SERVE_WORKERS', 1),
+                            help='Worker processes (POSIX only; Windows runs one)')
+        parser.add_argument('--threads', type=int, default=getattr(settings, 'SERVE_THREADS', 8),
+                            help='Request threads per worker')
+        parser.add_argument('--graceful-timeout', type=float, default=getattr(settings, 'SERVE_GRACEFUL_TIMEOUT', 30),
+                            help='Seconds running requests get to finish on shutdown')
+        parser.add_argument('--no-static', action='store_true', help='Leave static and media files to a front-end server')
+
+    def handle(self, *args, **options):
+        try:
+            from waitress.server import create_server
+        except ImportError:
+            raise CommandError("waitress is not installed: pip install -r requirements.txt")
+        from transol.wsgi import application
+
+        workers = max(1, options['workers'])
+        if workers > 1 and not hasattr(os, 'fork'):
+            self.stderr.write(self.style.WARNING(f"{workers} workers need fork(); running 1 worker with {options['threads']} threads."))
+            workers = 1
+        if not options['no_static']:
+            application = StaticMediaApplication(application)
+
+        family = socket.AF_INET6 if ':' in options['host'] else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind((options['host'], options['port']))
+        except OSError as e:
+            raise CommandError(f"Cannot listen on {options['host']}:{options['port']}: {e}")
+        sock.listen(1024)
+
+        def start():
+            # Each worker makes its own server (and thread pool) on the shared socket
+            return create_server(application, sockets=[sock], threads=options['threads'],
+                                 ident='transol', clear_untrusted_proxy_headers=True)
+
+        self.stdout.write(
+            f"Serving on http://{options['host']}:{options['port']} with {workers} worker(s) x {options['threads']} threads. "
+            "Ctrl+C to stop."
+        )
+        if workers == 1:
+            run_worker(start(), options['graceful_timeout'])
+        else:
+            self.supervise(start, workers, options['graceful_timeout'])
+        self.stdout.write("Stopped.")
+
+    def supervise(self, start, workers, graceful_timeout):
+        """Forks the workers, restarts any that die, and stops them all on a stop signal."""
+        # Forked children must not share the parent's database connections
+        connections.close_all()
+        children = {}
+        stopping = []
+
+        def spawn():
+            pid = os.fork()
+            if pid == 0:
+                code = 0
+                try:
+                    run_worker(start(), graceful_timeout)
+                except BaseException as e:
+                    sys.stderr.write(f"Worker {os.getpid()} failed: {e}\n")
+                    code = 1
+                finally:
+                    os._exit(code)
+            children[pid] = time.monotonic()
+
+        for signum in STOP_SIGNALS:
+            signal.signal(signum, lambda signum, frame: stopping.append(signum))
+        for _ in range(workers):
+            spawn()
+
+        while not stopping:
+            # Polled rather than blocking: a blocking waitpid resumes after a signal and would miss the stop
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if not pid:
+                time.sleep(0.5)
+                continue
+            started = children.pop(pid, None)
+            if started is None or stopping:
+                continue
+            self.stderr.write(self.style.WARNING(f"Worker {pid} exited ({status}); starting a new one."))
+            # A worker that dies straight away would otherwise be restarted in a tight loop
+            if time.monotonic() - started < 1:
+                time.sleep(1)
+            spawn()
+
+        self.stdout.write(f"Stopping {len(children)} worker(s)...")
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + graceful_timeout + 5
+        while children and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                children.pop(pid, None)
+            else:
+                time.sleep(0.1)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
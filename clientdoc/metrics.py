@@ -0,0 +1,307 @@
+# clientdoc/metrics.py
+"""Prometheus metrics shared by every worker process.
+
+Counters and histograms are declared below. Each process buffers its
+increments in memory and adds them to a small SQLite file (METRICS_DB) at
+most every METRICS_FLUSH_SECONDS, on every scrape and at exit, so /metrics
+reports the totals of all workers rather than of whichever one served the
+scrape. The file only holds running totals; deleting it resets them.
+"""
+
+import os
+import time
+import atexit
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from .routers import execute_wrapper
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RENDER_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+BYTES_BUCKETS = (64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2, 256 * 1024 ** 2)
+PAGES_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 1000)
+RATE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+KNOWN_METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _format_le(bound):
+    return _format_value(bound) if bound != float('inf') else '+Inf'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def label_text(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return ','.join(f'{name}="{_escape(labels[name])}"' for name in self.labelnames)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        _store.add(self.name, self.label_text(labels), '', amount)
+
+    def expose(self, samples):
+        lines = []
+        for labels, by_le in sorted(samples.get(self.name, {}).items()):
+            lines.append(f"{self.name}{{{labels}}} {_format_value(by_le[''])}" if labels
+                         else f"{self.name} {_format_value(by_le[''])}")
+        return lines
+
+
+class Histogram(Metric):
+    """Buckets are stored non-cumulatively and summed up when exposed."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=SECONDS_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(float(b) for b in buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        label_text = self.label_text(labels)
+        bound = next(b for b in self.buckets if value <= b)
+        _store.add(f"{self.name}_bucket", label_text, _format_le(bound), 1)
+        _store.add(f"{self.name}_sum", label_text, '', value)
+        _store.add(f"{self.name}_count", label_text, '', 1)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def expose(self, samples):
+        lines = []
+        buckets = samples.get(f"{self.name}_bucket", {})
+        sums = samples.get(f"{self.name}_sum", {})
+        counts = samples.get(f"{self.name}_count", {})
+        for labels in sorted(counts):
+            prefix = f"{labels}," if labels else ''
+            cumulative = 0
+            for bound in self.buckets:
+                le = _format_le(bound)
+                cumulative += buckets.get(labels, {}).get(le, 0)
+                lines.append(f'{self.name}_bucket{{{prefix}le="{le}"}} {_format_value(cumulative)}')
+            suffix = f"{{{labels}}}" if labels else ''
+            lines.append(f"{self.name}_sum{suffix} {_format_value(sums.get(labels, {}).get('', 0))}")
+            lines.append(f"{self.name}_count{suffix} {_format_value(counts[labels][''])}")
+        return lines
+
+
+class _Store:
+    """Per-process buffer of increments in front of the shared SQLite file."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.pid = os.getpid()
+        self.db = self.db_path = None
+        self.last_flush = time.monotonic()
+
+    def _check_fork(self):
+        # A forked worker inherits the parent's buffer; the parent flushes that itself
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.pending = {}
+            self.db = None
+
+    def _connect(self):
+        path = str(getattr(settings, 'METRICS_DB', os.path.join(settings.BASE_DIR, 'metrics.sqlite3')))
+        if self.db is not None and self.db_path != path:
+            self.db.close()
+            self.db = None
+        if self.db is None:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            db = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS samples ('
+                       'name TEXT NOT NULL, labels TEXT NOT NULL, le TEXT NOT NULL, value REAL NOT NULL, '
+                       'PRIMARY KEY (name, labels, le))')
+            self.db, self.db_path = db, path
+        return self.db
+
+    def add(self, name, labels, le, amount):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            return
+        with self.lock:
+            self._check_fork()
+            key = (name, labels, le)
+            self.pending[key] = self.pending.get(key, 0) + amount
+            due = time.monotonic() - self.last_flush >= getattr(settings, 'METRICS_FLUSH_SECONDS', 5)
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            self._check_fork()
+            self.last_flush = time.monotonic()
+            if not self.pending:
+                return
+            pending, self.pending = self.pending, {}
+            try:
+                db = self._connect()
+                db.execute('BEGIN IMMEDIATE')
+                db.executemany(
+                    'INSERT INTO samples (name, labels, le, value) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (name, labels, le) DO UPDATE SET value = value + excluded.value',
+                    [(name, labels, le, value) for (name, labels, le), value in pending.items()],
+                )
+                db.execute('COMMIT')
+            except sqlite3.Error as e:
+                # Keep the increments for the next flush rather than losing them
+                logger.warning(f"Could not write metrics to {getattr(settings, 'METRICS_DB', 'metrics.sqlite3')}: {e}")
+                if self.db is not None and self.db.in_transaction:
+                    self.db.execute('ROLLBACK')
+                for key, value in pending.items():
+                    self.pending[key] = self.pending.get(key, 0) + value
+
+    def samples(self):
+        """{name: {labels: {le: value}}} of all processes' flushed totals."""
+        self.flush()
+        samples = {}
+        with self.lock:
+            rows = self._connect().execute('SELECT name, labels, le, value FROM samples').fetchall()
+        for name, labels, le, value in rows:
+            samples.setdefault(name, {}).setdefault(labels, {})[le] = value
+        return samples
+
+
+REGISTRY = []
+_store = _Store()
+atexit.register(_store.flush)
+
+
+def flush():
+    """Writes this process's buffered increments to METRICS_DB now."""
+    _store.flush()
+
+
+def exposition():
+    """All metrics in the Prometheus text format."""
+    samples = _store.samples()
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.expose(samples))
+    return '\n'.join(lines) + '\n'
+
+
+# --- Metrics ---
+
+request_seconds = Histogram(
+    'clientdoc_request_duration_seconds', 'Wall time of requests by view.',
+    ('view', 'method', 'status'),
+)
+request_queries = Histogram(
+    'clientdoc_request_queries', 'Database queries per request by view.',
+    ('view', 'method'), buckets=QUERY_BUCKETS,
+)
+pdf_render_seconds = Histogram(
+    'clientdoc_pdf_render_seconds', 'Time to render a generated PDF section (generate_*_pdf).',
+    ('document', 'engine'), buckets=RENDER_BUCKETS,
+)
+render_cache_lookups = Counter(
+    'clientdoc_render_cache_lookups_total', 'Rendered-section cache lookups; hit/(hit+miss) is the hit ratio.',
+    ('document', 'result'),
+)
+fragment_cache_lookups = Counter(
+    'clientdoc_fragment_cache_lookups_total', 'Cached page fragment lookups (lists, dashboard, print views).',
+    ('fragment', 'result'),
+)
+finalize_seconds = Histogram(
+    'clientdoc_finalize_duration_seconds', 'Time to build a finalized bundle, queueing excluded.',
+    ('result',), buckets=RENDER_BUCKETS,
+)
+render_queue_wait_seconds = Histogram(
+    'clientdoc_render_queue_wait_seconds', 'Time renders waited for a render slot.',
+    ('kind',), buckets=RENDER_BUCKETS,
+)
+bundle_bytes = Histogram(
+    'clientdoc_bundle_bytes', 'Size of written combined PDF bundles.',
+    buckets=BYTES_BUCKETS,
+)
+bundle_pages = Histogram(
+    'clientdoc_bundle_pages', 'Page count of written combined PDF bundles.',
+    buckets=PAGES_BUCKETS,
+)
+bundle_sections = Counter(
+    'clientdoc_bundle_sections_total', 'Bundle sections copied from the previous bundle (reused) or built again.',
+    ('result',),
+)
+bundle_requests = Counter(
+    'clientdoc_bundle_requests_total', 'Bundle requests; "current" means the stored bundle was already up to date.',
+    ('result',),
+)
+import_rows = Counter(
+    'clientdoc_import_rows_total', 'Spreadsheet rows read by bulk invoice imports.',
+)
+import_groups = Counter(
+    'clientdoc_import_groups_total', 'Invoice groups of bulk imports by outcome.',
+    ('result',),
+)
+import_rows_per_second = Histogram(
+    'clientdoc_import_rows_per_second', 'Throughput of bulk invoice imports.',
+    buckets=RATE_BUCKETS,
+)
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    """Records each request's latency and query count by view (METRICS_ENABLED); place it first."""
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = _QueryCounter()
+        started = time.perf_counter()
+        status = '5xx'
+        try:
+            with execute_wrapper(queries):
+                response = self.get_response(request)
+            status = f"{response.status_code // 100}xx"
+            return response
+        finally:
+            # Unresolved paths share one label so scanners can't grow the series without bound
+            match = getattr(request, 'resolver_match', None)
+            view = match.view_name if match is not None else 'unmatched'
+            method = request.method if request.method in KNOWN_METHODS else 'other'
+            request_seconds.observe(time.perf_counter() - started, view=view, method=method, status=status)
+            request_queries.observe(queries.count, view=view, method=method)
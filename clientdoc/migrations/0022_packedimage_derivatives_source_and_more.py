@@ -0,0 +1,28 @@
+# Generated by Django 4.2.23 on 2026-10-19 07:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clientdoc', '0021_invoiceitem_description'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='packedimage',
+            name='derivatives_source',
+            field=models.CharField(blank=True, editable=False, help_text='Image name the derivatives were built from', max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='packedimage',
+            name='print_image',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='packed_images/print/'),
+        ),
+        migrations.AddField(
+            model_name='packedimage',
+            name='thumbnail',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='packed_images/thumbs/'),
+        ),
+    ]
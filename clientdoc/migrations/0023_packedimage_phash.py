@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-19 07:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clientdoc', '0022_packedimage_derivatives_source_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='packedimage',
+            name='phash',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='Perceptual (difference) hash used to spot duplicate photos', max_length=16, null=True),
+        ),
+    ]
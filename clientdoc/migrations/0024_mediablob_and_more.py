@@ -0,0 +1,45 @@
+# Generated by Django 4.2.23 on 2026-10-19 07:54
+
+import clientdoc.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clientdoc', '0023_packedimage_phash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.BigIntegerField(default=0)),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='confirmationdocument',
+            name='approval_email_file',
+            field=models.FileField(blank=True, null=True, storage=clientdoc.storage.get_blob_storage, upload_to='confirmation_docs/email/', verbose_name='Approval Email PDF'),
+        ),
+        migrations.AlterField(
+            model_name='confirmationdocument',
+            name='po_file',
+            field=models.FileField(blank=True, null=True, storage=clientdoc.storage.get_blob_storage, upload_to='confirmation_docs/po/', verbose_name='PO Copy'),
+        ),
+        migrations.AlterField(
+            model_name='confirmationdocument',
+            name='uploaded_dc',
+            field=models.FileField(blank=True, null=True, storage=clientdoc.storage.get_blob_storage, upload_to='confirmation_docs/dc/', verbose_name='Custom DC PDF'),
+        ),
+        migrations.AlterField(
+            model_name='confirmationdocument',
+            name='uploaded_invoice',
+            field=models.FileField(blank=True, null=True, storage=clientdoc.storage.get_blob_storage, upload_to='confirmation_docs/inv/', verbose_name='Custom Invoice PDF'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.23 on 2026-10-19 07:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clientdoc', '0024_mediablob_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='confirmationdocument',
+            name='bundle_fingerprint',
+            field=models.CharField(blank=True, editable=False, help_text='Fingerprint of the inputs the combined PDF was built from (used as its ETag)', max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='confirmationdocument',
+            name='bundle_generated_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
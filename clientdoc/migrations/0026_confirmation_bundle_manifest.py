@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-19 07:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clientdoc', '0025_confirmation_bundle_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='confirmationdocument',
+            name='bundle_manifest',
+            field=models.JSONField(blank=True, editable=False, help_text='Sections of the combined PDF with their fingerprints and page ranges', null=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.23 on 2026-10-19 08:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clientdoc', '0026_confirmation_bundle_manifest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenderJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('PEN', 'Pending'), ('RUN', 'Running'), ('DON', 'Done'), ('ERR', 'Failed')], db_index=True, default='PEN', max_length=3)),
+                ('run_after', models.DateTimeField(db_index=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('invoice', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='render_job', to='clientdoc.salesinvoice')),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.23 on 2026-10-19 08:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clientdoc', '0027_renderjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenderLease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('fingerprint', models.CharField(blank=True, default='', max_length=64)),
+                ('holder', models.CharField(max_length=32)),
+                ('acquired_at', models.DateTimeField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.23 on 2026-10-19 08:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clientdoc', '0028_renderlease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenderTicket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('FIN', 'Finalize'), ('BLK', 'Bulk Upload'), ('PRE', 'Pre-render')], max_length=3)),
+                ('status', models.CharField(choices=[('WAI', 'Queued'), ('RUN', 'Rendering'), ('DON', 'Done'), ('ERR', 'Failed'), ('ABN', 'Abandoned')], db_index=True, default='WAI', max_length=3)),
+                ('params', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_seen_at', models.DateTimeField(auto_now_add=True, help_text='Last time the waiting client polled')),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('wait_seconds', models.FloatField(blank=True, null=True)),
+                ('render_seconds', models.FloatField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('invoice', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='clientdoc.salesinvoice')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RenderSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField(unique=True)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('ticket', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='clientdoc.renderticket')),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.23 on 2026-10-19 08:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clientdoc', '0029_render_admission'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('trigger', models.CharField(choices=[('HDR', 'Header'), ('QRY', 'Query flag'), ('SMP', 'Sampled')], max_length=3)),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.CharField(max_length=500)),
+                ('view_name', models.CharField(blank=True, default='', max_length=100)),
+                ('status_code', models.PositiveIntegerField(blank=True, null=True)),
+                ('duration_ms', models.FloatField()),
+                ('query_count', models.PositiveIntegerField(default=0)),
+                ('file_name', models.CharField(max_length=100)),
+                ('invoice', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='clientdoc.salesinvoice')),
+            ],
+        ),
+    ]
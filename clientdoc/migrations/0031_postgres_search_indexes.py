@@ -0,0 +1,54 @@
+from django.db import migrations
+
+# List search runs icontains (UPPER(col::text) LIKE UPPER('%q%')) over these columns; trigram GIN
+# indexes on the same expression serve it. Only created on PostgreSQL (pg_trgm); other backends skip.
+TRIGRAM_COLUMNS = {
+    'clientdoc_salesinvoice': ['tally_invoice_number', 'app_invoice_number'],
+    'clientdoc_storelocation': ['name', 'address', 'city', 'gstin', 'site_code'],
+    'clientdoc_item': ['name', 'description'],
+    'clientdoc_buyer': ['name', 'address', 'gstin', 'state'],
+    'clientdoc_transportcharges': ['description'],
+}
+
+# Spreadsheet imports look these up with iexact (UPPER(col::text) = UPPER('q'))
+UPPER_COLUMNS = {
+    'clientdoc_salesinvoice': ['tally_invoice_number'],
+    'clientdoc_storelocation': ['name'],
+    'clientdoc_item': ['name'],
+    'clientdoc_buyer': ['name'],
+}
+
+
+def _indexes():
+    for table, columns in TRIGRAM_COLUMNS.items():
+        for column in columns:
+            yield f"{table}_{column}_trgm", f'ON "{table}" USING gin ((UPPER("{column}"::text)) gin_trgm_ops)'
+    for table, columns in UPPER_COLUMNS.items():
+        for column in columns:
+            yield f"{table}_{column}_upper", f'ON "{table}" ((UPPER("{column}"::text)))'
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, definition in _indexes():
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS "{name}" {definition}')
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in _indexes():
+        schema_editor.execute(f'DROP INDEX IF EXISTS "{name}"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clientdoc', '0030_request_profile'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
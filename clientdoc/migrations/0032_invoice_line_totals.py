@@ -0,0 +1,46 @@
+# Generated by Django 4.2.23 on 2026-10-19 10:50
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import BigIntegerField, Count, Sum
+from clientdoc.line_totals import line_taxable_paise
+
+
+def backfill_line_totals(apps, schema_editor):
+    SalesInvoice = apps.get_model('clientdoc', 'SalesInvoice')
+    db = schema_editor.connection.alias
+    totals = list(SalesInvoice.objects.using(db).annotate(
+        count=Count('invoiceitem'),
+    ).filter(count__gt=0).annotate(
+        qty=Sum('invoiceitem__quantity'),
+        paise=Sum(line_taxable_paise('invoiceitem__'), output_field=BigIntegerField()),
+    ).values_list('pk', 'count', 'qty', 'paise').iterator())
+    invoices = [SalesInvoice(pk=pk, item_count=count, total_qty=qty, taxable_total=Decimal(paise) / 100)
+                for pk, count, qty, paise in totals]
+    SalesInvoice.objects.using(db).bulk_update(invoices, ['item_count', 'total_qty', 'taxable_total'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clientdoc', '0031_postgres_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='salesinvoice',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='salesinvoice',
+            name='taxable_total',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='salesinvoice',
+            name='total_qty',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_line_totals, migrations.RunPython.noop),
+    ]
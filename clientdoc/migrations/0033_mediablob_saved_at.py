@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-19 13:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clientdoc', '0032_invoice_line_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediablob',
+            name='saved_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
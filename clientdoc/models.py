@@ -3,10 +3,11 @@ from django.utils import timezone
 from decimal import Decimal
 from django.db.models import Max 
 from django.db.models import Sum 
+from django.db.models.functions import Length
 from django.db import transaction 
-from num2words import num2words # New library
 from django.conf import settings
 from .constants import INDIAN_STATE_CODES
+from .storage import get_blob_storage
 
 
 class SoftDeleteManager(models.Manager):
@@ -187,6 +188,16 @@ class Item(SoftDeleteModel):
 
 # --- INVOICE AND RELATED MODELS ---
 
+# Fields calculate_gst_totals fills in
+GST_TOTAL_FIELDS = ('place_of_supply', 'customer_gstin', 'cgst_total', 'sgst_total', 'igst_total', 'total',
+                    'amount_in_words', 'tax_amount_in_words')
+
+# GST on transport charges (the standard service rate)
+TRANSPORT_GST_RATE = Decimal('0.18')
+
+# Line aggregates kept by the InvoiceItem signals (see line_totals.py), never by SalesInvoice.save
+LINE_TOTAL_FIELDS = ('item_count', 'total_qty', 'taxable_total')
+
 class SalesInvoice(SoftDeleteModel):
     STATUS_CHOICES = [
         ('DRF', 'Draft (Invoice Created)'),
@@ -230,9 +241,20 @@ class SalesInvoice(SoftDeleteModel):
     # Store calculated Words
     amount_in_words = models.CharField(max_length=255, blank=True, null=True)
     tax_amount_in_words = models.CharField(max_length=255, blank=True, null=True)
+
+    # Denormalized from the lines: count, quantity and taxable value (LINE_TOTAL_FIELDS)
+    item_count = models.PositiveIntegerField(default=0)
+    total_qty = models.IntegerField(default=0)
+    taxable_total = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
         
-    def calculate_gst_totals(self):
-        """Calculates Taxes based on Place of Supply vs Company State."""
+    def calculate_gst_totals(self, only_if_changed=False):
+        """Calculates Taxes based on Place of Supply vs Company State.
+
+        only_if_changed (the print views) saves just the computed fields, and only when they
+        differ, so looking at an invoice doesn't count as editing it and invalidate cached lists.
+        The line totals come out of the same pass over the lines and are saved with them.
+        """
+        before = {name: getattr(self, name) for name in GST_TOTAL_FIELDS + LINE_TOTAL_FIELDS}
         # 1. Fetch Company State
         company_state_code = getattr(settings, 'COMPANY_STATE_CODE', '29')
         # Check specific model if available override
@@ -263,9 +285,14 @@ class SalesInvoice(SoftDeleteModel):
         total_igst = Decimal('0.00')
         grand_total = Decimal('0.00')
         total_tax = Decimal('0.00')
+        item_count = total_qty = 0
+        taxable_total = Decimal('0.00')
 
-        for item in self.invoiceitem_set.all():
+        for item in self.invoiceitem_set.select_related('item'):
             taxable = item.taxable_value
+            item_count += 1
+            total_qty += item.quantity
+            taxable_total += taxable
             gst_rate = item.item.gst_rate # Use item rate or snapshot?? Models say calculate_total used snapshot.
             # Use snapshot if available
             if item.gst_rate is not None:
@@ -287,10 +314,8 @@ class SalesInvoice(SoftDeleteModel):
         if hasattr(self, 'transportcharges'):
             trp = self.transportcharges
             if trp and trp.charges > 0:
-                # Assuming 18% GST on Transport for now (Standard Service Rate)
-                # Or check if specific config exists. User said "along with gst".
                 trp_taxable = trp.charges
-                trp_gst_rate = Decimal('0.18') 
+                trp_gst_rate = TRANSPORT_GST_RATE
                 
                 trp_tax_amt = (trp_taxable * trp_gst_rate).quantize(Decimal('0.01'))
                 
@@ -308,24 +333,43 @@ class SalesInvoice(SoftDeleteModel):
         self.sgst_total = total_sgst
         self.igst_total = total_igst
         self.total = grand_total
+        self.item_count, self.total_qty, self.taxable_total = item_count, total_qty, taxable_total
         
-        # Word Conversion
+        self.set_amounts_in_words(total_tax)
+
+        from .line_totals import settle_line_totals
+        settle_line_totals(self.pk)
+        if self.pk is None:
+            self.save()
+        elif not only_if_changed:
+            self.save(update_fields=self._saved_fields() + list(LINE_TOTAL_FIELDS))
+        else:
+            changed = [name for name in before if getattr(self, name) != before[name]]
+            if changed:
+                self.save(update_fields=changed)
+
+    def set_amounts_in_words(self, total_tax):
+        """Fills the printed "INR ... Only" lines from self.total and total_tax."""
+        from num2words import num2words
         try:
              self.amount_in_words = "INR " + num2words(self.total, lang='en_IN').title() + " Only"
              self.tax_amount_in_words = "INR " + num2words(total_tax, lang='en_IN').title() + " Only"
         except Exception:
              self.amount_in_words = "Error generating words"
 
-        self.save()
-
     def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            # A stale in-memory copy must not overwrite line totals the signals have moved on
+            kwargs['update_fields'] = self._saved_fields()
         if not self.app_invoice_number:
             # FIX: Robust sequential number generation with retry logic
             for attempt in range(5): # Retry up to 5 times
                 try:
                     with transaction.atomic():
-                        # Find the highest existing app_invoice_number sequence
-                        last_invoice = SalesInvoice.all_objects.all().order_by('-app_invoice_number').only('app_invoice_number').first()
+                        # Find the highest existing app_invoice_number sequence. Longest first, so Tsol-100000
+                        # beats Tsol-99999, and only Tsol- numbers (PostgreSQL sorts NULLs first on DESC)
+                        last_invoice = SalesInvoice.all_objects.filter(app_invoice_number__startswith='Tsol-').order_by(
+                            Length('app_invoice_number').desc(), '-app_invoice_number').only('app_invoice_number').first()
                         
                         new_seq = 1
                         if last_invoice and last_invoice.app_invoice_number:
@@ -344,6 +388,11 @@ class SalesInvoice(SoftDeleteModel):
         else:
             super().save(*args, **kwargs)
 
+    def _saved_fields(self):
+        deferred = self.get_deferred_fields()
+        return [f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in LINE_TOTAL_FIELDS and f.attname not in deferred]
+
     def calculate_total(self):
         """Wrapper for new calculate_gst_totals to maintain compatibility."""
         self.calculate_gst_totals()
@@ -367,7 +416,7 @@ class InvoiceItem(models.Model):
     quantity = models.IntegerField(default=1)
     
     # Snapshot fields for historical accuracy
-    price = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    price = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
     description = models.TextField(blank=True, null=True, verbose_name="Item Description (Snapshot)")
     quantity_shipped = models.IntegerField(default=1)
     quantity_billed = models.IntegerField(default=1)
@@ -377,7 +426,7 @@ class InvoiceItem(models.Model):
         ('Amount', 'Amount (Fixed)'),
     ]
     discount_type = models.CharField(max_length=20, choices=DISCOUNT_CHOICES, default='Percentage')
-    discount_value = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    discount_value = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
 
     GST_CHOICES = [
         (Decimal('0.00'), '0%'),
@@ -452,16 +501,19 @@ class ConfirmationDocument(SoftDeleteModel):
     date = models.DateTimeField(default=timezone.now) 
     created_at = models.DateTimeField(default=timezone.now)
     
-    # Uploaded Documents
-    po_file = models.FileField(upload_to='confirmation_docs/po/', blank=True, null=True, verbose_name="PO Copy")
-    approval_email_file = models.FileField(upload_to='confirmation_docs/email/', blank=True, null=True, verbose_name="Approval Email PDF")
+    # Uploaded Documents (content-addressed: a PO shared by many invoices is stored once)
+    po_file = models.FileField(upload_to='confirmation_docs/po/', storage=get_blob_storage, blank=True, null=True, verbose_name="PO Copy")
+    approval_email_file = models.FileField(upload_to='confirmation_docs/email/', storage=get_blob_storage, blank=True, null=True, verbose_name="Approval Email PDF")
     
     # Custom Uploads (Overrides generated ones if present)
-    uploaded_invoice = models.FileField(upload_to='confirmation_docs/inv/', blank=True, null=True, verbose_name="Custom Invoice PDF")
-    uploaded_dc = models.FileField(upload_to='confirmation_docs/dc/', blank=True, null=True, verbose_name="Custom DC PDF")
+    uploaded_invoice = models.FileField(upload_to='confirmation_docs/inv/', storage=get_blob_storage, blank=True, null=True, verbose_name="Custom Invoice PDF")
+    uploaded_dc = models.FileField(upload_to='confirmation_docs/dc/', storage=get_blob_storage, blank=True, null=True, verbose_name="Custom DC PDF")
 
     # Final Output
     combined_pdf = models.FileField(upload_to='confirmations/', blank=True, null=True)
+    bundle_fingerprint = models.CharField(max_length=64, blank=True, null=True, editable=False, help_text="Fingerprint of the inputs the combined PDF was built from (used as its ETag)")
+    bundle_generated_at = models.DateTimeField(blank=True, null=True, editable=False)
+    bundle_manifest = models.JSONField(blank=True, null=True, editable=False, help_text="Sections of the combined PDF with their fingerprints and page ranges")
     
     def __str__(self):
         return f"Confirmation for Invoice {self.invoice.id}"
@@ -471,11 +523,30 @@ class PackedImage(models.Model):
     confirmation = models.ForeignKey(ConfirmationDocument, on_delete=models.CASCADE, null=True) 
     image = models.ImageField(upload_to='packed_images/')
     notes = models.TextField(blank=True, null=True, verbose_name="Image Notes") 
+    
+    # Derivatives (see clientdoc.images): downscaled JPEG for the PDF slot and a UI thumbnail
+    print_image = models.ImageField(upload_to='packed_images/print/', blank=True, null=True, editable=False)
+    thumbnail = models.ImageField(upload_to='packed_images/thumbs/', blank=True, null=True, editable=False)
+    derivatives_source = models.CharField(max_length=255, blank=True, null=True, editable=False, help_text="Image name the derivatives were built from")
+    phash = models.CharField(max_length=16, blank=True, null=True, editable=False, db_index=True, help_text="Perceptual (difference) hash used to spot duplicate photos")
 
     def __str__(self):
         invoice_id = self.confirmation.invoice.id if self.confirmation and self.confirmation.invoice else "N/A"
         return f"Image for Confirmation {invoice_id}"
 
+class MediaBlob(models.Model):
+    """One stored file in the content-addressed storage, with the number of FileField values pointing at it."""
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField(default=0)
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Last upload of this content; the blob is kept for MEDIA_BLOB_GRACE_SECONDS after it
+    saved_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount} refs)"
+
 class BulkInvoiceUpload(models.Model):
     """Tracks bulk excel uploads for invoice generation."""
     file = models.FileField(upload_to='bulk_uploads/')
@@ -484,4 +555,100 @@ class BulkInvoiceUpload(models.Model):
     log = models.TextField(blank=True, null=True, help_text="Log of success/errors during processing")
 
     def __str__(self):
-        return f"Upload {self.id} at {self.uploaded_at}"
\ No newline at end of file
+        return f"Upload {self.id} at {self.uploaded_at}"
+
+class RenderJob(models.Model):
+    """Pending speculative render of an invoice's generated sections (see clientdoc.prerender).
+
+    One row per invoice: further edits push run_after back instead of queueing
+    another render, which debounces bursts of saves.
+    """
+    STATUS_CHOICES = [
+        ('PEN', 'Pending'),
+        ('RUN', 'Running'),
+        ('DON', 'Done'),
+        ('ERR', 'Failed'),
+    ]
+    invoice = models.OneToOneField(SalesInvoice, on_delete=models.CASCADE, related_name='render_job')
+    status = models.CharField(max_length=3, choices=STATUS_CHOICES, default='PEN', db_index=True)
+    run_after = models.DateTimeField(db_index=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    error = models.TextField(blank=True, default='')
+
+    def __str__(self):
+        return f"Render job for invoice {self.invoice_id} ({self.get_status_display()})"
+
+
+class RenderLease(models.Model):
+    """Exclusive, expiring claim on rendering one output (see clientdoc.leases)."""
+    key = models.CharField(max_length=100, unique=True)
+    fingerprint = models.CharField(max_length=64, blank=True, default='')
+    holder = models.CharField(max_length=32)
+    acquired_at = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.key} until {self.expires_at}"
+
+
+class RenderTicket(models.Model):
+    """A render waiting for or holding one of the global render slots (see clientdoc.admission)."""
+    KIND_CHOICES = [
+        ('FIN', 'Finalize'),
+        ('BLK', 'Bulk Upload'),
+        ('PRE', 'Pre-render'),
+    ]
+    STATUS_CHOICES = [
+        ('WAI', 'Queued'),
+        ('RUN', 'Rendering'),
+        ('DON', 'Done'),
+        ('ERR', 'Failed'),
+        ('ABN', 'Abandoned'),
+    ]
+    kind = models.CharField(max_length=3, choices=KIND_CHOICES)
+    status = models.CharField(max_length=3, choices=STATUS_CHOICES, default='WAI', db_index=True)
+    invoice = models.ForeignKey(SalesInvoice, on_delete=models.SET_NULL, null=True, blank=True)
+    params = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_seen_at = models.DateTimeField(auto_now_add=True, help_text="Last time the waiting client polled")
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    wait_seconds = models.FloatField(blank=True, null=True)
+    render_seconds = models.FloatField(blank=True, null=True)
+    error = models.TextField(blank=True, default='')
+
+    def __str__(self):
+        return f"{self.get_kind_display()} ticket {self.id} ({self.get_status_display()})"
+
+
+class RenderSlot(models.Model):
+    """One token of the render concurrency pool; held by at most one running ticket."""
+    number = models.PositiveIntegerField(unique=True)
+    ticket = models.ForeignKey(RenderTicket, on_delete=models.SET_NULL, null=True, blank=True)
+    expires_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"Render slot {self.number}"
+
+
+class RequestProfile(models.Model):
+    """A cProfile capture of one request (see clientdoc.profiling); the .prof file lives in PROFILE_DIR."""
+    TRIGGER_CHOICES = [
+        ('HDR', 'Header'),
+        ('QRY', 'Query flag'),
+        ('SMP', 'Sampled'),
+    ]
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    trigger = models.CharField(max_length=3, choices=TRIGGER_CHOICES)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    view_name = models.CharField(max_length=100, blank=True, default='')
+    invoice = models.ForeignKey(SalesInvoice, on_delete=models.SET_NULL, null=True, blank=True)
+    status_code = models.PositiveIntegerField(null=True, blank=True)
+    duration_ms = models.FloatField()
+    query_count = models.PositiveIntegerField(default=0)
+    file_name = models.CharField(max_length=100)
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
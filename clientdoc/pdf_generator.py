@@ -7,13 +7,19 @@ from reportlab.lib.enums import TA_CENTER, TA_RIGHT, TA_LEFT
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 import os
-from io import BytesIO
+import tempfile
 from decimal import Decimal
+from django.conf import settings
 
 # Register Font for INR Symbol if available
 # User requested fallback to Rs. if issues persist.
 INR_SYMBOL = 'Rs.'
 
+def new_pdf_buffer():
+    """Returns a file-like buffer that stays in memory for small PDFs and spills to a temp file above PDF_SPOOL_MAX_BYTES."""
+    max_size = getattr(settings, 'PDF_SPOOL_MAX_BYTES', 8 * 1024 * 1024)
+    return tempfile.SpooledTemporaryFile(max_size=max_size, mode='w+b')
+
 def clean(val): return str(val) if val else "-"
 def clean_date(d): return d.strftime('%d-%b-%y') if d else ""
 
@@ -127,7 +133,7 @@ def create_footer_with_signature(company, notes=""):
     return t_foot
 
 def generate_invoice_pdf(invoice, company_input):
-    buffer = BytesIO()
+    buffer = new_pdf_buffer()
     doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=10*mm, rightMargin=10*mm, topMargin=10*mm, bottomMargin=10*mm)
     elements = []
     styles = getSampleStyleSheet()
@@ -215,11 +221,12 @@ def generate_invoice_pdf(invoice, company_input):
     item_header = ['Sl No.', 'Description of Goods', 'HSN/SAC', 'Quantity', 'Rate', 'per', 'Amount']
     item_data = [item_header]
     
-    total_qty = 0
-    invoice.calculate_total()
+    invoice.calculate_gst_totals(only_if_changed=True)
+    total_qty = invoice.total_qty
+    # Fetched once with their Item rows; the tables below walk them several times
+    lines = list(invoice.invoiceitem_set.select_related('item'))
     
-    for idx, item in enumerate(invoice.invoiceitem_set.all(), 1):
-        total_qty += item.quantity
+    for idx, item in enumerate(lines, 1):
         item_data.append([
             str(idx),
             Paragraph(f"<b>{item.item.name}</b><br/>{item.description or item.item.description or ''}", style_normal),
@@ -230,7 +237,7 @@ def generate_invoice_pdf(invoice, company_input):
             f"Rs. {item.quantity * item.price}" # Snapshot price
         ])
     
-    taxable_value = sum(i.quantity * i.price for i in invoice.invoiceitem_set.all())
+    taxable_value = sum(i.quantity * i.price for i in lines)
     
     # We can't display a single rate if items have different rates. 
     # For the item table, we can show "See Tax Tbl" or the specific rate if passed.
@@ -249,7 +256,7 @@ def generate_invoice_pdf(invoice, company_input):
         trp = invoice.transportcharges
         trp_val = trp.charges
         item_data.append([
-            str(len(invoice.invoiceitem_set.all()) + 1),
+            str(len(lines) + 1),
             Paragraph(f"<b>Transport Charges</b><br/>{trp.description or ''}", style_normal),
             '997619',
             "1",
@@ -297,7 +304,7 @@ def generate_invoice_pdf(invoice, company_input):
     ]
     
     hsn_map = {} 
-    for item in invoice.invoiceitem_set.all():
+    for item in lines:
         h = item.item.hsn_sac
         val = item.quantity * item.price
         rate = item.gst_rate
@@ -355,7 +362,7 @@ def generate_invoice_pdf(invoice, company_input):
     return buffer
 
 def generate_dc_pdf(invoice, dc, company_input):
-    buffer = BytesIO()
+    buffer = new_pdf_buffer()
     doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=10*mm, rightMargin=10*mm, topMargin=10*mm, bottomMargin=10*mm)
     elements = []
     styles = getSampleStyleSheet()
@@ -420,9 +427,8 @@ def generate_dc_pdf(invoice, dc, company_input):
     # Items
     item_header = ['Sl No', 'Description of Goods', 'HSN/SAC', 'Quantity', 'Remarks']
     item_data = [item_header]
-    total_qty = 0
-    for idx, item in enumerate(invoice.invoiceitem_set.all(), 1):
-        total_qty += item.quantity
+    total_qty = invoice.total_qty
+    for idx, item in enumerate(invoice.invoiceitem_set.select_related('item'), 1):
         item_data.append([
             str(idx),
             Paragraph(f"<b>{item.item.name}</b><br/>{item.item.description or ''}", style_normal),
@@ -518,7 +524,7 @@ def generate_dc_pdf(invoice, dc, company_input):
     return buffer
 
 def generate_transport_pdf(invoice, transport, company_input):
-    buffer = BytesIO()
+    buffer = new_pdf_buffer()
     doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=10*mm, rightMargin=10*mm, topMargin=10*mm, bottomMargin=10*mm)
     elements = []
     styles = getSampleStyleSheet()
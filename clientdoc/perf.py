@@ -0,0 +1,48 @@
+# clientdoc/perf.py
+"""Small measurement helpers for performance checks (memory, timing)."""
+
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+
+def _max_rss_bytes():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def measure_peak_memory(func, *args, **kwargs):
+    """Runs func and returns (result, stats).
+
+    stats['peak_traced_bytes'] is the peak Python heap allocated while func ran
+    (buffers, PDF bytes, images). stats['max_rss_bytes'] is the process high-water
+    mark after the call; it never goes down, so compare it across fresh processes.
+    """
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    start_current, _ = tracemalloc.get_traced_memory()
+    started = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        if not was_tracing:
+            tracemalloc.stop()
+
+    stats = {
+        'peak_traced_bytes': max(peak - start_current, 0),
+        'max_rss_bytes': _max_rss_bytes(),
+        'wall_seconds': elapsed,
+    }
+    return result, stats
@@ -0,0 +1,193 @@
+# clientdoc/prerender.py
+"""Speculative pre-rendering of the invoice, DC and transport sections.
+
+Saving an invoice that is far enough along the workflow, or its items, DC or
+transport charges, schedules a debounced RenderJob. The job renders the sections
+into the render cache (keyed by input fingerprint), so by the time the user
+finalizes only the merge is left. Jobs run in a separate process with
+`manage.py prerender_worker`, or with PRERENDER_IN_PROCESS on a daemon thread
+of the process that queued them. PRERENDER_ENABLED is off unless one of those
+consumes the jobs. Finalize renders whatever is still missing.
+"""
+
+import logging
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.utils import timezone
+from .render_cache import cached_section
+from .admission import render_slot
+
+logger = logging.getLogger(__name__)
+
+# Invoices in these states are about to be finalized. Finalized ones are left out: finalizing
+# saves the invoice as FIN, which would only queue a render of pages it has just cached
+PRERENDER_STATUSES = ('DC', 'TRP')
+
+
+def prerender_enabled():
+    return getattr(settings, 'PRERENDER_ENABLED', False)
+
+
+def enqueue_prerender(invoice_id):
+    """Schedules a pre-render once the current transaction commits.
+
+    A transaction saving many lines of one invoice (a formset, an import group)
+    schedules it once: the ids are collected for a single on_commit callback.
+    """
+    if not prerender_enabled() or not invoice_id:
+        return
+    conn = transaction.get_connection()
+    if not conn.in_atomic_block:
+        schedule_job(invoice_id)
+        return
+    queued = getattr(conn, 'prerender_queue', None)
+    # The callback is gone once it ran, or if the block that registered it rolled back
+    if queued is None or not any(entry[1] is queued for entry in conn.run_on_commit):
+        queued = _queue_for_commit(conn)
+    queued.invoice_ids.add(invoice_id)
+
+
+def _queue_for_commit(conn):
+    invoice_ids = set()
+
+    def schedule_queued():
+        for invoice_id in sorted(invoice_ids):
+            schedule_job(invoice_id)
+    schedule_queued.invoice_ids = invoice_ids
+    conn.prerender_queue = schedule_queued
+    transaction.on_commit(schedule_queued)
+    return schedule_queued
+
+
+def schedule_job(invoice_id):
+    """Creates or pushes back the invoice's job, so rapid edits render once."""
+    from .models import RenderJob
+    run_after = timezone.now() + timedelta(seconds=getattr(settings, 'PRERENDER_DEBOUNCE_SECONDS', 5))
+    try:
+        updated = RenderJob.objects.filter(invoice_id=invoice_id).update(status='PEN', run_after=run_after, error='')
+        if not updated:
+            RenderJob.objects.create(invoice_id=invoice_id, run_after=run_after)
+    except DatabaseError as e:
+        # Pre-rendering is an optimisation; finalize renders whatever is missing
+        logger.warning(f"Could not schedule pre-render for invoice {invoice_id}: {e}")
+        return
+    if getattr(settings, 'PRERENDER_IN_PROCESS', False):
+        background_worker.wake()
+
+
+def prerender_invoice(invoice, company_profile=None):
+    """Renders every generated section the bundle would use. Returns the section names."""
+    from .models import OurCompanyProfile
+    company_profile = company_profile or OurCompanyProfile.objects.first()
+    sections = ['invoice']
+    if hasattr(invoice, 'deliverychallan'):
+        sections.append('dc')
+    if hasattr(invoice, 'transportcharges'):
+        sections.append('transport')
+    for section in sections:
+        cached_section(invoice, section, company_profile)
+    return sections
+
+
+def claim_due_job():
+    """Marks the oldest due job as running and returns it (None if nothing is due)."""
+    from .models import RenderJob
+    now = timezone.now()
+    due = RenderJob.objects.filter(status='PEN', run_after__lte=now).order_by('run_after')
+    if connection.features.has_select_for_update_skip_locked:
+        # PostgreSQL: workers lock different rows instead of racing for the same one
+        with transaction.atomic():
+            job = due.select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            RenderJob.objects.filter(pk=job.pk).update(status='RUN', started_at=now)
+            job.status = 'RUN'
+            return job
+    for job in due[:10]:
+        # run_after in the filter: a job pushed back by a newer edit is not due any more
+        claimed = RenderJob.objects.filter(pk=job.pk, status='PEN', run_after=job.run_after).update(status='RUN', started_at=now)
+        if claimed:
+            job.status = 'RUN'
+            return job
+    return None
+
+
+def run_job(job):
+    from .models import RenderJob, SalesInvoice
+    status, error = 'DON', ''
+    try:
+        invoice = SalesInvoice.objects.select_related('location', 'buyer').filter(
+            pk=job.invoice_id, status__in=PRERENDER_STATUSES).first()
+        if invoice is not None:
+            with render_slot('PRE', invoice):
+                sections = prerender_invoice(invoice)
+            logger.info(f"Pre-rendered {', '.join(sections)} for invoice {invoice.id}")
+    except Exception as e:
+        logger.error(f"Pre-render failed for invoice {job.invoice_id}: {e}")
+        status, error = 'ERR', str(e)
+    # Left pending if an edit re-queued the job while it was rendering
+    RenderJob.objects.filter(pk=job.pk, status='RUN', run_after=job.run_after).update(
+        status=status, error=error, finished_at=timezone.now())
+
+
+def run_due_jobs(limit=None):
+    """Runs due jobs until none are left (or limit is reached). Returns how many ran."""
+    count = 0
+    while limit is None or count < limit:
+        job = claim_due_job()
+        if job is None:
+            break
+        run_job(job)
+        count += 1
+    return count
+
+
+def seconds_until_next_job():
+    """Seconds until the next pending job is due, or None when the queue is empty."""
+    from .models import RenderJob
+    next_run = RenderJob.objects.filter(status='PEN').order_by('run_after').values_list('run_after', flat=True).first()
+    if next_run is None:
+        return None
+    return max(0.0, (next_run - timezone.now()).total_seconds())
+
+
+class BackgroundWorker:
+    """Daemon thread that runs jobs as they come due and exits when the queue is empty."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def wake(self):
+        with self._lock:
+            self._wakeup.set()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='clientdoc-prerender', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                self._wakeup.clear()
+                close_old_connections()
+                run_due_jobs()
+                wait = seconds_until_next_job()
+                if wait is None:
+                    with self._lock:
+                        if not self._wakeup.is_set():
+                            self._thread = None
+                            return
+                    continue
+                self._wakeup.wait(timeout=max(wait, 0.1))
+        except Exception as e:
+            logger.error(f"Pre-render worker stopped: {e}")
+            with self._lock:
+                self._thread = None
+        finally:
+            connection.close()
+
+
+background_worker = BackgroundWorker()
@@ -0,0 +1,62 @@
+# clientdoc/print_context.py
+"""Template context for the print templates, shared by the print views and the HTML PDF renderer."""
+
+
+def display_number(invoice):
+    return invoice.tally_invoice_number if invoice.tally_invoice_number else invoice.app_invoice_number
+
+
+def invoice_print_context(invoice, company_profile):
+    # Ensure totals are calculated
+    invoice.calculate_gst_totals(only_if_changed=True)
+
+    # Determine IGST vs CGST/SGST based on model's calculated fields
+    # Logic: If igst_total > 0, it's Inter-state. Or check place_of_supply vs company state.
+    # However, model stores totals now.
+
+    comp_state_code = company_profile.state_code if company_profile else '29'
+    # Fallback to model POS if set, else Location state
+    pos_code = invoice.place_of_supply if invoice.place_of_supply else (invoice.location.state_code if invoice.location else '29')
+
+    is_igst = (pos_code != comp_state_code)
+
+    items = list(invoice.invoiceitem_set.select_related('item'))
+    # Sum of the lines' taxable values, kept on the invoice
+    taxable_val = invoice.taxable_total
+
+    if hasattr(invoice, 'transportcharges') and invoice.transportcharges and invoice.transportcharges.charges > 0:
+        taxable_val += invoice.transportcharges.charges
+
+    return {
+        'invoice': invoice,
+        'items': items,
+        'company': company_profile,
+        'display_invoice_number': display_number(invoice),
+        'taxable_val': taxable_val,
+        'tax_amt': (invoice.cgst_total + invoice.sgst_total + invoice.igst_total),
+        'cgst_amt': invoice.cgst_total,
+        'sgst_amt': invoice.sgst_total,
+        'igst_amt': invoice.igst_total,
+        'is_igst': is_igst,
+    }
+
+
+def dc_print_context(invoice, dc, company_profile):
+    items = list(invoice.invoiceitem_set.select_related('item'))
+    return {
+        'invoice': invoice,
+        'items': items,
+        'dc': dc,
+        'company': company_profile,
+        'total_qty': invoice.total_qty,
+        'display_invoice_number': display_number(invoice),
+    }
+
+
+def transport_print_context(invoice, transport, company_profile):
+    return {
+        'invoice': invoice,
+        'transport': transport,
+        'company': company_profile,
+        'display_invoice_number': display_number(invoice),
+    }
@@ -0,0 +1,130 @@
+# clientdoc/profiling.py
+"""On-demand cProfile capture of single requests.
+
+With PROFILING_ENABLED a request is profiled when a staff user sends the
+PROFILING_HEADER header or the PROFILING_QUERY_FLAG query parameter, or when
+it falls within PROFILING_SAMPLE_RATE. The .prof file is written to
+PROFILE_DIR and a RequestProfile row records the view, invoice, duration and
+query count. With profiling off the middleware removes itself at startup, so
+requests pay nothing.
+"""
+
+import os
+import time
+import uuid
+import random
+import pstats
+import logging
+import cProfile
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from .routers import execute_wrapper
+from .querybudget import QueryBudget, QueryRecorder
+
+logger = logging.getLogger(__name__)
+
+
+def profile_dir():
+    return str(getattr(settings, 'PROFILE_DIR', os.path.join(settings.BASE_DIR, 'profiles')))
+
+
+def profile_path(file_name):
+    return os.path.join(profile_dir(), os.path.basename(file_name))
+
+
+def top_functions(file_name, limit=30):
+    """Rows of the profile's top functions by cumulative time."""
+    stats = pstats.Stats(profile_path(file_name))
+    rows = []
+    for (filename, line, function), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({
+            'function': function,
+            'location': f"{filename}:{line}" if line else filename,
+            'ncalls': ncalls,
+            'tottime': tottime,
+            'cumtime': cumtime,
+            'percall_ms': cumtime / ncalls * 1000 if ncalls else 0,
+        })
+    rows.sort(key=lambda row: row['cumtime'], reverse=True)
+    return rows[:limit], stats.total_tt
+
+
+def prune_profiles(keep=None):
+    """Deletes all but the `keep` most recent profiles and their files."""
+    from .models import RequestProfile
+    keep = getattr(settings, 'PROFILING_KEEP', 200) if keep is None else keep
+    stale = list(RequestProfile.objects.order_by('-created_at', '-id')[keep:].values_list('id', 'file_name'))
+    for _, file_name in stale:
+        try:
+            os.remove(profile_path(file_name))
+        except OSError:
+            pass
+    if stale:
+        RequestProfile.objects.filter(id__in=[pk for pk, _ in stale]).delete()
+
+
+class ProfilingMiddleware:
+    """Profiles flagged or sampled requests (PROFILING_ENABLED); place it after AuthenticationMiddleware."""
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.header = 'HTTP_' + getattr(settings, 'PROFILING_HEADER', 'X-Profile').upper().replace('-', '_')
+        self.query_flag = getattr(settings, 'PROFILING_QUERY_FLAG', '_profile')
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0)
+
+    def trigger(self, request):
+        """'HDR'/'QRY' for a staff request asking for a profile, 'SMP' when sampled, else None."""
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_staff:
+            if request.META.get(self.header):
+                return 'HDR'
+            if self.query_flag in request.GET:
+                return 'QRY'
+        if self.sample_rate and random.random() < self.sample_rate:
+            return 'SMP'
+        return None
+
+    def __call__(self, request):
+        trigger = self.trigger(request)
+        if trigger is None:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        queries = QueryRecorder(QueryBudget(None, 0))
+        started = time.perf_counter()
+        with execute_wrapper(queries):
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        duration_ms = (time.perf_counter() - started) * 1000
+        try:
+            self.save(request, response, profiler, trigger, duration_ms, queries.count)
+        except Exception as e:
+            # Never let a diagnostic break the request it measured
+            logger.error(f"Could not save profile of {request.path}: {e}")
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.profile_view = (getattr(view_func, '__name__', ''), view_kwargs.get('invoice_id'))
+        return None
+
+    def save(self, request, response, profiler, trigger, duration_ms, query_count):
+        from .models import RequestProfile, SalesInvoice
+        view_name, invoice_id = getattr(request, 'profile_view', ('', None))
+        if invoice_id is not None and not SalesInvoice.all_objects.filter(pk=invoice_id).exists():
+            invoice_id = None
+
+        os.makedirs(profile_dir(), exist_ok=True)
+        file_name = f"{time.strftime('%Y%m%d-%H%M%S')}-{view_name or 'request'}-{uuid.uuid4().hex[:8]}.prof"
+        profiler.dump_stats(profile_path(file_name))
+        RequestProfile.objects.create(
+            trigger=trigger, method=request.method, path=request.path[:500], view_name=view_name[:100],
+            invoice_id=invoice_id, status_code=getattr(response, 'status_code', None),
+            duration_ms=duration_ms, query_count=query_count, file_name=file_name,
+        )
+        prune_profiles()
+        logger.info(f"Profiled {request.method} {request.path} ({trigger}): {duration_ms:.0f} ms, {query_count} queries -> {file_name}")
@@ -0,0 +1,186 @@
+# clientdoc/querybudget.py
+"""Per-request query budgets and N+1 detection.
+
+Every query of a request goes through a QueryRecorder (a connection execute
+wrapper) that counts it and groups it by SQL shape, i.e. the statement with its
+literal values and IN-lists collapsed. The same shape running more than
+max_repeats times is reported as an N+1 together with the code line and
+template line that issued it. Views declare their budget with @query_budget;
+the rest get QUERY_BUDGET_DEFAULT. Breaches are logged as warnings, or raised
+when QUERY_BUDGET_STRICT is on (tests and benchmarks).
+"""
+
+import os
+import re
+import sys
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from .routers import execute_wrapper
+
+logger = logging.getLogger(__name__)
+
+_IN_LIST_RE = re.compile(r'\bIN \((?:%s|\?)(?:, (?:%s|\?))*\)', re.IGNORECASE)
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_SPACE_RE = re.compile(r'\s+')
+_SELECT_LIST_RE = re.compile(r'^SELECT .*? FROM ')
+# Transaction bookkeeping repeats by design (one savepoint per atomic block)
+_IGNORED_PREFIXES = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT', 'BEGIN', 'COMMIT', 'ROLLBACK')
+
+_THIS_FILE = os.path.abspath(__file__)
+_TEMPLATE_BASE = os.path.join('django', 'template', 'base.py')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A request or block ran more queries than its budget, or repeated one query too often."""
+
+
+def sql_shape(sql):
+    """The statement with values and IN-list lengths collapsed, so repeats group together."""
+    shape = _SPACE_RE.sub(' ', sql).strip()
+    shape = _STRING_RE.sub('?', shape)
+    shape = _NUMBER_RE.sub('?', shape)
+    return _IN_LIST_RE.sub('IN (...)', shape)
+
+
+def summarize(shape, limit=300):
+    """Shape for log messages: the select list is noise, the FROM/WHERE part identifies the query."""
+    shape = _SELECT_LIST_RE.sub('SELECT ... FROM ', shape)
+    return shape if len(shape) <= limit else shape[:limit] + '...'
+
+
+def call_site():
+    """'<file>:<line> in <function>' of the project code issuing the current query,
+    plus '<template>:<line>' when it came from a template variable or tag."""
+    project_dir = str(settings.BASE_DIR)
+    code = template = None
+    frame = sys._getframe(1)
+    while frame is not None and not (code and template):
+        filename = frame.f_code.co_filename
+        if template is None and filename.endswith(_TEMPLATE_BASE) and frame.f_code.co_name == 'render_annotated':
+            node = frame.f_locals.get('self')
+            origin, token = getattr(node, 'origin', None), getattr(node, 'token', None)
+            if origin is not None and token is not None:
+                template = f"{origin.template_name or origin.name}:{token.lineno}"
+        elif (code is None and filename.startswith(project_dir) and filename != _THIS_FILE
+              and 'site-packages' not in filename):
+            code = f"{os.path.relpath(filename, project_dir)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return ' via '.join(part for part in (template, code) if part) or 'unknown'
+
+
+class QueryBudget:
+    """max_queries None means no total cap; max_repeats 0 turns N+1 detection off."""
+
+    def __init__(self, max_queries=None, max_repeats=None):
+        self.max_queries = max_queries
+        self.max_repeats = getattr(settings, 'QUERY_BUDGET_MAX_REPEATS', 5) if max_repeats is None else max_repeats
+
+    def __repr__(self):
+        return f"<QueryBudget max_queries={self.max_queries} max_repeats={self.max_repeats}>"
+
+
+class QueryRecorder:
+    """connection.execute_wrapper that counts queries and finds repeated shapes.
+
+    The call site is only captured when a shape crosses the repeat limit, so
+    the stack is walked once per offending query rather than for every query.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.count = 0
+        self.shapes = Counter()
+        self.sites = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        if not self.budget.max_repeats:
+            # Counting only: skip the regexes
+            return execute(sql, params, many, context)
+        shape = sql_shape(sql)
+        if not shape.upper().startswith(_IGNORED_PREFIXES):
+            self.shapes[shape] += 1
+            if self.budget.max_repeats and self.shapes[shape] == self.budget.max_repeats + 1:
+                self.sites[shape] = call_site()
+        return execute(sql, params, many, context)
+
+    def repeated(self):
+        """[(shape, times, call site)] of the shapes that ran more than max_repeats times."""
+        if not self.budget.max_repeats:
+            return []
+        return [(shape, times, self.sites.get(shape, 'unknown'))
+                for shape, times in self.shapes.most_common() if times > self.budget.max_repeats]
+
+    def problems(self):
+        problems = []
+        if self.budget.max_queries is not None and self.count > self.budget.max_queries:
+            problems.append(f"{self.count} queries, budget is {self.budget.max_queries}")
+        for shape, times, site in self.repeated():
+            problems.append(f"possible N+1: {times}x at {site}: {summarize(shape)}")
+        return problems
+
+
+def query_budget(max_queries=None, max_repeats=None):
+    """Declares a view's query budget (see QueryBudgetMiddleware)."""
+    def decorator(view_func):
+        view_func.query_budget = QueryBudget(max_queries, max_repeats)
+        return view_func
+    return decorator
+
+
+def report(label, recorder):
+    """Logs (or, with QUERY_BUDGET_STRICT, raises) the recorder's budget breaches."""
+    problems = recorder.problems()
+    if not problems:
+        return
+    message = f"Query budget exceeded in {label}: " + '; '.join(problems)
+    if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+@contextmanager
+def assert_query_budget(max_queries=None, max_repeats=None, label='block'):
+    """Test helper: raises QueryBudgetExceeded if the block breaks the budget.
+
+        with assert_query_budget(10):
+            generate_invoice_pdf(invoice, company)
+    """
+    recorder = QueryRecorder(QueryBudget(max_queries, max_repeats))
+    with execute_wrapper(recorder):
+        yield recorder
+    problems = recorder.problems()
+    if problems:
+        raise QueryBudgetExceeded(f"Query budget exceeded in {label}: " + '; '.join(problems))
+
+
+class QueryBudgetMiddleware:
+    """Counts each request's queries against its view's budget (QUERY_BUDGET_ENABLED)."""
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_BUDGET_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder(QueryBudget(getattr(settings, 'QUERY_BUDGET_DEFAULT', None)))
+        request.query_recorder = recorder
+        with execute_wrapper(recorder):
+            response = self.get_response(request)
+        view = getattr(request, 'query_budget_view', None)
+        report(f"{request.method} {request.path}" + (f" ({view})" if view else ''), recorder)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        recorder = getattr(request, 'query_recorder', None)
+        if recorder is None:
+            return None
+        request.query_budget_view = getattr(view_func, '__name__', None)
+        budget = getattr(view_func, 'query_budget', None)
+        if budget is not None:
+            recorder.budget = budget
+        return None
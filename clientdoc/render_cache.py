@@ -0,0 +1,214 @@
+# clientdoc/render_cache.py
+"""Fingerprints of bundle sections and an on-disk cache of rendered section PDFs.
+
+A fingerprint is a SHA-256 over everything that can change a section's output.
+Rendered PDFs are stored under RENDER_CACHE_DIR/<invoice id>/<section>-<fingerprint>.pdf,
+so identical inputs are served byte-for-byte identical (stable ETags and ranges)
+without re-rendering. Combined bundles record the fingerprint of every section in
+their manifest (see bundles.write_combined_pdf).
+"""
+
+import os
+import json
+import glob
+import hashlib
+import logging
+import tempfile
+from django.conf import settings
+from .leases import run_leased
+from .metrics import pdf_render_seconds, render_cache_lookups
+
+logger = logging.getLogger(__name__)
+
+# Bump when generator output changes so stale cached renders are not reused
+RENDERER_VERSION = 1
+
+GENERATED_SECTIONS = ('invoice', 'dc', 'transport')
+
+# Stored results of calculate_gst_totals and the line totals; they follow from the other inputs
+DERIVED_INVOICE_FIELDS = {'total', 'cgst_total', 'sgst_total', 'igst_total', 'amount_in_words', 'tax_amount_in_words', 'status',
+                          'item_count', 'total_qty', 'taxable_total'}
+
+
+def _row(obj, exclude=()):
+    if obj is None:
+        return None
+    return {f.attname: getattr(obj, f.attname) for f in obj._meta.concrete_fields if f.attname not in exclude}
+
+
+def _digest(payload):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _items(invoice):
+    rows = invoice.invoiceitem_set.order_by('pk').values_list(
+        'pk', 'quantity', 'price', 'description', 'gst_rate', 'discount_type', 'discount_value',
+        'item__name', 'item__description', 'item__hsn_sac', 'item__unit', 'item__gst_rate',
+    )
+    return [list(r) for r in rows]
+
+
+def _company_row(company):
+    row = _row(company)
+    if row is not None and company.signature:
+        row['signature'] = company.signature.name
+    return row
+
+
+def _related(invoice, attr):
+    try:
+        return getattr(invoice, attr)
+    except Exception:
+        return None
+
+
+def section_fingerprint(invoice, section, company):
+    """Fingerprint of a generated section (invoice, dc or transport) for the current data."""
+    payload = {
+        'renderer': RENDERER_VERSION,
+        'section': section,
+        'engine': section_engine(section),
+        'company_state_code': getattr(settings, 'COMPANY_STATE_CODE', '29'),
+        'invoice': _row(invoice, DERIVED_INVOICE_FIELDS),
+        'location': _row(invoice.location),
+        'company': _company_row(company),
+    }
+    if section in ('invoice', 'dc'):
+        payload['items'] = _items(invoice)
+    if section == 'invoice':
+        payload['buyer'] = _row(invoice.buyer)
+    if section in ('invoice', 'transport'):
+        payload['transport'] = _row(_related(invoice, 'transportcharges'))
+    if section == 'dc':
+        payload['dc'] = _row(_related(invoice, 'deliverychallan'))
+    return _digest(payload)
+
+
+def section_engine(section):
+    """Renderer configured for a generated section: 'reportlab' or 'weasyprint' (PDF_ENGINES)."""
+    return getattr(settings, 'PDF_ENGINES', {}).get(section, 'reportlab')
+
+
+def render_section(invoice, section, company):
+    """Renders a generated section to a spooled buffer with its configured engine."""
+    if section not in GENERATED_SECTIONS:
+        raise ValueError(f"Unknown section {section}")
+    engine = section_engine(section)
+    with pdf_render_seconds.time(document=section, engine=engine):
+        return _render(invoice, section, company, engine)
+
+
+def _render(invoice, section, company, engine):
+    # ReportLab loads on the first render, not when the signals import this module
+    from .pdf_generator import generate_invoice_pdf, generate_dc_pdf, generate_transport_pdf
+    if section == 'invoice':
+        # Only saves stale totals: a save would re-queue this pre-render and invalidate the cached lists
+        invoice.calculate_gst_totals(only_if_changed=True)
+    if engine == 'weasyprint':
+        from . import html_pdf
+        if section == 'invoice':
+            return html_pdf.generate_invoice_html_pdf(invoice, company)
+        if section == 'dc':
+            return html_pdf.generate_dc_html_pdf(invoice, invoice.deliverychallan, company)
+        return html_pdf.generate_transport_html_pdf(invoice, invoice.transportcharges, company)
+    if section == 'invoice':
+        return generate_invoice_pdf(invoice, company)
+    if section == 'dc':
+        return generate_dc_pdf(invoice, invoice.deliverychallan, company)
+    return generate_transport_pdf(invoice, invoice.transportcharges, company)
+
+
+def _cache_dir(invoice_id):
+    return os.path.join(str(settings.RENDER_CACHE_DIR), str(invoice_id))
+
+
+def cached_section(invoice, section, company, fingerprint=None):
+    """Returns (path, fingerprint) of the rendered section, rendering it only on a cache miss.
+
+    Concurrent misses for the same section (a finalize racing the pre-renderer)
+    render once; the others wait on the lease and reuse the file.
+    """
+    fingerprint = fingerprint or section_fingerprint(invoice, section, company)
+    directory = _cache_dir(invoice.id)
+    path = os.path.join(directory, f"{section}-{fingerprint}.pdf")
+    _, reused = run_leased(
+        f"section:{invoice.id}:{section}", fingerprint,
+        work=lambda: _render_to_cache(invoice, section, company, directory, path),
+        reuse=lambda: path if os.path.exists(path) else None,
+    )
+    render_cache_lookups.inc(document=section, result='hit' if reused else 'miss')
+    return path, fingerprint
+
+
+def _render_to_cache(invoice, section, company, directory, path):
+    buffer = render_section(invoice, section, company)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = buffer.read(64 * 1024)
+                if not chunk:
+                    break
+                out.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        buffer.close()
+
+    # Older renders of this section can't be served again
+    for stale in glob.glob(os.path.join(directory, f"{section}-*.pdf")):
+        if stale != path:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+    return path
+
+
+def uploaded_fingerprint(field_file):
+    """Fingerprint of an uploaded PDF, or None when the field is empty."""
+    if not field_file:
+        return None
+    # Blob names already are content hashes; legacy paths fall back to size and mtime
+    try:
+        st = os.stat(field_file.path)
+        return _digest([field_file.name, st.st_size, int(st.st_mtime)])
+    except OSError:
+        return _digest([field_file.name, None, None])
+
+
+def images_fingerprint(confirmation):
+    # Derivatives and hashes are built from these at bundle time, so the source names cover them
+    rows = confirmation.packedimage_set.order_by('pk').values_list('pk', 'image', 'notes')
+    return _digest({
+        'renderer': RENDERER_VERSION,
+        'dpi': getattr(settings, 'PACKED_IMAGE_DPI', 200),
+        'duplicate_distance': getattr(settings, 'PACKED_IMAGE_DUPLICATE_DISTANCE', 6),
+        'images': [list(r) for r in rows],
+    })
+
+
+def bundle_fingerprint(invoice, confirmation, company, file_order, linearized=False):
+    """Fingerprint of the combined bundle the current data would produce.
+
+    Computed from the inputs before anything is rendered, so concurrent requests
+    can tell they would build the same file (see bundles.write_combined_pdf).
+    """
+    parts = [('linearized', True)] if linearized else []
+    for section in file_order:
+        if section == 'invoice':
+            parts.append(('invoice', uploaded_fingerprint(confirmation.uploaded_invoice) or section_fingerprint(invoice, 'invoice', company)))
+        elif section == 'dc':
+            parts.append(('dc', uploaded_fingerprint(confirmation.uploaded_dc) or section_fingerprint(invoice, 'dc', company)))
+        elif section == 'transport':
+            parts.append(('transport', section_fingerprint(invoice, 'transport', company)))
+        elif section == 'po':
+            parts.append(('po', uploaded_fingerprint(confirmation.po_file)))
+        elif section == 'email':
+            parts.append(('email', uploaded_fingerprint(confirmation.approval_email_file)))
+    parts.append(('images', images_fingerprint(confirmation)))
+    return _digest(parts)
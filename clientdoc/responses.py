@@ -0,0 +1,102 @@
+# clientdoc/responses.py
+"""File responses that stream from disk with HTTP Range and conditional GET support."""
+
+import os
+import re
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+CHUNK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    """Parses a single-range "bytes=" header into (start, end) inclusive.
+
+    Returns None when the header should be ignored (absent, malformed or
+    multi-range, which is answered with the full file) and 'unsatisfiable'
+    when the range lies outside the file.
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return 'unsatisfiable'
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        return 'unsatisfiable'
+    return start, min(end, size - 1)
+
+
+def _range_applies(request, etag, last_modified):
+    """If-Range: only honour the range when the client's copy is still current."""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return etag is not None and if_range == etag
+    since = parse_http_date_safe(if_range)
+    return since is not None and last_modified is not None and int(last_modified) <= since
+
+
+def _iter_file(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def ranged_file_response(request, path, content_type, filename, etag=None, last_modified=None, inline=True):
+    """Streams a file, answering single-range requests with 206 Partial Content.
+
+    etag is a bare fingerprint (quoted here); last_modified is a POSIX
+    timestamp and defaults to the file's mtime. The caller is expected to have
+    answered If-None-Match/If-Modified-Since before the file is produced.
+    """
+    size = os.path.getsize(path)
+    if last_modified is None:
+        last_modified = os.path.getmtime(path)
+    etag = quote_etag(etag) if etag else None
+
+    byte_range = None
+    if request.method == 'GET' and _range_applies(request, etag, last_modified):
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+
+    if byte_range == 'unsatisfiable':
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{size}"
+    elif byte_range:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(_iter_file(path, start, length), status=206, content_type=content_type)
+        response['Content-Length'] = str(length)
+        response['Content-Range'] = f"bytes {start}-{end}/{size}"
+    else:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+        response['Content-Length'] = str(size)
+
+    disposition = 'inline' if inline else 'attachment'
+    response['Content-Disposition'] = f'{disposition}; filename="{filename}"'
+    response['Accept-Ranges'] = 'bytes'
+    if etag:
+        response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Documents change when the invoice is edited; always revalidate, never share
+    response['Cache-Control'] = 'private, no-cache'
+    return response
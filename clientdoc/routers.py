@@ -0,0 +1,99 @@
+# clientdoc/routers.py
+"""Read-only 'reporting' database for list pages, dashboards, exports and print views.
+
+Views decorated with @reporting_view read through the 'reporting' alias: a
+second, read-only connection to the same SQLite file (WAL lets it read while
+imports and finalizes write), or a PostgreSQL replica. Long report queries
+then never hold the primary connection or its write lock. Writes always go to
+the primary, and a write inside a reporting view sends the rest of that
+request's reads to the primary too.
+
+A replica can lag, so write views are decorated with @pin_primary: after a
+successful POST the client reads from the primary for REPORTING_PIN_SECONDS,
+and the list it is redirected to shows what it just saved.
+"""
+
+import functools
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPORTING_ALIAS = 'reporting'
+PIN_COOKIE = 'pin_primary'
+
+_state = threading.local()
+
+
+def reporting_enabled():
+    return REPORTING_ALIAS in settings.DATABASES
+
+
+@contextmanager
+def reporting():
+    """Routes reads in the block to the reporting database."""
+    previous = getattr(_state, 'reporting', False), getattr(_state, 'pinned', False)
+    _state.reporting, _state.pinned = True, False
+    try:
+        yield
+    finally:
+        _state.reporting, _state.pinned = previous
+
+
+class ReportingRouter:
+    """Reads go to 'reporting' inside reporting(); everything else uses the primary."""
+
+    def db_for_read(self, model, **hints):
+        if getattr(_state, 'reporting', False) and not getattr(_state, 'pinned', False):
+            return REPORTING_ALIAS
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        if getattr(_state, 'reporting', False):
+            # Read your own write for the rest of the request
+            _state.pinned = True
+        # Explicit, or Django would write instances loaded from 'reporting' back there
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return False if db == REPORTING_ALIAS else None
+
+
+def reporting_view(view_func):
+    """Runs a read-only view's queries on the reporting database (unless the client is pinned)."""
+    @functools.wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if not reporting_enabled() or request.COOKIES.get(PIN_COOKIE):
+            return view_func(request, *args, **kwargs)
+        with reporting():
+            return view_func(request, *args, **kwargs)
+    return wrapper
+
+
+def pin_primary(view_func):
+    """After a successful POST, pins the client's reporting views to the primary for a few seconds."""
+    @functools.wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        response = view_func(request, *args, **kwargs)
+        if request.method == 'POST' and response.status_code < 400 and reporting_enabled():
+            response.set_cookie(PIN_COOKIE, '1', max_age=getattr(settings, 'REPORTING_PIN_SECONDS', 5),
+                                httponly=True, samesite='Lax')
+        return response
+    return wrapper
+
+
+@contextmanager
+def execute_wrapper(wrapper):
+    """connection.execute_wrapper on every configured database, the reporting one included."""
+    wrapped = [connections[alias] for alias in settings.DATABASES]
+    for connection in wrapped:
+        connection.execute_wrappers.append(wrapper)
+    try:
+        yield
+    finally:
+        for connection in wrapped:
+            connection.execute_wrappers.pop()
@@ -0,0 +1,155 @@
+# clientdoc/serving.py
+"""Production serving for `manage.py serve`: static/media files and the waitress worker loop.
+
+StaticMediaApplication answers STATIC_URL and MEDIA_URL requests from disk in
+front of Django, so files skip the middleware stack and are sent with the
+server's file wrapper (sendfile-style chunks, not Python strings). run_worker
+serves one waitress server until SIGTERM/SIGINT, then stops accepting and
+lets in-flight requests (a finalize, an upload) finish before exiting.
+"""
+
+import os
+import time
+import signal
+import logging
+import mimetypes
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.handlers.wsgi import get_path_info
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+
+logger = logging.getLogger(__name__)
+
+STOP_SIGNALS = tuple(getattr(signal, name) for name in ('SIGTERM', 'SIGINT', 'SIGBREAK') if hasattr(signal, name))
+BLOCK_SIZE = 64 * 1024
+
+
+def _url_prefix(url):
+    # Only site-relative URLs can be mounted; an external STATIC_URL (CDN) is left alone
+    if not url or '://' in url:
+        return None
+    return '/' + url.strip('/') + '/'
+
+
+class StaticMediaApplication:
+    """WSGI wrapper serving STATIC_URL (static roots or app finders) and MEDIA_URL (MEDIA_ROOT)."""
+
+    def __init__(self, application, static=True, media=True):
+        self.application = application
+        self.mounts = []
+        self.static_paths = {}
+        if static and _url_prefix(settings.STATIC_URL):
+            max_age = getattr(settings, 'SERVE_STATIC_MAX_AGE', 3600)
+            self.mounts.append((_url_prefix(settings.STATIC_URL), self.find_static, f"public, max-age={max_age}"))
+        if media and _url_prefix(settings.MEDIA_URL):
+            # Media changes under the same name (re-uploads, re-built bundles): always revalidate
+            self.mounts.append((_url_prefix(settings.MEDIA_URL), self.find_media, 'private, no-cache'))
+
+    def __call__(self, environ, start_response):
+        path = get_path_info(environ)
+        for prefix, find, cache_control in self.mounts:
+            if path.startswith(prefix):
+                file_path = find(path[len(prefix):])
+                if file_path:
+                    return self.serve(environ, start_response, file_path, cache_control)
+                break
+        return self.application(environ, start_response)
+
+    def find_static(self, relative):
+        # Static files only change on deploy, so lookups through the finders are cached
+        if relative not in self.static_paths:
+            found = None
+            static_root = getattr(settings, 'STATIC_ROOT', None)
+            try:
+                if static_root and os.path.isfile(safe_join(static_root, relative)):
+                    found = safe_join(static_root, relative)
+                else:
+                    found = finders.find(relative)
+            except SuspiciousFileOperation:
+                found = None
+            self.static_paths[relative] = found if isinstance(found, str) else None
+        return self.static_paths[relative]
+
+    def find_media(self, relative):
+        try:
+            path = safe_join(settings.MEDIA_ROOT, relative)
+        except SuspiciousFileOperation:
+            return None
+        return path if os.path.isfile(path) else None
+
+    def serve(self, environ, start_response, file_path, cache_control):
+        method = environ.get('REQUEST_METHOD', 'GET')
+        if method not in ('GET', 'HEAD'):
+            start_response('405 Method Not Allowed', [('Allow', 'GET, HEAD'), ('Content-Length', '0')])
+            return []
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return self.application(environ, start_response)
+
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        headers = [
+            ('ETag', etag),
+            ('Last-Modified', http_date(stat.st_mtime)),
+            ('Cache-Control', cache_control),
+        ]
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if_modified_since = parse_http_date_safe(environ.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if (if_none_match and etag in (tag.strip() for tag in if_none_match.split(','))) or (
+                not if_none_match and if_modified_since and int(stat.st_mtime) <= if_modified_since):
+            start_response('304 Not Modified', headers)
+            return []
+
+        content_type, encoding = mimetypes.guess_type(file_path)
+        headers.append(('Content-Type', content_type or 'application/octet-stream'))
+        if encoding:
+            headers.append(('Content-Encoding', encoding))
+        headers.append(('Content-Length', str(stat.st_size)))
+        start_response('200 OK', headers)
+        if method == 'HEAD':
+            return []
+        f = open(file_path, 'rb')
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None:
+            return file_wrapper(f, BLOCK_SIZE)
+        return _iter_file(f)
+
+
+def _iter_file(f):
+    with f:
+        while True:
+            chunk = f.read(BLOCK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _busy(server):
+    return any(channel.requests or channel.total_outbufs_len for channel in list(server.active_channels.values()))
+
+
+def run_worker(server, graceful_timeout):
+    """Runs a waitress server until a stop signal, then drains it for up to graceful_timeout seconds."""
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+
+    for signum in STOP_SIGNALS:
+        signal.signal(signum, stop)
+
+    while not stopping:
+        server.asyncore.loop(timeout=server.adj.asyncore_loop_timeout, map=server._map,
+                             use_poll=server.adj.asyncore_use_poll, count=1)
+
+    # No new connections; keep the loop going so running requests can send their responses
+    server.accepting = False
+    deadline = time.monotonic() + graceful_timeout
+    while _busy(server) and time.monotonic() < deadline:
+        server.asyncore.loop(timeout=0.1, map=server._map, use_poll=server.adj.asyncore_use_poll, count=1)
+    if _busy(server):
+        logger.warning(f"Worker {os.getpid()}: requests still running after {graceful_timeout}s, stopping anyway")
+    server.task_dispatcher.shutdown(timeout=max(0.0, deadline - time.monotonic()))
+    server.close()
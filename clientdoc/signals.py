@@ -0,0 +1,150 @@
+# clientdoc/signals.py
+
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import (
+    ConfirmationDocument, SalesInvoice, InvoiceItem, DeliveryChallan, TransportCharges,
+    Buyer, StoreLocation, Item, ItemCategory, OurCompanyProfile, ActivityLog,
+)
+from .storage import blob_fields, retain_blob, release_blob
+from .prerender import enqueue_prerender, PRERENDER_STATUSES
+from .fragments import bump_versions
+from .line_totals import deferring_line_totals, line_contribution, move_line_totals
+
+
+# --- Content-addressed blob reference counting ---
+
+def _saved_blob_fields(sender, update_fields):
+    fields = blob_fields(sender)
+    if update_fields is not None:
+        fields = [f for f in fields if f.attname in update_fields or f.name in update_fields]
+    return fields
+
+
+@receiver(pre_save, sender=ConfirmationDocument)
+def remember_blob_names(sender, instance, update_fields=None, **kwargs):
+    """Stashes the file names currently stored for the row, to diff after save."""
+    fields = [f.attname for f in _saved_blob_fields(sender, update_fields)]
+    if not fields:
+        instance._previous_blob_names = {}
+        return
+    previous = {}
+    if instance.pk:
+        previous = sender.all_objects.filter(pk=instance.pk).values(*fields).first() or {}
+    instance._previous_blob_names = previous
+
+
+@receiver(post_save, sender=ConfirmationDocument)
+def update_blob_refcounts(sender, instance, update_fields=None, **kwargs):
+    previous = getattr(instance, '_previous_blob_names', {})
+    for field in _saved_blob_fields(sender, update_fields):
+        old_name = previous.get(field.attname) or ''
+        new_name = getattr(instance, field.attname).name or ''
+        if old_name == new_name:
+            continue
+        retain_blob(new_name)
+        release_blob(old_name)
+    instance._previous_blob_names = {}
+
+
+@receiver(post_delete, sender=ConfirmationDocument)
+def release_deleted_blobs(sender, instance, **kwargs):
+    for field in blob_fields(sender):
+        release_blob(getattr(instance, field.attname).name or '')
+
+
+# --- Speculative pre-rendering of generated sections ---
+
+@receiver(post_save, sender=SalesInvoice)
+def prerender_on_invoice_save(sender, instance, raw=False, **kwargs):
+    """Entering DC/TRP (or editing an invoice already there) queues a pre-render."""
+    if not raw and not instance.is_deleted and instance.status in PRERENDER_STATUSES:
+        enqueue_prerender(instance.pk)
+
+
+@receiver(post_save, sender=InvoiceItem)
+@receiver(post_delete, sender=InvoiceItem)
+@receiver(post_save, sender=DeliveryChallan)
+@receiver(post_delete, sender=DeliveryChallan)
+@receiver(post_save, sender=TransportCharges)
+@receiver(post_delete, sender=TransportCharges)
+def prerender_on_section_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # Formsets hand every item the same invoice instance; only query when it isn't loaded
+    if sender._meta.get_field('invoice').is_cached(instance):
+        invoice = instance.invoice
+    else:
+        invoice = SalesInvoice.all_objects.filter(pk=instance.invoice_id).only('status', 'is_deleted').first()
+    if invoice and not invoice.is_deleted and invoice.status in PRERENDER_STATUSES:
+        enqueue_prerender(invoice.pk)
+
+
+# --- Denormalized invoice line totals ---
+
+@receiver(pre_save, sender=InvoiceItem)
+def remember_line_contribution(sender, instance, raw=False, **kwargs):
+    """Stashes what the stored row adds to its invoice, to subtract after save."""
+    instance._previous_line = None
+    if raw or instance._state.adding or deferring_line_totals(instance.invoice_id):
+        return
+    previous = sender.objects.filter(pk=instance.pk).only(
+        'invoice_id', 'quantity', 'price', 'discount_type', 'discount_value').first()
+    if previous:
+        instance._previous_line = (previous.invoice_id, line_contribution(previous))
+
+
+def _move_cached_invoice(instance, invoice_id, change):
+    # Keep an invoice already loaded on the line (formsets share one) in step with the row
+    if instance._meta.get_field('invoice').is_cached(instance) and instance.invoice and instance.invoice.pk == invoice_id:
+        invoice = instance.invoice
+        invoice.item_count += change[0]
+        invoice.total_qty += change[1]
+        invoice.taxable_total += change[2]
+
+
+def _apply_line_change(instance, invoice_id, change):
+    move_line_totals(invoice_id, *change)
+    _move_cached_invoice(instance, invoice_id, change)
+
+
+@receiver(post_save, sender=InvoiceItem)
+def update_line_totals(sender, instance, raw=False, **kwargs):
+    if raw or deferring_line_totals(instance.invoice_id):
+        return
+    count, qty, taxable = line_contribution(instance)
+    previous = getattr(instance, '_previous_line', None)
+    instance._previous_line = None
+    if previous:
+        old_invoice_id, (old_count, old_qty, old_taxable) = previous
+        if old_invoice_id != instance.invoice_id:
+            _apply_line_change(instance, old_invoice_id, (-old_count, -old_qty, -old_taxable))
+        else:
+            count, qty, taxable = count - old_count, qty - old_qty, taxable - old_taxable
+    _apply_line_change(instance, instance.invoice_id, (count, qty, taxable))
+
+
+@receiver(post_delete, sender=InvoiceItem)
+def remove_line_totals(sender, instance, **kwargs):
+    if deferring_line_totals(instance.invoice_id):
+        return
+    count, qty, taxable = line_contribution(instance)
+    _apply_line_change(instance, instance.invoice_id, (-count, -qty, -taxable))
+
+
+# --- Cached page fragments ---
+
+@receiver([post_save, post_delete], sender=SalesInvoice)
+@receiver([post_save, post_delete], sender=InvoiceItem)
+@receiver([post_save, post_delete], sender=DeliveryChallan)
+@receiver([post_save, post_delete], sender=TransportCharges)
+@receiver([post_save, post_delete], sender=ConfirmationDocument)
+@receiver([post_save, post_delete], sender=Buyer)
+@receiver([post_save, post_delete], sender=StoreLocation)
+@receiver([post_save, post_delete], sender=Item)
+@receiver([post_save, post_delete], sender=ItemCategory)
+@receiver([post_save, post_delete], sender=OurCompanyProfile)
+@receiver([post_save, post_delete], sender=ActivityLog)
+def bump_fragment_version(sender, **kwargs):
+    """Any change makes the cached fragments showing this model stale (see fragments.py)."""
+    bump_versions(sender)
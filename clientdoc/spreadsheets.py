@@ -0,0 +1,609 @@
+# clientdoc/spreadsheets.py
+"""Excel templates, exports and bulk uploads.
+
+Kept apart from views.py so openpyxl, and the PDF stack the invoice upload
+bundles with, are imported on the first upload or download instead of when a
+worker starts.
+"""
+
+import time
+import logging
+import openpyxl
+from openpyxl.styles import Font, PatternFill, Alignment
+from openpyxl.comments import Comment
+from openpyxl.worksheet.datavalidation import DataValidation
+from django.conf import settings
+from django.db import transaction
+from django.shortcuts import redirect
+from .models import SalesInvoice, InvoiceItem, Item, StoreLocation, DeliveryChallan, TransportCharges, ConfirmationDocument, PackedImage, OurCompanyProfile, Buyer, ItemCategory
+from .bundles import write_combined_pdf
+from .admission import render_slot
+from .line_totals import deferred_line_totals
+from .images import build_derivatives, dhash_file, hamming, FLAT_HASH
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def sample_workbook(upload_type, do_export=False):
+    """Bulk upload template for upload_type, pre-filled with the current records when do_export."""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = f"{upload_type.title()} {'Data' if do_export else 'Template'}"
+    
+    # Define Headers based on Type
+    if upload_type == 'buyer':
+        headers = ["Buyer Name*", "Address", "GSTIN", "State", "Phone", "Email"]
+        widths = [30, 40, 20, 20, 20, 30]
+        
+    elif upload_type == 'item':
+        headers = ["Item Name*", "Category", "Article/SKU", "Description", "Price*", "GST Rate (0.18)*", "HSN Code", "Unit (Nos)"]
+        widths = [30, 20, 20, 40, 15, 15, 15, 15]
+        
+    elif upload_type == 'location':
+        headers = ["Location Name*", "Site Code", "Address", "City", "State", "GSTIN", "Priority"]
+        widths = [30, 15, 40, 20, 20, 20, 15]
+        
+    else: # Invoice
+        headers = [
+            'Buyer Name', 'Location Name', 'Item Name', 'Item Description', 'Quantity', 'Unit Rate', 
+            'SGST', 'CGST', 'IGST', 'Transport Charges', 'Total Amount', 
+            'Generate Invoice (Yes/No)', 'Generate PDF (Yes/No)', 
+            'Tally Invoice No. (Identifier)', 'Invoce Date', 
+            "Buyer's Order No.", "Buyer's Order Date (YYYY-MM-DD)", 
+            'Dispatch Doc No.', 'Dispatched Through', 'Destination', 
+            'Delivery Note', 'Delivery Note Date (YYYY-MM-DD)', 
+            'Mode/Terms of Payment', 'Reference No. & Date', 'Other References', 
+            'Terms of Delivery', 'Remarks', 'DC Notes', 'Transport Description', 
+            'Doc-1 Invoice (Path)', 'Doc-2 DC (Path)', 'Doc-3 Buyer Po (Path)', 'Doc 4 Email approal (Path)', 
+            'Doc-images-1', 'Doc-images-2', 'Doc-images-3', 'Doc-images-4', 'Doc-images-5'
+        ]
+        # Widths mostly uniform
+        widths = [25] * len(headers)
+        widths[0] = 30 # Buyer
+        widths[1] = 30 # Location
+        widths[2] = 30 # Item
+        widths[3] = 40 # Description
+
+    ws.append(headers)
+    
+    # Styles
+    header_font = Font(bold=True, color="FFFFFF")
+    header_fill = PatternFill(start_color="808080", end_color="808080", fill_type="solid") # Grey
+    blue_fill = PatternFill(start_color="0070C0", end_color="0070C0", fill_type="solid") # Blue
+    
+    for cell in ws[1]:
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = Alignment(horizontal='center')
+        
+    # Blue First Column Header
+    ws['A1'].fill = blue_fill
+    
+    # Add Comments for Guidance (Invoice Only)
+    if upload_type == 'invoice':
+        comments_map = {
+            'A1': "Select Buyer from dropdown or ensure exact name match.",
+            'B1': "Select Location (Ship To) from dropdown.",
+            'C1': "Select Item. Description/Price auto-fill if left blank.",
+            'J1': "Fill amount to auto-generate Transport Bill.",
+            'L1': "Must be 'Yes' to process row.",
+            'M1': "Must be 'Yes' to bundle PDFs.",
+            'N1': "Unique ID. Leave blank to auto-generate (Tsol-XXXXX). Use same ID on multiple rows to group items.",
+            'U1': "If filled, Delivery Challan (DC) is auto-created.",
+            'V1': "If filled, Delivery Challan (DC) is auto-created.",
+            'AB1': "Notes for DC. If filled, DC is auto-created.",
+            'AD1': "Absolute file path (e.g. C:\\Docs\\Inv.pdf). Overrides auto-gen invoice.",
+            'AG1': "Absolute file path for Approval Email PDF."
+        }
+        for cell_coord, note in comments_map.items():
+            if cell_coord in ws:
+                ws[cell_coord].comment = Comment(note, "System")
+
+    # Set Widths
+    for i, width in enumerate(widths, 1):
+        col_letter = openpyxl.utils.get_column_letter(i)
+        ws.column_dimensions[col_letter].width = width
+
+    # ---- EXPORT DATA LOGIC ----
+    if do_export:
+        if upload_type == 'buyer':
+            for obj in Buyer.objects.all():
+                ws.append([
+                    obj.name, obj.address, obj.gstin, obj.state, obj.phone, obj.email
+                ])
+        elif upload_type == 'item':
+            for obj in Item.objects.select_related('category').all():
+                ws.append([
+                    obj.name, 
+                    obj.category.name if obj.category else "", 
+                    obj.article_code, 
+                    obj.description, 
+                    obj.price, 
+                    float(obj.gst_rate) if obj.gst_rate else 0.00,
+                    obj.hsn_code, 
+                    obj.unit
+                ])
+        elif upload_type == 'location':
+            for obj in StoreLocation.objects.all():
+                ws.append([
+                    obj.name, obj.site_code, obj.address, obj.city, obj.state, obj.gstin, obj.priority
+                ])
+    
+    # Invoice Specific Logic (Dropdowns etc - Only for Templates/Invoice)
+    if upload_type == 'invoice':
+        # Add Data and Validations
+        data_ws = wb.create_sheet("Reference Data")
+        data_ws.sheet_state = 'hidden' 
+        
+        buyers = list(Buyer.objects.values_list('name', flat=True))
+        locations = list(StoreLocation.objects.values_list('name', flat=True))
+        
+        # Item Data for Auto-Fill (Name, Price, GST)
+        items_qs = Item.objects.all().values_list('name', 'price', 'gst_rate')
+        items = list(items_qs) # List of tuples
+        
+        for i, b in enumerate(buyers, 1): data_ws.cell(row=i, column=1, value=b)
+        for i, l in enumerate(locations, 1): data_ws.cell(row=i, column=2, value=l)
+        
+        # Items in Cols 3, 4, 5 (C, D, E) (Reference Sheet)
+        for i, (name, price, gst) in enumerate(items, 1): 
+            data_ws.cell(row=i, column=3, value=name)
+            data_ws.cell(row=i, column=4, value=price)
+            data_ws.cell(row=i, column=5, value=gst)
+
+        # Named Ranges for Robust Dropdowns
+        from openpyxl.workbook.defined_name import DefinedName
+        
+        # Helper to safer add named range
+        def create_named_range(name, sheet_title, range_ref):
+            d = DefinedName(name, attr_text=f"'{sheet_title}'!{range_ref}")
+            wb.defined_names.add(d)
+
+        if buyers:
+            create_named_range("BuyerList", "Reference Data", f"$A$1:$A${len(buyers)}")
+        if locations:
+            create_named_range("LocList", "Reference Data", f"$B$1:$B${len(locations)}")
+        if items:
+            create_named_range("ItemList", "Reference Data", f"$C$1:$C${len(items)}")
+        
+        def add_val(col, valid_formula):
+             dv = DataValidation(type="list", formula1=valid_formula, allow_blank=True)
+             ws.add_data_validation(dv)
+             dv.add(f"{col}2:{col}500")
+
+        if buyers: add_val('A', "=BuyerList")
+        if locations: add_val('B', "=LocList")
+        if items: add_val('C', "=ItemList")
+        
+        # VLOOKUP Formulas
+        # Item Name is C. Description is D (User fills). Quantity is E. Unit Rate is F.
+        # We want Unit Rate (F) to auto-fill from Reference Data D (Price) based on C (Item Name).
+        # Reference Data: C=Name, D=Price, E=GST
+        
+        nrows = 500
+        for r in range(2, nrows + 1):
+             # Price VLOOKUP
+             ws[f'F{r}'] = f"=IFERROR(VLOOKUP(C{r}, 'Reference Data'!$C$1:$E${len(items)+1}, 2, FALSE), \"\")"
+             
+        # Yes/No Dropdowns for L and M (Indices 11, 12)
+        # 0=A, 1=B, 2=C, 3=D, 4=E, 5=F, 6=G, 7=H, 8=I, 9=J, 10=K
+        # 11 = L (Gen Invoice)
+        # 12 = M (Gen PDF)
+        
+        dv_yn = DataValidation(type="list", formula1='"Yes,No"', allow_blank=False)
+        ws.add_data_validation(dv_yn)
+        dv_yn.add("L2:L500")
+        ws.add_data_validation(dv_yn) 
+        dv_yn.add("M2:M500")
+        
+        # Defaults
+        ws['L2'] = "Yes"
+        ws['M2'] = "Yes" 
+        ws['W2'] = "30 Days" # Mode/Terms (Shifted: Old was V(21). Now 22(W))
+        ws['Y2'] = "EMAIL Approval" # Other Ref (Old X(23). Now 24(Y))
+
+    return wb
+
+# --- PROCESSORS ---
+def process_buyer_upload(record):
+    ws = openpyxl.load_workbook(record.file.path, data_only=True).active
+    log = []
+    for idx, row in enumerate(ws.iter_rows(min_row=2, values_only=True), 2):
+        if not row or not row[0]: continue
+        name = str(row[0]).strip()
+        defaults = {
+            'address': row[1] or "",
+            'gstin': row[2] or "",
+            'state': row[3] or "Karnataka",
+            'phone': row[4] or "",
+            'email': row[5] or ""
+        }
+        obj, created = Buyer.objects.update_or_create(name=name, defaults=defaults)
+        log.append(f"Row {idx}: {'Created' if created else 'Updated'} Buyer '{name}'")
+    
+    record.log += "\n".join(log)
+    record.status = 'Processed'
+    record.save()
+
+def process_item_upload(record):
+    ws = openpyxl.load_workbook(record.file.path, data_only=True).active
+    log = []
+    from decimal import Decimal
+    for idx, row in enumerate(ws.iter_rows(min_row=2, values_only=True), 2):
+        if not row or not row[0]: continue
+        name = str(row[0]).strip()
+        
+        # Category Logic
+        cat_name = row[1]
+        category = None
+        if cat_name:
+            category, _ = ItemCategory.objects.get_or_create(name=str(cat_name).strip())
+            
+        price = 0.00
+        try: price = float(row[4]) if row[4] else 0.00
+        except: pass
+        
+        gst = 0.18
+        try: gst = float(row[5]) if row[5] else 0.18
+        except: pass
+
+        defaults = {
+            'category': category,
+            'article_code': row[2] or "",
+            'description': row[3] or "",
+            'price': Decimal(price),
+            'gst_rate': Decimal(gst),
+            'hsn_code': row[6] or "844311",
+            'unit': row[7] or "Nos"
+        }
+        obj, created = Item.objects.update_or_create(name=name, defaults=defaults)
+        log.append(f"Row {idx}: {'Created' if created else 'Updated'} Item '{name}'")
+        
+        record.log += "\n".join(log)
+        record.status = 'Processed'
+        record.save()
+
+def process_location_upload(record):
+    ws = openpyxl.load_workbook(record.file.path, data_only=True).active
+    log = []
+    for idx, row in enumerate(ws.iter_rows(min_row=2, values_only=True), 2):
+        if not row or not row[0]: continue
+        name = str(row[0]).strip()
+        defaults = {
+            'site_code': row[1] or "",
+            'address': row[2] or "",
+            'city': row[3] or "",
+            'state': row[4] or "Karnataka",
+            'gstin': row[5] or "",
+            'priority': row[6] or ""
+        }
+        obj, created = StoreLocation.objects.update_or_create(name=name, defaults=defaults)
+        log.append(f"Row {idx}: {'Created' if created else 'Updated'} Location '{name}'")
+        
+    record.log += "\n".join(log)
+    record.status = 'Processed'
+    record.save()
+
+@deferred_line_totals()
+def process_invoice_upload(upload_record, linearize=None):
+    """Parses Excel with support for Multiple Items per Invoice using Grouping - Updated Mapping & De-duplications"""
+    started = time.perf_counter()
+    file_path = upload_record.file.path
+    wb = openpyxl.load_workbook(file_path, data_only=True)
+    ws = wb.active
+    
+    log = []
+    created_count = 0
+    updated_count = 0
+    error_count = 0
+    failed_groups = 0
+    row_count = 0
+    
+    from datetime import datetime
+    from decimal import Decimal
+    import uuid
+    from django.core.files import File
+    import os
+    
+    def parse_date(date_val):
+        if not date_val: return None
+        if isinstance(date_val, datetime): return date_val
+        try: return datetime.strptime(str(date_val).strip(), '%Y-%m-%d')
+        except ValueError: return None 
+
+    # --- 1. READ AND GROUP DATA ---
+    grouped_rows = {} 
+    
+    for index, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
+        if not row or not any(row): continue
+        row_count += 1
+        
+        def get_col(idx): return row[idx] if idx < len(row) else None
+        
+        # Mappings Updated (Inserted Description @ 3)
+        # 0: Buyer, 1: Location, 2: Item, 3: DESC (NEW)
+        # 4: Qty, 5: Unit Rate, 6: SGST, 7: CGST, 8: IGST, 9: Trans Charges, 10: Total
+        # 11: Gen Inv, 12: Gen PDF
+        # 13: Tally Inv
+        # 14: Inv Date
+        
+        gen_invoice = get_col(11)
+        if not gen_invoice or str(gen_invoice).strip().lower() != 'yes':
+             log.append(f"Row {index}: Skipped (Generate != Yes)")
+             continue
+
+        location_name = get_col(1)
+        item_name = get_col(2)
+        qty = get_col(4)
+        
+        if not (location_name and item_name and qty):
+             log.append(f"Row {index}: Skipped (Missing essential Item/Location data)")
+             error_count += 1
+             continue
+             
+        tally_no = str(get_col(13)).strip() if get_col(13) else None
+        
+        if tally_no:
+            key = f"TALLY::{tally_no}"
+        else:
+            key = f"UNIQUE::{uuid.uuid4()}" 
+            
+        if key not in grouped_rows:
+            grouped_rows[key] = []
+        
+        row_data = {
+            'index': index,
+            'buyer_name': get_col(0),
+            'location_name': location_name,
+            'item_name': item_name,
+            'item_desc': get_col(3), # New Description
+            'qty': qty,
+            'unit_rate': get_col(5),
+            'trans_charges': get_col(9),
+            'gen_pdf': get_col(12),
+            'tally_no': tally_no,
+            'inv_date': parse_date(get_col(14)),
+            'buyer_ord_no': get_col(15),
+            'buyer_ord_date': parse_date(get_col(16)),
+            'disp_doc_no': get_col(17),
+            'disp_through': get_col(18),
+            'dest': get_col(19),
+            'del_note': get_col(20),
+            'del_note_date': parse_date(get_col(21)),
+            'pay_terms': get_col(22) or "30 Days",
+            'ref_no': get_col(23),
+            'other_ref': get_col(24) or "EMAIL Approval",
+            'terms_del': get_col(25),
+            'remark': get_col(26),
+            'dc_notes': get_col(27),
+            'trans_desc': get_col(28),
+            # File Paths
+            'doc_inv': get_col(29),
+            'doc_dc': get_col(30),
+            'doc_po': get_col(31),
+            'doc_email': get_col(32),
+            'doc_img_1': get_col(33),
+            'doc_img_2': get_col(34),
+            'doc_img_3': get_col(35),
+            'doc_img_4': get_col(36),
+            'doc_img_5': get_col(37),
+        }
+        grouped_rows[key].append(row_data)
+
+    # --- 2. PROCESS GROUPS ---
+    for key, rows in grouped_rows.items():
+        first_row = rows[0]
+        row_indices = [str(r['index']) for r in rows]
+        indices_str = ", ".join(row_indices)
+        
+        try:
+            with transaction.atomic():
+                loc_obj = StoreLocation.objects.filter(name__iexact=str(first_row['location_name']).strip()).first()
+                if not loc_obj:
+                    log.append(f"Rows {indices_str}: Failed - Location '{first_row['location_name']}' not found")
+                    error_count += 1
+                    failed_groups += 1
+                    continue
+                
+                buyer_obj = None
+                if first_row['buyer_name']:
+                    buyer_obj = Buyer.objects.filter(name__iexact=str(first_row['buyer_name']).strip()).first()
+                
+                invoice = None
+                is_update = False
+                
+                if first_row['tally_no']:
+                     invoice = SalesInvoice.objects.filter(tally_invoice_number__iexact=first_row['tally_no']).first()
+                     if invoice: is_update = True
+                
+                header_data = {
+                    'buyer': buyer_obj,
+                    'location': loc_obj,
+                    'tally_invoice_number': first_row['tally_no'],
+                    'buyers_order_no': first_row['buyer_ord_no'],
+                    'buyers_order_date': first_row['buyer_ord_date'] or datetime.now(),
+                    'dispatch_doc_no': first_row['disp_doc_no'],
+                    'dispatched_through': first_row['disp_through'],
+                    'destination': first_row['dest'],
+                    'delivery_note': first_row['del_note'],
+                    'delivery_note_date': first_row['del_note_date'] or datetime.now(),
+                    'mode_terms_payment': first_row['pay_terms'],
+                    'reference_no_date': first_row['ref_no'],
+                    'other_references': first_row['other_ref'],
+                    'terms_of_delivery': first_row['terms_del'],
+                    'remark': first_row['remark'],
+                }
+                
+                if first_row['inv_date']: header_data['date'] = first_row['inv_date']
+
+                if is_update and invoice:
+                     for k, v in header_data.items():
+                         if v is not None: setattr(invoice, k, v)
+                     invoice.save()
+                     log.append(f"Rows {indices_str}: Updated Invoice {invoice.app_invoice_number or invoice.id}")
+                     updated_count += 1
+                else:
+                    if 'date' not in header_data: header_data['date'] = datetime.now()
+                    header_data['status'] = 'DRF'
+                    invoice = SalesInvoice.objects.create(**header_data)
+                    log.append(f"Rows {indices_str}: Created Invoice #{invoice.id}")
+                    created_count += 1
+                    
+                # --- PROCESS ITEMS (Iterate ALL rows in group) ---
+                for r in rows:
+                    item_obj = Item.objects.filter(name__iexact=str(r['item_name']).strip()).first()
+                    if not item_obj:
+                         log.append(f"Row {r['index']}: Warning - Item '{r['item_name']}' not found. Skipped.")
+                         continue
+                    try: q = int(r['qty'])
+                    except: q = 1
+                    
+                    price = item_obj.price
+                    if r['unit_rate']:
+                        try: price = Decimal(str(r['unit_rate']).strip())
+                        except: pass
+                    
+                    # Prevent Duplicates and Fix "Returned more than one" error
+                    # If multiple items exist (from previous bad uploads), delete them first.
+                    existing_dupes = InvoiceItem.objects.filter(invoice=invoice, item=item_obj)
+                    if existing_dupes.count() > 1:
+                        existing_dupes.delete()
+
+                    # Update or Create based on Item
+                    InvoiceItem.objects.update_or_create(
+                        invoice=invoice,
+                        item=item_obj,
+                        defaults={
+                            'quantity': q,
+                            'quantity_billed': q,
+                            'quantity_shipped': q,
+                            'price': price,
+                            'gst_rate': item_obj.gst_rate,
+                            'description': r['item_desc'] 
+                        }
+                    )
+                
+                # Create DC if Notes OR Delivery Note details are present
+                if first_row['dc_notes'] or first_row['del_note'] or first_row['del_note_date']:
+                    dc, _ = DeliveryChallan.objects.get_or_create(invoice=invoice)
+                    if first_row['dc_notes']: 
+                        dc.notes = first_row['dc_notes']
+                    dc.save()
+                    if invoice.status == 'DRF': invoice.status = 'DC'
+                    
+                if first_row['trans_charges']:
+                     try:
+                         amt = Decimal(str(first_row['trans_charges']).strip()) 
+                         trp, _ = TransportCharges.objects.get_or_create(invoice=invoice)
+                         trp.charges = amt
+                         trp.description = first_row['trans_desc']
+                         trp.save()
+                         # Force invoice to be aware if needed or just status update
+                         if invoice.status in ['DRF', 'DC']: invoice.status = 'TRP'
+                     except Exception as e:
+                         log.append(f"Row {first_row['index']}: Warning - Invalid Transport Charge ({e})")
+                
+                invoice.save()
+                
+                # CRITICAL: Calculate total AFTER adding transport charges so Tax Matrix includes them
+                # refresh_from_db isn't strictly needed inside atomic for related objects unless cached, 
+                # but let's be safe for calculate logic.
+                if hasattr(invoice, 'transportcharges'): invoice.transportcharges.refresh_from_db()
+                invoice.calculate_total() 
+                
+                # --- FILE UPLOADS ---
+                # Fix: Check all_objects to handle soft-deleted records to prevent UNIQUE constraint error
+                conf = ConfirmationDocument.all_objects.filter(invoice=invoice).first()
+                if conf:
+                    if conf.is_deleted:
+                        conf.restore()
+                else:
+                    conf = ConfirmationDocument.objects.create(invoice=invoice)
+                
+                def save_file_from_path(path_val, target_field):
+                    if path_val:
+                         path_val = str(path_val).strip() # Clean path
+                         if os.path.exists(path_val):
+                             try:
+                                 with open(path_val, 'rb') as f:
+                                     fname = os.path.basename(path_val)
+                                     target_field.save(fname, File(f), save=True)
+                             except Exception as fe:
+                                 log.append(f" Failed to load file {path_val}: {fe}")
+                         else:
+                             log.append(f" File not found: {path_val}")
+                
+                save_file_from_path(first_row['doc_po'], conf.po_file)
+                save_file_from_path(first_row['doc_email'], conf.approval_email_file)
+                save_file_from_path(first_row['doc_inv'], conf.uploaded_invoice)
+                save_file_from_path(first_row['doc_dc'], conf.uploaded_dc)
+                
+                # --- PACKED IMAGES (Iterate 5 slots) ---
+                img_slots = [first_row[f'doc_img_{i}'] for i in range(1, 6)]
+                known_hashes = [h for h in conf.packedimage_set.values_list('phash', flat=True) if h]
+                for img_path in img_slots:
+                    if img_path:
+                        img_path = str(img_path).strip()
+                        if os.path.exists(img_path):
+                            # Re-uploads and repeated slots often carry the same photo under another name
+                            try:
+                                img_hash = dhash_file(img_path)
+                            except Exception:
+                                img_hash = None
+                            if img_hash == FLAT_HASH:
+                                img_hash = None
+                            if img_hash and any(hamming(img_hash, h) <= settings.PACKED_IMAGE_DUPLICATE_DISTANCE for h in known_hashes):
+                                log.append(f" Duplicate image skipped: {img_path}")
+                                continue
+                            if img_hash:
+                                known_hashes.append(img_hash)
+                            try:
+                                with open(img_path, 'rb') as f:
+                                    pi = PackedImage(confirmation=conf)
+                                    pi.image.save(os.path.basename(img_path), File(f), save=True)
+                                build_derivatives([pi])
+                            except Exception as ie:
+                               log.append(f" Failed to load image {img_path}: {ie}")
+                        else:
+                            log.append(f" Image not found: {img_path}")
+
+                should_gen_pdf = any(str(r['gen_pdf']).strip().lower() == 'yes' for r in rows if r['gen_pdf'])
+
+            # --- PDF GENERATION ---
+            # After the group commits: the render slot and leases are rows other workers must see,
+            # and waiting for them inside the transaction would hold the database write lock
+            if should_gen_pdf:
+                try:
+                    company_profile = OurCompanyProfile.objects.first()
+                    conf.refresh_from_db()
+                    # Bulk bundles put the Email Approval ahead of the Buyer PO
+                    with render_slot('BLK', invoice):
+                        write_combined_pdf(invoice, conf, company_profile, ['invoice', 'dc', 'transport', 'email', 'po'], linearize=linearize)
+                    invoice.status = 'FIN'
+                    invoice.save()
+                    log.append(f" Invoice #{invoice.id}: PDF Generated (Bundled)")
+                except Exception as pdf_err:
+                    logger.error(f"Bulk PDF Error: {pdf_err}")
+                    log.append(f" Invoice #{invoice.id}: PDF Failed ({str(pdf_err)})")
+
+        except Exception as e:
+            log.append(f"Rows {indices_str}: Group Error - {str(e)}")
+            error_count += 1
+            failed_groups += 1
+            import traceback
+            logger.error(traceback.format_exc())
+
+    upload_record.log = "\n".join(log)
+    upload_record.status = 'Processed'
+    upload_record.save()
+
+    elapsed = time.perf_counter() - started
+    metrics.import_rows.inc(row_count)
+    metrics.import_groups.inc(created_count, result='created')
+    metrics.import_groups.inc(updated_count, result='updated')
+    metrics.import_groups.inc(failed_groups, result='failed')
+    if row_count and elapsed > 0:
+        metrics.import_rows_per_second.observe(row_count / elapsed)
+    
+    return redirect('clientdoc:dashboard')
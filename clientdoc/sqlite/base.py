@@ -0,0 +1,55 @@
+# clientdoc/sqlite/base.py
+"""SQLite backend tuned for several workers writing at once.
+
+Every new connection gets the database's PRAGMAS (WAL, synchronous=NORMAL,
+mmap, cache and busy_timeout by default): in WAL mode readers never wait for
+a writer, and a commit no longer needs an exclusive lock on the whole file.
+Transactions start with BEGIN IMMEDIATE, so a transaction that will write
+takes the write lock up front and queues behind other writers via
+busy_timeout. A plain BEGIN takes it on the first write instead, and when two
+such transactions both hold read locks SQLite fails one of them straight away
+with "database is locked", whatever the timeout.
+
+    DATABASES = {'default': {'ENGINE': 'clientdoc.sqlite', 'NAME': ..., 'PRAGMAS': {...}}}
+"""
+
+from django.db.backends.sqlite3 import base
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    # Durable across application crashes; a power cut can lose the last commits, never corrupt the file
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    # Negative values are KiB: 64 MB of page cache per connection
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 30000,
+}
+
+
+def apply_pragmas(conn, pragmas):
+    """Runs PRAGMA name = value for each entry on a DB-API connection."""
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def pragmas(self):
+        pragmas = dict(DEFAULT_PRAGMAS)
+        pragmas.update(self.settings_dict.get('PRAGMAS') or {})
+        if self.is_in_memory_db():
+            # Test databases live in memory, where there is no journal or file to map
+            pragmas.pop('journal_mode', None)
+            pragmas.pop('mmap_size', None)
+        return pragmas
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        apply_pragmas(conn, self.pragmas())
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        # A query_only connection (the reporting alias) never writes; don't take the write lock for it
+        read_only = str(self.pragmas().get('query_only', '')).upper() in ('1', 'ON', 'TRUE')
+        self.cursor().execute('BEGIN' if read_only else 'BEGIN IMMEDIATE')
@@ -0,0 +1,155 @@
+# clientdoc/storage.py
+"""Content-addressed storage for uploaded documents (PO, approval emails, custom invoice/DC).
+
+Each distinct file is stored once as blobs/<ab>/<cd>/<sha256><ext>. MediaBlob keeps
+how many FileField values point at a blob; the references are counted from model
+saves and deletes only (see clientdoc.signals), so a blob is only removed once the
+last row that uses it is hard-deleted or switched to another file.
+
+_save does not count a reference: it stamps the blob's saved_at, and a blob saved
+within MEDIA_BLOB_GRACE_SECONDS is never removed, so content reused by an upload
+whose row isn't saved yet stays on disk. Removing a blob deletes its row in the
+caller's transaction and its file only after that commits, when no row has taken
+the name again. Unreferenced blobs left behind (a failed upload, a release inside
+the grace period) are swept by gc_media.
+"""
+
+import os
+import hashlib
+import logging
+import tempfile
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+BLOB_PREFIX = 'blobs/'
+
+
+def is_blob_name(name):
+    return bool(name) and name.startswith(BLOB_PREFIX)
+
+
+def blob_grace_cutoff():
+    """Blobs saved after this may still get the reference of a row being saved."""
+    return timezone.now() - timedelta(seconds=getattr(settings, 'MEDIA_BLOB_GRACE_SECONDS', 3600))
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage that names files by SHA-256 and skips writing content it already has."""
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is decided by the content hash in _save
+        return name
+
+    def _save(self, name, content):
+        sha = hashlib.sha256()
+        size = 0
+        for chunk in content.chunks():
+            sha.update(chunk)
+            size += len(chunk)
+        digest = sha.hexdigest()
+        ext = os.path.splitext(name)[1].lower()
+        blob_name = f"{BLOB_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+        name = self._touch_blob(digest, blob_name, size)
+
+        # The fresh saved_at keeps release_blob away, so a file found now stays
+        full_path = self.path(name)
+        if not os.path.exists(full_path):
+            directory = os.path.dirname(full_path)
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as out:
+                    for chunk in content.chunks():
+                        out.write(chunk)
+                os.chmod(tmp_path, self.file_permissions_mode or 0o644)
+                # Same content under the same name, so a concurrent writer racing us is harmless
+                os.replace(tmp_path, full_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        return name
+
+    def _touch_blob(self, digest, blob_name, size):
+        """Stamps the row of the blob with this digest as just saved, creating it if needed; returns its name."""
+        from .models import MediaBlob
+        while True:
+            now = timezone.now()
+            if MediaBlob.objects.filter(sha256=digest).update(saved_at=now):
+                return MediaBlob.objects.filter(sha256=digest).values_list('name', flat=True).get()
+            try:
+                with transaction.atomic():
+                    return MediaBlob.objects.create(sha256=digest, name=blob_name, size=size, saved_at=now).name
+            except IntegrityError:
+                # Created (or removed and created again) by someone else since the update
+                continue
+
+    def delete(self, name):
+        if not is_blob_name(name):
+            return super().delete(name)
+        # Blobs go away when their refcount reaches zero (release_blob), not on FieldFile.delete()
+        self._remove_blob(name)
+
+    def _remove_blob(self, name):
+        """Deletes the blob's row if nothing references it; the file goes once that commits."""
+        from .models import MediaBlob
+        deleted, _ = MediaBlob.objects.filter(name=name, refcount__lte=0).filter(
+            Q(saved_at__isnull=True) | Q(saved_at__lt=blob_grace_cutoff())).delete()
+        if deleted:
+            # A rollback brings the row back, so the file must stay until the delete commits
+            transaction.on_commit(lambda: self._remove_unindexed_file(name))
+        return bool(deleted)
+
+    def _remove_unindexed_file(self, name):
+        from .models import MediaBlob
+        # An upload of the same content may have created the row again since
+        if MediaBlob.objects.filter(name=name).exists():
+            return
+        try:
+            super().delete(name)
+        except Exception as e:
+            logger.error(f"Failed to remove blob {name}: {e}")
+
+
+_blob_storage = None
+
+
+def get_blob_storage():
+    """Callable for FileField(storage=...), so migrations don't serialize the instance."""
+    global _blob_storage
+    if _blob_storage is None:
+        _blob_storage = ContentAddressedStorage()
+    return _blob_storage
+
+
+def retain_blob(name):
+    """Adds one reference: a row was saved pointing at the blob."""
+    from .models import MediaBlob
+    if not is_blob_name(name):
+        return
+    if not MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + 1):
+        logger.warning(f"Blob {name} has no MediaBlob row; its reference is not counted")
+
+
+def release_blob(name):
+    """Drops one reference; removes the blob when nothing points at it any more."""
+    from .models import MediaBlob
+    if not is_blob_name(name):
+        return
+    with transaction.atomic():
+        MediaBlob.objects.filter(name=name, refcount__gt=0).update(refcount=F('refcount') - 1)
+        get_blob_storage()._remove_blob(name)
+
+
+def blob_fields(model):
+    """FileFields of a model that use the content-addressed storage."""
+    from django.db.models import FileField
+    return [f for f in model._meta.get_fields()
+            if isinstance(f, FileField) and isinstance(f.storage, ContentAddressedStorage)]
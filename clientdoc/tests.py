@@ -1,3 +1,808 @@
-from django.test import TestCase
+# clientdoc/tests.py
 
-# Create your tests here.
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+from PIL import Image
+from PyPDF2 import PdfReader
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.urls import resolve, reverse
+from . import bulk, bundles, line_totals
+from .admission import create_ticket, finish, render_slot, try_admit
+from .bulk import insert_rows
+from .models import (
+    SalesInvoice, InvoiceItem, Item, StoreLocation, Buyer, TransportCharges, OurCompanyProfile, ConfirmationDocument,
+    DeliveryChallan, MediaBlob, RenderJob, RenderLease, GST_TOTAL_FIELDS, LINE_TOTAL_FIELDS,
+)
+from .line_totals import deferred_line_totals, line_taxable_paise
+from .leases import acquire_lease, run_leased
+from .management.commands.seed_synthetic import LINE_FIELDS
+from .prerender import run_due_jobs
+from .querybudget import assert_query_budget
+from .render_cache import bundle_fingerprint
+from .routers import PIN_COOKIE
+from .storage import get_blob_storage
+from .views import FORMSET_BUDGET_LINES
+
+
+def temporary_media(test):
+    """Points MEDIA_ROOT and RENDER_CACHE_DIR at a directory removed after the test."""
+    directory = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+    settings_override = override_settings(MEDIA_ROOT=directory, RENDER_CACHE_DIR=f"{directory}/render_cache")
+    settings_override.enable()
+    test.addCleanup(settings_override.disable)
+
+
+def file_database(test):
+    """Moves an in-memory SQLite test database into a file for the test.
+
+    Threads then queue on WAL and busy_timeout as in production; the shared
+    in-memory database fails concurrent writers with "database table is locked".
+    """
+    if connection.vendor != 'sqlite' or not connection.is_in_memory_db():
+        return
+    directory = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+    path = os.path.join(directory, 'test.sqlite3')
+    connection.ensure_connection()
+    with closing(sqlite3.connect(path)) as target:
+        connection.connection.backup(target)
+    # Closing the in-memory connection would drop the database, so it is only set aside
+    memory_name, memory_connection = connection.settings_dict['NAME'], connection.connection
+    connection.connection = None
+    connection.settings_dict['NAME'] = path
+
+    def restore():
+        connection.close()
+        connection.settings_dict['NAME'] = memory_name
+        connection.connection = memory_connection
+    test.addCleanup(restore)
+
+
+def make_item(name, gst_rate='0.18', price='100.00'):
+    return Item.objects.create(name=name, price=Decimal(price), gst_rate=Decimal(gst_rate))
+
+
+def add_line(invoice, item, quantity, price, discount_type='Percentage', discount_value='0.00'):
+    return InvoiceItem.objects.create(
+        invoice=invoice, item=item, quantity=quantity, price=Decimal(price), gst_rate=item.gst_rate,
+        discount_type=discount_type, discount_value=Decimal(discount_value),
+    )
+
+
+def jpeg_upload(name, shade=0):
+    out = BytesIO()
+    Image.new('RGB', (64, 48), (shade % 256, 80, 160)).save(out, 'JPEG')
+    return SimpleUploadedFile(name, out.getvalue(), content_type='image/jpeg')
+
+
+def item_formset_data(items, lines=()):
+    """POST data for InvoiceItemFormSet: the existing `lines` followed by new lines for `items`."""
+    data = {
+        'invoiceitem_set-TOTAL_FORMS': len(lines) + len(items), 'invoiceitem_set-INITIAL_FORMS': len(lines),
+        'invoiceitem_set-MIN_NUM_FORMS': 0, 'invoiceitem_set-MAX_NUM_FORMS': 1000,
+    }
+    rows = [(line.item_id, line.id) for line in lines] + [(item.id, '') for item in items]
+    for n, (item_id, line_id) in enumerate(rows):
+        data.update({
+            f'invoiceitem_set-{n}-id': line_id, f'invoiceitem_set-{n}-item': item_id,
+            f'invoiceitem_set-{n}-quantity_billed': 3, f'invoiceitem_set-{n}-price': '120.00',
+            f'invoiceitem_set-{n}-discount_type': 'Percentage', f'invoiceitem_set-{n}-discount_value': '0.00',
+            f'invoiceitem_set-{n}-gst_rate': '0.18',
+        })
+    return data
+
+
+class RecomputeTotalsTests(TestCase):
+    """recompute_totals must write exactly what calculate_gst_totals computes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        OurCompanyProfile.objects.create(name='Company', address='Bengaluru', state_code='29')
+        cls.local = StoreLocation.objects.create(name='Local', address='a', city='Bengaluru', gstin='29AAAAA0000A1Z5')
+        cls.remote = StoreLocation.objects.create(name='Remote', address='b', city='Mumbai', state='Maharashtra')
+        cls.buyer = Buyer.objects.create(name='Buyer', address='c', gstin='29BBBBB0000B1Z5')
+        cls.items = [make_item(f'Item {rate}', rate) for rate in ('0.05', '0.12', '0.18', '0.28')]
+
+    def stored_totals(self, invoice):
+        return {name: getattr(invoice, name) for name in GST_TOTAL_FIELDS}
+
+    def test_matches_calculate_gst_totals(self):
+        rng = random.Random(7)
+        invoices = []
+        for n in range(60):
+            invoice = SalesInvoice.objects.create(
+                location=self.remote if n % 2 else self.local,
+                buyer=self.buyer if n % 3 else None,
+                place_of_supply=[None, '29', '27'][n % 3],
+            )
+            for _ in range(rng.randint(0, 5)):
+                discount_type = rng.choice(['Percentage', 'Amount'])
+                discount_value = rng.choice(['0.00', '5.00', '12.50', '33.33', '7.77'])
+                add_line(invoice, rng.choice(self.items), rng.randint(1, 40), f'{rng.randint(1, 99999) / 100:.2f}',
+                         discount_type, discount_value)
+            if n % 4 == 0:
+                TransportCharges.objects.create(invoice=invoice, charges=Decimal(rng.randint(1, 99999)) / 100)
+            invoices.append(invoice.pk)
+        # Stale totals, as after a GST rate or company state change
+        SalesInvoice.all_objects.update(cgst_total=Decimal('1.00'), sgst_total=Decimal('1.00'),
+                                        igst_total=Decimal('1.00'), total=Decimal('1.00'), amount_in_words=None)
+
+        call_command('recompute_totals', chunk_size=25, stdout=StringIO())
+
+        for invoice in SalesInvoice.all_objects.filter(pk__in=invoices):
+            stored = self.stored_totals(invoice)
+            invoice.calculate_gst_totals()
+            self.assertEqual(stored, self.stored_totals(invoice), f"invoice {invoice.pk}")
+
+    def test_inter_and_intra_state_split(self):
+        local = SalesInvoice.objects.create(location=self.local)
+        remote = SalesInvoice.objects.create(location=self.remote)
+        for invoice in (local, remote):
+            add_line(invoice, self.items[2], 3, '333.33', 'Percentage', '12.50')
+            add_line(invoice, self.items[3], 1, '99.99', 'Amount', '10.00')
+            TransportCharges.objects.create(invoice=invoice, charges=Decimal('150.25'))
+        SalesInvoice.all_objects.update(cgst_total=0, sgst_total=0, igst_total=0, total=0)
+
+        call_command('recompute_totals', stdout=StringIO())
+
+        local.refresh_from_db()
+        remote.refresh_from_db()
+        self.assertEqual(local.igst_total, Decimal('0.00'))
+        self.assertEqual(local.cgst_total, local.sgst_total)
+        self.assertEqual(remote.cgst_total + remote.sgst_total, Decimal('0.00'))
+        self.assertEqual(remote.igst_total, local.cgst_total + local.sgst_total)
+        self.assertEqual(local.total, remote.total)
+        for invoice in (local, remote):
+            stored = self.stored_totals(invoice)
+            invoice.calculate_gst_totals()
+            self.assertEqual(stored, self.stored_totals(invoice))
+
+    @override_settings(DEBUG=True)
+    def test_dry_run_writes_nothing(self):
+        # DEBUG formats every executed query with its params, so a bare % in the SQL would fail here
+        invoice = SalesInvoice.objects.create(location=self.local)
+        add_line(invoice, self.items[0], 2, '10.00')
+        SalesInvoice.all_objects.filter(pk=invoice.pk).update(total=Decimal('1.00'))
+        out = StringIO()
+        call_command('recompute_totals', dry_run=True, stdout=out)
+        self.assertIn('Would update 1', out.getvalue())
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.total, Decimal('1.00'))
+
+
+class LineTotalsTests(TestCase):
+    """item_count, total_qty and taxable_total follow the invoice's lines however they change."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.location = StoreLocation.objects.create(name='Local', address='a', city='Bengaluru')
+        cls.items = [make_item(f'Item {rate}', rate) for rate in ('0.05', '0.18', '0.28')]
+
+    def expected_totals(self, invoice):
+        lines = list(InvoiceItem.objects.filter(invoice=invoice))
+        return len(lines), sum(line.quantity for line in lines), sum((line.taxable_value for line in lines), Decimal('0.00'))
+
+    def assertLineTotals(self, invoice, expected=None):
+        stored = SalesInvoice.all_objects.values_list(*LINE_TOTAL_FIELDS).get(pk=invoice.pk)
+        self.assertEqual(stored, expected or self.expected_totals(invoice))
+
+    def test_add_edit_and_delete_lines(self):
+        invoice = SalesInvoice.objects.create(location=self.location)
+        first = add_line(invoice, self.items[0], 3, '199.99', 'Percentage', '12.50')
+        second = add_line(invoice, self.items[1], 7, '45.55', 'Amount', '10.00')
+        self.assertLineTotals(invoice, (2, 10, first.taxable_value + second.taxable_value))
+
+        first.quantity, first.price, first.discount_value = 5, Decimal('210.01'), Decimal('33.33')
+        first.save()
+        second.discount_type = 'Percentage'
+        second.save()
+        self.assertLineTotals(invoice)
+
+        first.delete()
+        self.assertLineTotals(invoice, (1, 7, second.taxable_value))
+        second.delete()
+        self.assertLineTotals(invoice, (0, 0, Decimal('0.00')))
+
+    def test_line_moved_to_another_invoice(self):
+        source = SalesInvoice.objects.create(location=self.location)
+        target = SalesInvoice.objects.create(location=self.location)
+        add_line(source, self.items[0], 2, '10.00')
+        moved = add_line(source, self.items[1], 4, '99.95', 'Percentage', '7.77')
+        add_line(target, self.items[2], 1, '500.00')
+
+        moved.invoice = target
+        moved.quantity = 6
+        moved.save()
+
+        self.assertLineTotals(source, (1, 2, Decimal('20.00')))
+        self.assertLineTotals(target)
+        self.assertEqual(SalesInvoice.all_objects.get(pk=target.pk).item_count, 2)
+
+    def test_sql_taxable_value_matches_python(self):
+        rng = random.Random(11)
+        invoice = SalesInvoice.objects.create(location=self.location)
+        for _ in range(200):
+            add_line(invoice, rng.choice(self.items), rng.randint(1, 50), f'{rng.randint(1, 99999) / 100:.2f}',
+                     rng.choice(['Percentage', 'Amount']), rng.choice(['0.00', '2.50', '12.50', '33.33', '7.77', '99.99']))
+        # Halfway discounts round to even: 5% of 0.10 is 0.00 and 5% of 0.30 is 0.02
+        add_line(invoice, self.items[0], 1, '0.10', 'Percentage', '5.00')
+        add_line(invoice, self.items[0], 3, '0.10', 'Percentage', '5.00')
+        # A discount bigger than the line leaves nothing taxable
+        add_line(invoice, self.items[0], 1, '5.00', 'Amount', '9.00')
+
+        lines = InvoiceItem.objects.filter(invoice=invoice).annotate(taxable_paise=line_taxable_paise())
+        for line in lines:
+            self.assertEqual(Decimal(line.taxable_paise) / 100, line.taxable_value, f"line {line.pk}")
+        self.assertLineTotals(invoice)
+        self.assertEqual(list(line_totals.find_drift([invoice.pk])), [])
+
+    def test_deferred_line_totals(self):
+        calculated = SalesInvoice.objects.create(location=self.location)
+        refreshed = SalesInvoice.objects.create(location=self.location)
+        refresh = mock.patch.object(line_totals, 'refresh_line_totals', wraps=line_totals.refresh_line_totals)
+        with refresh as refresh_line_totals, deferred_line_totals():
+            for invoice in (calculated, refreshed):
+                add_line(invoice, self.items[1], 2, '150.00')
+                add_line(invoice, self.items[2], 1, '80.50', 'Amount', '0.50')
+            # No per-line updates inside the block
+            self.assertLineTotals(refreshed, (0, 0, Decimal('0.00')))
+            calculated.calculate_gst_totals()
+
+        # calculate_gst_totals saved its invoice's totals, so only the other one is refreshed
+        refresh_line_totals.assert_called_once_with({refreshed.pk})
+        for invoice in (calculated, refreshed):
+            self.assertLineTotals(invoice, (2, 3, Decimal('380.00')))
+
+    def test_verify_line_totals_repairs_drift(self):
+        invoices = [SalesInvoice.objects.create(location=self.location) for _ in range(3)]
+        for n, invoice in enumerate(invoices):
+            add_line(invoice, self.items[n], n + 1, '25.25', 'Percentage', '10.00')
+        # Drift, as after raw SQL or restoring a backup
+        SalesInvoice.all_objects.filter(pk__in=[invoices[0].pk, invoices[2].pk]).update(
+            item_count=9, total_qty=0, taxable_total=Decimal('1.00'))
+
+        out = StringIO()
+        call_command('verify_line_totals', dry_run=True, stdout=out)
+        self.assertIn('Found 2 drifted invoices', out.getvalue())
+        self.assertLineTotals(invoices[0], (9, 0, Decimal('1.00')))
+
+        out = StringIO()
+        call_command('verify_line_totals', stdout=out)
+        self.assertIn('Repaired 2 drifted invoices', out.getvalue())
+        for invoice in invoices:
+            self.assertLineTotals(invoice)
+        call_command('verify_line_totals', dry_run=True, stdout=out)
+        self.assertIn('Found 0 drifted invoices', out.getvalue())
+
+
+@override_settings(MEDIA_BLOB_GRACE_SECONDS=0)
+class BlobTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.location = StoreLocation.objects.create(name='Local', address='a', city='Bengaluru')
+
+    def setUp(self):
+        temporary_media(self)
+
+    def confirmation(self):
+        return ConfirmationDocument.objects.create(invoice=SalesInvoice.objects.create(location=self.location))
+
+    def upload(self, confirmation, content, name='po.pdf'):
+        with self.captureOnCommitCallbacks(execute=True):
+            confirmation.po_file.save(name, ContentFile(content), save=True)
+        return confirmation.po_file.name
+
+    def blob(self, name):
+        return MediaBlob.objects.filter(name=name).first()
+
+    def assertBlob(self, name, refcount):
+        blob = self.blob(name)
+        if refcount is None:
+            self.assertIsNone(blob)
+            self.assertFalse(get_blob_storage().exists(name))
+        else:
+            self.assertEqual(blob.refcount, refcount)
+            self.assertTrue(get_blob_storage().exists(name))
+
+
+class BlobRefcountTests(BlobTestCase):
+    """MediaBlob refcounts follow the rows pointing at each blob, and files go only with their last reference."""
+
+    def test_identical_uploads_share_one_blob(self):
+        first, second = self.confirmation(), self.confirmation()
+        name = self.upload(first, b'%PDF-1.4 purchase order')
+        self.assertEqual(self.upload(second, b'%PDF-1.4 purchase order', 'copy.pdf'), name)
+        self.assertBlob(name, 2)
+        self.assertEqual(MediaBlob.objects.count(), 1)
+
+    def test_saving_the_same_file_again_keeps_the_count(self):
+        confirmation = self.confirmation()
+        name = self.upload(confirmation, b'order')
+        self.upload(confirmation, b'order')
+        confirmation.save()
+        self.assertBlob(name, 1)
+
+    def test_storage_save_without_a_row_adds_no_reference(self):
+        confirmation = self.confirmation()
+        name = self.upload(confirmation, b'order')
+        # Content stored but never saved on a row: a save rolled back after the upload
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.assertEqual(get_blob_storage().save('stray.pdf', ContentFile(b'order')), name)
+            raise RuntimeError('form failed')
+        confirmation.save()
+        ConfirmationDocument.all_objects.get(pk=confirmation.pk).save()
+        self.assertBlob(name, 1)
+
+    def test_replacing_a_file_releases_the_old_blob(self):
+        confirmation = self.confirmation()
+        old = self.upload(confirmation, b'first order')
+        new = self.upload(confirmation, b'second order')
+        self.assertBlob(old, None)
+        self.assertBlob(new, 1)
+
+    def test_blob_is_removed_with_its_last_reference(self):
+        first, second = self.confirmation(), self.confirmation()
+        name = self.upload(first, b'order')
+        self.upload(second, b'order')
+        with self.captureOnCommitCallbacks(execute=True):
+            first.hard_delete()
+        self.assertBlob(name, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            second.hard_delete()
+        self.assertBlob(name, None)
+
+    def test_rolled_back_delete_keeps_the_file(self):
+        confirmation = self.confirmation()
+        name = self.upload(confirmation, b'order')
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                confirmation.hard_delete()
+                raise RuntimeError('import group failed')
+        self.assertEqual(callbacks, [])
+        self.assertBlob(name, 1)
+
+    @override_settings(MEDIA_BLOB_GRACE_SECONDS=600)
+    def test_recently_uploaded_blob_outlives_its_release(self):
+        confirmation = self.confirmation()
+        name = self.upload(confirmation, b'order')
+        # Another upload of this content may be about to save its row
+        with self.captureOnCommitCallbacks(execute=True):
+            confirmation.hard_delete()
+        self.assertBlob(name, 0)
+        self.assertEqual(self.upload(self.confirmation(), b'order'), name)
+        self.assertBlob(name, 1)
+
+
+class GcMediaTests(BlobTestCase):
+    """gc_media acts on the references at write time, not those it saw when the scan started."""
+
+    def gc_media(self, **options):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('gc_media', min_age_hours=0, stdout=StringIO(), **options)
+
+    def test_keeps_files_referenced_since_the_scan(self):
+        referenced = self.upload(self.confirmation(), b'order')
+        orphan = get_blob_storage().save('orphan.pdf', ContentFile(b'never saved on a row'))
+        # As if the upload landed after the scan collected the live references
+        with mock.patch('clientdoc.management.commands.gc_media.Command.live_references', return_value=set()):
+            self.gc_media()
+        self.assertBlob(referenced, 1)
+        self.assertBlob(orphan, None)
+
+    def test_reconciles_drifted_refcounts(self):
+        name = self.upload(self.confirmation(), b'order')
+        self.upload(self.confirmation(), b'order')
+        MediaBlob.objects.filter(name=name).update(refcount=7)
+        self.gc_media(dry_run=True)
+        self.assertEqual(self.blob(name).refcount, 7)
+        self.gc_media()
+        self.assertBlob(name, 2)
+
+
+@override_settings(PRERENDER_ENABLED=True, PRERENDER_DEBOUNCE_SECONDS=0)
+class PrerenderTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        OurCompanyProfile.objects.create(name='Company', address='Bengaluru')
+        cls.location = StoreLocation.objects.create(name='Local', address='a', city='Bengaluru')
+        cls.item = make_item('Printer')
+
+    def setUp(self):
+        temporary_media(self)
+
+    def test_prerender_does_not_requeue_itself(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice = SalesInvoice.objects.create(location=self.location, status='DC')
+            add_line(invoice, self.item, 2, '150.00')
+            invoice.calculate_gst_totals()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(run_due_jobs(limit=1), 1)
+
+        # Rendering is not an edit: no save, so nothing queued again
+        self.assertEqual(RenderJob.objects.get(invoice=invoice).status, 'DON')
+        self.assertEqual(run_due_jobs(), 0)
+
+    def test_one_schedule_per_invoice_and_transaction(self):
+        with mock.patch('clientdoc.prerender.schedule_job') as schedule_job:
+            with self.captureOnCommitCallbacks(execute=True):
+                invoice = SalesInvoice.objects.create(location=self.location, status='DC')
+                other = SalesInvoice.objects.create(location=self.location, status='TRP')
+                for _ in range(5):
+                    add_line(invoice, self.item, 1, '150.00')
+                add_line(other, self.item, 1, '150.00')
+                invoice.calculate_gst_totals()
+        self.assertEqual(schedule_job.call_args_list, [mock.call(invoice.pk), mock.call(other.pk)])
+
+    def test_rolled_back_block_does_not_lose_later_schedules(self):
+        with mock.patch('clientdoc.prerender.schedule_job') as schedule_job:
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertRaises(RuntimeError), transaction.atomic():
+                    SalesInvoice.objects.create(location=self.location, status='DC')
+                    raise RuntimeError('import group failed')
+                invoice = SalesInvoice.objects.create(location=self.location, status='DC')
+        schedule_job.assert_called_once_with(invoice.pk)
+
+    def test_finalized_invoice_is_not_prerendered(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice = SalesInvoice.objects.create(location=self.location, status='TRP')
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice.status = 'FIN'
+            invoice.save()
+            add_line(invoice, self.item, 1, '150.00')
+        # Only the TRP save queued a job, and it has nothing left to render for a finalized invoice
+        self.assertEqual(RenderJob.objects.filter(invoice=invoice).count(), 1)
+        with mock.patch('clientdoc.prerender.prerender_invoice') as prerender_invoice:
+            self.assertEqual(run_due_jobs(), 1)
+        prerender_invoice.assert_not_called()
+
+
+@override_settings(FRAGMENT_CACHE_ENABLED=False)
+class QueryBudgetTests(TestCase):
+    """Views stay within the query budget they declare, however many rows and lines there are."""
+
+    @classmethod
+    def setUpTestData(cls):
+        OurCompanyProfile.objects.create(name='Company', address='Bengaluru')
+        cls.location = StoreLocation.objects.create(name='Local', address='a', city='Bengaluru')
+        cls.buyer = Buyer.objects.create(name='Buyer', address='c')
+        cls.items = [make_item(f'Item {n}') for n in range(FORMSET_BUDGET_LINES)]
+        # More than a page of everything, so a per-row query shows up as a repeat
+        for n in range(25):
+            invoice = SalesInvoice.objects.create(location=cls.location, buyer=cls.buyer, status='TRP')
+            for item in cls.items[n % 5:n % 5 + 3]:
+                add_line(invoice, item, 2, '150.00')
+            DeliveryChallan.objects.create(invoice=invoice)
+            TransportCharges.objects.create(invoice=invoice, charges=Decimal('250.00'))
+            ConfirmationDocument.objects.create(invoice=invoice)
+        cls.invoice = invoice
+
+    def setUp(self):
+        temporary_media(self)
+        # Reporting views read the primary: the reporting connection can't see this test's uncommitted rows
+        self.client.cookies[PIN_COOKIE] = '1'
+
+    def request_within_budget(self, url, data=None):
+        budget = resolve(url).func.query_budget
+        with assert_query_budget(budget.max_queries, budget.max_repeats, label=url):
+            if data is None:
+                return self.client.get(url)
+            return self.client.post(url, data)
+
+    def test_list_views_and_dashboard(self):
+        for name in ('dashboard', 'invoice_list', 'dc_list', 'transport_list', 'confirmation_list',
+                     'buyer_list', 'item_list', 'store_location_list', 'trash_list'):
+            with self.subTest(view=name):
+                response = self.request_within_budget(reverse(f'clientdoc:{name}'))
+                self.assertEqual(response.status_code, 200)
+
+    def test_create_invoice_with_full_formset(self):
+        data = item_formset_data(self.items)
+        data['location'] = self.location.id
+        response = self.request_within_budget(reverse('clientdoc:create_invoice'), data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(SalesInvoice.objects.latest('pk').item_count, FORMSET_BUDGET_LINES)
+
+    def test_edit_invoice_with_full_formset(self):
+        invoice = SalesInvoice.objects.create(location=self.location, status='DRF')
+        lines = [add_line(invoice, item, 1, '100.00') for item in self.items]
+        url = reverse('clientdoc:edit_invoice', args=[invoice.id])
+        self.assertEqual(self.request_within_budget(url).status_code, 200)
+
+        data = item_formset_data([], lines)
+        data.update({
+            'location': self.location.id, 'buyer': self.buyer.id, 'date': '2026-01-05 10:00',
+            'mode_terms_payment': 'Credit', 'other_references': '-',
+            'buyers_order_date': '2026-01-02 10:00', 'delivery_note_date': '2026-01-05 10:00',
+        })
+        response = self.request_within_budget(url, data)
+        self.assertEqual(response.status_code, 302)
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.taxable_total, Decimal('120.00') * FORMSET_BUDGET_LINES)
+
+    def test_confirmation_with_full_image_formset(self):
+        url = reverse('clientdoc:create_confirmation', args=[self.invoice.id])
+        self.assertEqual(self.request_within_budget(url).status_code, 200)
+
+        data = {
+            'packedimage_set-TOTAL_FORMS': FORMSET_BUDGET_LINES, 'packedimage_set-INITIAL_FORMS': 0,
+            'packedimage_set-MIN_NUM_FORMS': 0, 'packedimage_set-MAX_NUM_FORMS': 1000, 'save_notes': '1',
+        }
+        for n in range(FORMSET_BUDGET_LINES):
+            data[f'packedimage_set-{n}-image'] = jpeg_upload(f'carton-{n}.jpg', n * 5)
+            data[f'packedimage_set-{n}-notes'] = f'Carton {n + 1}'
+        response = self.request_within_budget(url, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.invoice.confirmationdocument.packedimage_set.count(), FORMSET_BUDGET_LINES)
+
+
+class DownloadRangeTests(TestCase):
+    """download_document serves byte ranges and answers conditional requests without rendering."""
+
+    @classmethod
+    def setUpTestData(cls):
+        OurCompanyProfile.objects.create(name='Company', address='Bengaluru')
+        location = StoreLocation.objects.create(name='Local', address='a', city='Bengaluru')
+        cls.invoice = SalesInvoice.objects.create(location=location, status='TRP')
+        add_line(cls.invoice, make_item('Printer'), 2, '150.00')
+        cls.invoice.calculate_gst_totals()
+        cls.url = reverse('clientdoc:download_document', args=[cls.invoice.id, 'invoice'])
+
+    def setUp(self):
+        temporary_media(self)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.pdf = self.content(response)
+        self.etag = response['ETag']
+
+    def content(self, response):
+        try:
+            return b''.join(response.streaming_content)
+        finally:
+            response.close()
+
+    def test_full_download(self):
+        self.assertTrue(self.pdf.startswith(b'%PDF'))
+        response = self.client.get(self.url)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(int(response['Content-Length']), len(self.pdf))
+        self.assertEqual(self.content(response), self.pdf)
+
+    def test_satisfiable_ranges(self):
+        size = len(self.pdf)
+        for header, start, end in [('bytes=0-99', 0, 99), ('bytes=-10', size - 10, size - 1),
+                                   (f'bytes={size - 5}-{size + 100}', size - 5, size - 1)]:
+            with self.subTest(header):
+                response = self.client.get(self.url, HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(response['Content-Range'], f"bytes {start}-{end}/{size}")
+                self.assertEqual(int(response['Content-Length']), end - start + 1)
+                self.assertEqual(self.content(response), self.pdf[start:end + 1])
+
+    def test_unsatisfiable_range(self):
+        size = len(self.pdf)
+        for header in (f'bytes={size}-', 'bytes=-0', 'bytes=20-10'):
+            with self.subTest(header):
+                response = self.client.get(self.url, HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 416)
+                self.assertEqual(response['Content-Range'], f"bytes */{size}")
+
+    def test_if_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-99', HTTP_IF_RANGE=self.etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.content(response), self.pdf[:100])
+        # The client's copy is stale: it gets the whole current file instead of a mismatched piece
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-99', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.content(response), self.pdf)
+
+    def test_if_none_match_skips_rendering(self):
+        with mock.patch('clientdoc.views.cached_section') as cached_section:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=self.etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], self.etag)
+        cached_section.assert_not_called()
+        # An edit changes the fingerprint, so the old ETag no longer matches
+        add_line(self.invoice, make_item('Toner'), 1, '50.00')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=self.etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], self.etag)
+        response.close()
+
+
+class BulkInsertTests(TestCase):
+    """insert_rows stores exactly the values it is given, whichever path the backend takes."""
+
+    DESCRIPTIONS = ['Plain', 'Comma, "quoted" and\nmultiline', 'Back\\slash\ttab', '', None]
+
+    @classmethod
+    def setUpTestData(cls):
+        location = StoreLocation.objects.create(name='Local', address='a', city='Bengaluru')
+        cls.invoice = SalesInvoice.objects.create(location=location)
+        cls.item = make_item('Printer')
+
+    def insert_lines(self):
+        rows = [(self.invoice.pk, self.item.pk, n + 1, Decimal('10.50'), description,
+                 n + 1, n + 1, 'Percentage', Decimal('0.00'), self.item.gst_rate)
+                for n, description in enumerate(self.DESCRIPTIONS)]
+        insert_rows(InvoiceItem, LINE_FIELDS, rows)
+        stored = InvoiceItem.objects.filter(invoice=self.invoice).order_by('quantity')
+        self.assertEqual([line.description for line in stored], self.DESCRIPTIONS)
+        self.assertEqual({line.price for line in stored}, {Decimal('10.50')})
+
+    def test_round_trip(self):
+        self.insert_lines()
+
+    @skipUnless(connection.vendor == 'postgresql', 'COPY is only used on PostgreSQL')
+    def test_postgres_loads_with_copy(self):
+        with mock.patch.object(bulk, '_copy_psycopg3', wraps=bulk._copy_psycopg3) as copy3, \
+                mock.patch.object(bulk, '_copy_psycopg2', wraps=bulk._copy_psycopg2) as copy2:
+            self.insert_lines()
+        self.assertEqual(copy3.call_count + copy2.call_count, 1)
+
+    def test_psycopg2_csv_keeps_null_and_empty_apart(self):
+        cursor = mock.Mock()
+        cursor.copy_expert.side_effect = lambda sql, buffer: setattr(cursor, 'sent', buffer.read())
+        bulk._copy_psycopg2(cursor, 'COPY t (a, b) FROM STDIN', [(None, ''), ('say "hi", then\nleave', 1)])
+        cursor.copy_expert.assert_called_once_with('COPY t (a, b) FROM STDIN WITH (FORMAT csv)', mock.ANY)
+        self.assertEqual(cursor.sent, ',""\n"say ""hi"", then\nleave","1"\n')
+
+
+class BundleTests(TestCase):
+    """Bundles are rebuilt from the sections that changed and stored under the fingerprint of what was written."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = OurCompanyProfile.objects.create(name='Company', address='Bengaluru')
+        location = StoreLocation.objects.create(name='Local', address='a', city='Bengaluru')
+        cls.invoice = SalesInvoice.objects.create(location=location, status='TRP')
+        add_line(cls.invoice, make_item('Printer'), 2, '150.00')
+        cls.invoice.calculate_gst_totals()
+        DeliveryChallan.objects.create(invoice=cls.invoice, notes='Vehicle KA01 1234')
+        TransportCharges.objects.create(invoice=cls.invoice, charges=Decimal('250.00'))
+        cls.confirmation = ConfirmationDocument.objects.create(invoice=cls.invoice)
+
+    def setUp(self):
+        temporary_media(self)
+
+    def write_bundle(self, **kwargs):
+        """Writes the bundle and returns the sections it had to render."""
+        invoice = SalesInvoice.objects.get(pk=self.invoice.pk)
+        with mock.patch.object(bundles, 'cached_section', wraps=bundles.cached_section) as cached_section:
+            bundles.write_combined_pdf(invoice, self.confirmation, self.company, **kwargs)
+        return [call.args[1] for call in cached_section.call_args_list]
+
+    def bundle_pages(self):
+        self.confirmation.refresh_from_db()
+        with open(self.confirmation.combined_pdf.path, 'rb') as f:
+            return [page.extract_text() for page in PdfReader(f).pages]
+
+    def test_unchanged_sections_are_reused(self):
+        self.assertEqual(self.write_bundle(), ['invoice', 'dc', 'transport'])
+        first_pages = self.bundle_pages()
+        first_manifest = self.confirmation.bundle_manifest
+
+        DeliveryChallan.objects.filter(invoice=self.invoice).update(notes='Vehicle KA02 5678')
+        self.assertEqual(self.write_bundle(), ['dc'])
+
+        pages = self.bundle_pages()
+        manifest = self.confirmation.bundle_manifest
+        self.assertEqual(len(pages), sum(section['pages'] for section in manifest['sections']))
+        sections = {section['section']: section for section in manifest['sections']}
+        previous = {section['section']: section for section in first_manifest['sections']}
+        for name in ('invoice', 'transport'):
+            self.assertEqual(sections[name], previous[name])
+            start, count = sections[name]['start'], sections[name]['pages']
+            self.assertEqual(pages[start:start + count], first_pages[start:start + count])
+        self.assertNotEqual(sections['dc']['fingerprint'], previous['dc']['fingerprint'])
+        dc_pages = pages[sections['dc']['start']:sections['dc']['start'] + sections['dc']['pages']]
+        self.assertIn('KA02 5678', ''.join(dc_pages))
+
+    def test_failed_linearize_is_not_stored_as_linearized(self):
+        invoice = SalesInvoice.objects.get(pk=self.invoice.pk)
+        with mock.patch.object(bundles, 'linearize_pdf', return_value=False):
+            self.write_bundle(linearize=True)
+        self.confirmation.refresh_from_db()
+        self.assertFalse(self.confirmation.bundle_manifest['linearized'])
+        self.assertEqual(self.confirmation.bundle_fingerprint,
+                         bundle_fingerprint(invoice, self.confirmation, self.company, bundles.DEFAULT_FILE_ORDER))
+
+        # The next linearized request builds the bundle again rather than reusing the regular one
+        with mock.patch.object(bundles, 'linearize_pdf', wraps=bundles.linearize_pdf) as linearize_pdf:
+            self.write_bundle(linearize=True)
+        linearize_pdf.assert_called_once()
+        self.confirmation.refresh_from_db()
+        self.assertTrue(self.confirmation.bundle_manifest['linearized'])
+        self.assertEqual(self.confirmation.bundle_fingerprint,
+                         bundle_fingerprint(invoice, self.confirmation, self.company, bundles.DEFAULT_FILE_ORDER, linearized=True))
+
+
+class ConcurrentFinalizeTests(TransactionTestCase):
+    """The render lease makes simultaneous finalizes of one invoice share a single render."""
+
+    def setUp(self):
+        temporary_media(self)
+        file_database(self)
+        OurCompanyProfile.objects.create(name='Company', address='Bengaluru')
+        location = StoreLocation.objects.create(name='Local', address='a', city='Bengaluru')
+        self.invoice = SalesInvoice.objects.create(location=location, status='TRP')
+        add_line(self.invoice, make_item('Printer'), 2, '150.00')
+        self.invoice.calculate_gst_totals()
+        ConfirmationDocument.objects.create(invoice=self.invoice)
+
+    def test_concurrent_finalizes_render_once(self):
+        write_bundle = bundles._write_bundle
+        renders = []
+
+        def slow_write_bundle(*args):
+            renders.append(threading.get_ident())
+            # Long enough for the other request to find the lease taken
+            time.sleep(0.5)
+            return write_bundle(*args)
+
+        url = reverse('clientdoc:finalize_invoice_pdf', args=[self.invoice.id])
+        start = threading.Barrier(2)
+        statuses = []
+
+        def finalize():
+            try:
+                start.wait()
+                statuses.append(Client().post(url, {'file_order': 'invoice,dc,transport,po,email'}).status_code)
+            finally:
+                connection.close()
+
+        with mock.patch.object(bundles, '_write_bundle', slow_write_bundle):
+            threads = [threading.Thread(target=finalize) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(statuses, [302, 302])
+        self.assertEqual(len(renders), 1)
+        self.assertFalse(RenderLease.objects.exists())
+        confirmation = ConfirmationDocument.objects.get(invoice=self.invoice)
+        self.assertTrue(confirmation.combined_pdf and confirmation.bundle_fingerprint)
+
+
+class LeaseRenewalTests(TransactionTestCase):
+    """Leases and render slots outlive their TTL for as long as the holder is still working."""
+
+    def setUp(self):
+        file_database(self)
+
+    def test_running_work_keeps_its_lease(self):
+        def slow_work():
+            # Three TTLs: without renewal the lease is free for the taking by now
+            time.sleep(0.9)
+            return acquire_lease('bundle:1')
+
+        stolen, reused = run_leased('bundle:1', 'fp', work=slow_work, reuse=lambda: None, ttl=0.3)
+        self.assertFalse(reused)
+        self.assertIsNone(stolen)
+        self.assertFalse(RenderLease.objects.exists())
+
+    @override_settings(RENDER_LEASE_TTL_SECONDS=0.3, RENDER_CONCURRENCY=1)
+    def test_running_render_keeps_its_slot(self):
+        with render_slot('BLK'):
+            time.sleep(0.9)
+            waiting = create_ticket('FIN')
+            self.assertFalse(try_admit(waiting))
+        self.assertTrue(try_admit(waiting))
+        finish(waiting)
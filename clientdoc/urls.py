@@ -39,6 +39,7 @@ urlpatterns = [
     path('transport/<int:invoice_id>/edit/', views.edit_transport, name='edit_transport'),
     path('confirmation/<int:invoice_id>/', views.create_confirmation, name='create_confirmation'),
     path('confirmation/<int:invoice_id>/finalize/', views.finalize_invoice_pdf, name='finalize_invoice_pdf'), # NEW
+    path('render-queue/<int:ticket_id>/', views.render_status, name='render_status'),
 
     # 6. CONFIRMATION DETAIL ACTIONS
     path('images/<int:image_id>/delete/', views.delete_packed_image, name='delete_packed_image'),
@@ -46,6 +47,7 @@ urlpatterns = [
     # 7. PRINT VIEW
     path('invoices/<int:invoice_id>/print/', views.print_invoice, name='print_invoice'),
     path('invoices/<int:invoice_id>/print-dc/', views.print_dc, name='print_dc'),
+    path('invoices/<int:invoice_id>/download/<str:doc_type>/', views.download_document, name='download_document'),
     
     # 8. DETAIL VIEWS
     path('items/<int:item_id>/', views.item_detail, name='item_detail'),
@@ -59,4 +61,12 @@ urlpatterns = [
     
     # 9. PROJECT GUIDE
     path('project-guide/', views.project_guide, name='project_guide'),
+
+    # 10. REQUEST PROFILES (staff only)
+    path('profiles/', views.profile_list, name='profile_list'),
+    path('profiles/<int:pk>/', views.profile_detail, name='profile_detail'),
+    path('profiles/<int:pk>/download/', views.download_profile, name='download_profile'),
+
+    # 11. PROMETHEUS METRICS
+    path('metrics', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
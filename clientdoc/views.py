@@ -2,122 +2,69 @@
 
 from django.template.loader import render_to_string
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse
+from django.http import HttpResponse, Http404, FileResponse
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
-from django.db import transaction
+from django.db import models, transaction
 from django.core.paginator import Paginator
 from django.conf import settings
 from django.urls import reverse
-from .models import SalesInvoice, InvoiceItem, Item, StoreLocation, DeliveryChallan, TransportCharges, ConfirmationDocument, PackedImage, OurCompanyProfile, ActivityLog, Buyer, BulkInvoiceUpload, ItemCategory
-import openpyxl
-from openpyxl.worksheet.datavalidation import DataValidation
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from .models import SalesInvoice, InvoiceItem, Item, ItemCategory, StoreLocation, DeliveryChallan, TransportCharges, ConfirmationDocument, PackedImage, OurCompanyProfile, ActivityLog, Buyer, BulkInvoiceUpload, RenderTicket, RequestProfile
 from .forms import InvoiceForm, DeliveryChallanForm, TransportChargesForm, ConfirmationDocumentForm, PackedImageFormSet, ItemForm, StoreLocationForm, BuyerForm, InvoiceItemFormSet
 import json
-from .pdf_generator import generate_invoice_pdf, generate_dc_pdf, generate_transport_pdf
+from .render_cache import cached_section, section_fingerprint, GENERATED_SECTIONS
+from .responses import ranged_file_response
+from .print_context import invoice_print_context, dc_print_context, transport_print_context
+from .admission import create_ticket, try_admit, holding_slot, touch, finish, queue_position
+from .querybudget import query_budget
+from .fragments import cached_fragment
+from .routers import reporting_view, pin_primary
+from .profiling import top_functions, profile_path
+from . import metrics
+from .images import build_derivatives, delete_derivatives, find_duplicates
 import logging
-from io import BytesIO
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib.utils import ImageReader
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image as PlatypusImage
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
-from reportlab.lib.units import mm
-from PyPDF2 import PdfMerger, PdfReader
 import os
+import time
 
 logger = logging.getLogger(__name__)
 
-# --- PDF GENERATION HELPERS ---
-
-def generate_packed_images_pdf(confirmation):
-    """Generates a PDF page for packed images."""
-    images = confirmation.packedimage_set.all()
-    if not images.exists():
-        return None 
-
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
-    margin = 50
-    img_width = width - (2 * margin) 
-    img_height = 250 
-    spacing = 20
-    y = height - margin
-    
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(margin, y, "Packed Goods Images")
-    y -= 40
-    
-    # Track unique image paths to prevent duplicates
-    seen_images = set()
-    
-    for image_obj in images:
-        # Skip duplicate images based on file path
-        try:
-            img_path = image_obj.image.path
-            
-            # Check if we've already processed this image
-            if img_path in seen_images:
-                continue
-            
-            seen_images.add(img_path)
-            
-        except Exception:
-            # If path access fails, skip this image
-            continue
-        
-        if y < margin + img_height + spacing:
-            c.showPage()
-            y = height - margin - 20 
-            
-        try:
-            img = ImageReader(img_path) 
-            
-            aspect = img.getSize()[1] / img.getSize()[0]
-            current_img_height = img_width * aspect
-            
-            if current_img_height > img_height:
-                current_img_height = img_height
-
-            c.drawImage(img, margin, y - current_img_height, width=img_width, height=current_img_height)
-            
-            c.setFont("Helvetica", 10)
-            notes_y = y - current_img_height - 10
-            c.drawString(margin, notes_y, f"Notes: {image_obj.notes or 'N/A'}")
-
-            y -= (current_img_height + spacing + 20) 
-
-        except Exception as e:
-            logger.error(f"Error drawing image {image_obj.id} to PDF: {e}")
-            c.setFont("Helvetica-Bold", 12)
-            c.drawString(margin, y, f"Error loading image {image_obj.id}: {e}")
-            y -= 30
-            
-    c.save()
-    buffer.seek(0)
-    return buffer
-
+# Formset saves run the same few queries once per line item or packed image. Their
+# budgets cover forms of up to this many lines; larger ones are reported.
+FORMSET_BUDGET_LINES = 50
+# The bulk upload processes its sheet in the request, about 12 queries per row without PDFs
+BULK_UPLOAD_BUDGET_ROWS = 500
 
 # --- 1. DASHBOARD & LIST VIEWS (FIX 3: Corrected List Views) ---
 
+@reporting_view
+@query_budget(10)
 def dashboard(request):
     """Shows system overview and recent activity (recent invoices)."""
-    invoices = SalesInvoice.objects.all().select_related('location').order_by('-date')[:10]
-    total_invoices = SalesInvoice.objects.count()
-    total_finalized = SalesInvoice.objects.filter(status='FIN').count()
-    
-    context = {
-        'invoices': invoices,
-        'total_invoices': total_invoices,
-        'total_finalized': total_finalized
-    }
-    
-    recent_logs = ActivityLog.objects.order_by('-timestamp')[:10]
-    
-    context['recent_logs'] = recent_logs
-    return render(request, 'clientdoc/dashboard.html', context)
+    def stats():
+        return render_to_string('clientdoc/includes/dashboard_stats.html', {
+            'total_invoices': SalesInvoice.objects.count(),
+            'total_finalized': SalesInvoice.objects.filter(status='FIN').count(),
+        }, request)
+
+    def recent():
+        invoices = SalesInvoice.objects.all().select_related('location').order_by('-date')[:10]
+        return render_to_string('clientdoc/includes/dashboard_recent.html', {'invoices': invoices}, request)
+
+    def activity():
+        recent_logs = ActivityLog.objects.order_by('-timestamp')[:10]
+        return render_to_string('clientdoc/includes/dashboard_activity.html', {'recent_logs': recent_logs}, request)
+
+    return render(request, 'clientdoc/dashboard.html', {
+        'stats': cached_fragment('dashboard_stats', [SalesInvoice], (), stats),
+        'recent': cached_fragment('dashboard_recent', [SalesInvoice], (), recent),
+        # "5 minutes ago" goes stale by itself, so the activity list is re-rendered every minute too
+        'activity': cached_fragment('dashboard_activity', [ActivityLog], int(time.time() // 60), activity),
+    })
 
+@reporting_view
+@query_budget(5)
 def item_detail(request, item_id):
     """Detail view for a single item."""
     item = get_object_or_404(Item, id=item_id)
@@ -126,11 +73,25 @@ def item_detail(request, item_id):
 def log_activity(action, details=""):
     ActivityLog.objects.create(action=action, details=details)
 
+DATE_TEXT_CHARS = '0123456789-:. +'
+
+
+def _is_date_field(model_class, path):
+    opts = model_class._meta
+    *relations, name = path.split('__')
+    for relation in relations:
+        opts = opts.get_field(relation).related_model._meta
+    return isinstance(opts.get_field(name), models.DateField)
+
+
 def get_filtered_queryset(model_class, request, search_fields):
     """Helper to filter and sort querysets."""
-    queryset = model_class.objects.all().select_related('invoice') if model_class != SalesInvoice and hasattr(model_class, 'invoice') else model_class.objects.all()
+    # List templates show invoice.location.name and item.category.name on every row
+    queryset = model_class.objects.all().select_related('invoice__location') if model_class != SalesInvoice and hasattr(model_class, 'invoice') else model_class.objects.all()
     if model_class == SalesInvoice:
         queryset = queryset.select_related('location')
+    elif model_class == Item:
+        queryset = queryset.select_related('category')
     elif hasattr(model_class, 'invoice'):
          queryset = queryset.filter(invoice__is_deleted=False)
         
@@ -140,6 +101,9 @@ def get_filtered_queryset(model_class, request, search_fields):
         from django.db.models import Q
         q_objects = Q()
         for field in search_fields:
+            # A date's text is only digits and separators: skip it for other queries so the text indexes can be used
+            if _is_date_field(model_class, field) and query.strip(DATE_TEXT_CHARS):
+                continue
             q_objects |= Q(**{field + '__icontains': query})
         queryset = queryset.filter(q_objects)
     
@@ -187,6 +151,9 @@ def get_filtered_queryset(model_class, request, search_fields):
          'created_at', '-created_at', 
          'id', '-id', 
          'total', '-total', 
+         'item_count', '-item_count',
+         'total_qty', '-total_qty',
+         'taxable_total', '-taxable_total',
          'status', '-status', 
          'tally_invoice_number', '-tally_invoice_number', 
          'app_invoice_number', '-app_invoice_number',
@@ -209,6 +176,17 @@ def get_filtered_queryset(model_class, request, search_fields):
         
     return queryset
 
+def cached_list_table(request, name, model_class, search_fields, template, models):
+    """A list page's table and pagination, cached until one of `models` changes."""
+    def render_table():
+        queryset = get_filtered_queryset(model_class, request, search_fields)
+        page_obj = Paginator(queryset, 20).get_page(request.GET.get('page'))
+        return render_to_string(template, {'page_obj': page_obj}, request)
+    params = tuple(request.GET.get(param, '') for param in ('q', 'sort', 'page'))
+    return cached_fragment(name, models, params, render_table)
+
+@reporting_view
+@query_budget(10)
 def trash_list(request):
     """View to show deleted items."""
     invoices = SalesInvoice.objects.trash().all()
@@ -222,6 +200,7 @@ def trash_list(request):
         'title': 'Trash Bin'
     })
 
+@pin_primary
 def restore_object(request, model_name, pk):
     """Restores a soft-deleted object."""
     model_map = {
@@ -244,6 +223,7 @@ def restore_object(request, model_name, pk):
     messages.success(request, f'{model_name.title()} restored successfully.')
     return redirect('clientdoc:trash_list')
 
+@pin_primary
 def hard_delete_object(request, model_name, pk):
     """Permanently deletes an object."""
     model_map = {
@@ -266,6 +246,7 @@ def hard_delete_object(request, model_name, pk):
     messages.warning(request, f'{model_name.title()} permanently deleted.')
     return redirect('clientdoc:trash_list')
 
+@pin_primary
 def delete_object(request, model_name, pk):
     """Soft deletes an object from list view."""
     model_map = {
@@ -288,20 +269,20 @@ def delete_object(request, model_name, pk):
     messages.success(request, f'{model_name.title()} moved to trash.')
     return redirect(request.META.get('HTTP_REFERER', 'clientdoc:dashboard'))
 
+@reporting_view
+@query_budget(10)
 def invoice_list(request):
     search_fields = ['tally_invoice_number', 'app_invoice_number', 'location__name', 'date']
-    invoices = get_filtered_queryset(SalesInvoice, request, search_fields)
-    
-    paginator = Paginator(invoices, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    
+    table = cached_list_table(request, 'invoice_list', SalesInvoice, search_fields,
+                              'clientdoc/includes/invoice_table.html', [SalesInvoice, InvoiceItem, StoreLocation])
     return render(request, 'clientdoc/invoice_list.html', {
-        'page_obj': page_obj, 
+        'table': table,
         'title': 'Sales Invoice List',
         'list_type': 'inv'
     })
 
+@reporting_view
+@query_budget(10)
 def dc_list(request):
     search_fields = ['invoice__tally_invoice_number', 'invoice__app_invoice_number', 'invoice__location__name', 'date']
     challans = get_filtered_queryset(DeliveryChallan, request, search_fields)
@@ -316,6 +297,8 @@ def dc_list(request):
         'list_type': 'dc'
     })
     
+@reporting_view
+@query_budget(10)
 def transport_list(request):
     search_fields = ['invoice__tally_invoice_number', 'invoice__app_invoice_number', 'invoice__location__name', 'date', 'description']
     charges = get_filtered_queryset(TransportCharges, request, search_fields)
@@ -330,6 +313,8 @@ def transport_list(request):
         'list_type': 'trp'
     })
 
+@reporting_view
+@query_budget(10)
 def confirmation_list(request):
     search_fields = ['invoice__tally_invoice_number', 'invoice__app_invoice_number', 'invoice__location__name', 'date']
     docs = get_filtered_queryset(ConfirmationDocument, request, search_fields)
@@ -348,20 +333,20 @@ def confirmation_list(request):
 
 # --- ITEM VIEWS ---
 
+@reporting_view
+@query_budget(10)
 def item_list(request):
     search_fields = ['name', 'description']
-    items = get_filtered_queryset(Item, request, search_fields)
-    
-    paginator = Paginator(items, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    
+    table = cached_list_table(request, 'item_list', Item, search_fields,
+                              'clientdoc/includes/item_table.html', [Item, ItemCategory])
     return render(request, 'clientdoc/item_list.html', {
-        'page_obj': page_obj, 
+        'table': table,
         'title': 'Item List',
         'list_type': 'item'
     })
 
+@pin_primary
+@query_budget(15)
 def edit_item(request, pk):
     item = get_object_or_404(Item, pk=pk)
     if request.method == 'POST':
@@ -375,6 +360,8 @@ def edit_item(request, pk):
         form = ItemForm(instance=item)
     return render(request, 'clientdoc/form.html', {'form': form, 'title': 'Edit Item'})
 
+@pin_primary
+@query_budget(15)
 def create_item(request):
     if request.method == 'POST':
         form = ItemForm(request.POST) 
@@ -387,6 +374,8 @@ def create_item(request):
         form = ItemForm()
     return render(request, 'clientdoc/form.html', {'form': form, 'title': 'Create Item'})
 
+@pin_primary
+@query_budget(15)
 def create_location(request):
     if request.method == 'POST':
         form = StoreLocationForm(request.POST) 
@@ -399,20 +388,20 @@ def create_location(request):
         form = StoreLocationForm()
     return render(request, 'clientdoc/form.html', {'form': form, 'title': 'Create Store Location'})
 
+@reporting_view
+@query_budget(10)
 def store_location_list(request):
     search_fields = ['name', 'address', 'city', 'gstin', 'site_code']
-    locations = get_filtered_queryset(StoreLocation, request, search_fields)
-    
-    paginator = Paginator(locations, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    
+    table = cached_list_table(request, 'store_location_list', StoreLocation, search_fields,
+                              'clientdoc/includes/location_table.html', [StoreLocation])
     return render(request, 'clientdoc/store_location_list.html', {
-        'page_obj': page_obj, 
+        'table': table,
         'title': 'Store Client Locations',
         'list_type': 'location'
     })
 
+@pin_primary
+@query_budget(15)
 def edit_location(request, pk):
     location = get_object_or_404(StoreLocation, pk=pk)
     if request.method == 'POST':
@@ -426,12 +415,20 @@ def edit_location(request, pk):
         form = StoreLocationForm(instance=location)
     return render(request, 'clientdoc/form.html', {'form': form, 'title': 'Edit Store Location'})
 
+@reporting_view
+@query_budget(5)
 def store_location_detail(request, pk):
     location = get_object_or_404(StoreLocation, pk=pk)
-    return render(request, 'clientdoc/store_location_detail.html', {'location': location})
+    return render(request, 'clientdoc/store_location_detail.html', {
+        'location': location,
+        'recent_invoices': location.salesinvoice_set.order_by('-date')[:5],
+    })
 
 # --- 2. WORKFLOW STEP 1: CREATE INVOICE ITEMS ---
 
+# Validating and saving a line item takes about 4 queries
+@pin_primary
+@query_budget(20 + 4 * FORMSET_BUDGET_LINES, max_repeats=FORMSET_BUDGET_LINES)
 def create_invoice(request):
     """Handles creation of SalesInvoice and multiple InvoiceItem records using FormSets."""
     
@@ -516,6 +513,9 @@ def create_invoice(request):
 
 
 # --- 3. WORKFLOW STEP 2: EDIT INVOICE (TALLY DETAILS) ---
+# Validating and updating an existing line item takes about 6 queries
+@pin_primary
+@query_budget(20 + 6 * FORMSET_BUDGET_LINES, max_repeats=FORMSET_BUDGET_LINES)
 def edit_invoice(request, invoice_id):
     invoice = get_object_or_404(SalesInvoice, id=invoice_id)
     items = Item.objects.all() 
@@ -571,6 +571,8 @@ def edit_invoice(request, invoice_id):
 
 
 # --- 4. WORKFLOW STEP 3: EDIT DELIVERY CHALLAN (DC) ---
+@pin_primary
+@query_budget(20)
 def edit_dc(request, invoice_id):
     invoice = get_object_or_404(SalesInvoice, id=invoice_id)
     dc, created = DeliveryChallan.objects.get_or_create(invoice=invoice)
@@ -611,6 +613,8 @@ def edit_dc(request, invoice_id):
 
 
 # --- 5. WORKFLOW STEP 4: EDIT TRANSPORT CHARGES ---
+@pin_primary
+@query_budget(20)
 def edit_transport(request, invoice_id):
     invoice = get_object_or_404(SalesInvoice, id=invoice_id)
     transport, created = TransportCharges.objects.get_or_create(invoice=invoice)
@@ -656,6 +660,9 @@ def edit_transport(request, invoice_id):
 
 # --- 6. WORKFLOW STEP 5: CONFIRMATION & PDF GENERATION (FIX 1: Robust Merging) ---
 
+# Saving a packed image and its derivatives takes about 2 queries
+@pin_primary
+@query_budget(10 + 2 * FORMSET_BUDGET_LINES, max_repeats=FORMSET_BUDGET_LINES)
 def create_confirmation(request, invoice_id):
     invoice = get_object_or_404(SalesInvoice, id=invoice_id)
     confirmation, created = ConfirmationDocument.objects.get_or_create(invoice=invoice)
@@ -691,6 +698,7 @@ def create_confirmation(request, invoice_id):
         if form.is_valid() and image_formset.is_valid():
             confirmation = form.save()
             image_formset.save()
+            build_derivatives(confirmation.packedimage_set.all())
             
             if 'save_notes' in request.POST:
                 messages.success(request, 'Files and image notes saved successfully.')
@@ -706,6 +714,11 @@ def create_confirmation(request, invoice_id):
     
     prev_url = reverse('clientdoc:edit_transport', kwargs={'invoice_id': invoice.id})
     packed_images_list = confirmation.packedimage_set.all()
+    
+    # Flag near-duplicate photos; they are left out of the bundle
+    duplicates = find_duplicates(packed_images_list)
+    for image_form in image_formset:
+        image_form.duplicate_of = duplicates.get(image_form.instance.pk)
 
     # Prepare available files for Checklist
     available_files = [
@@ -736,112 +749,104 @@ def create_confirmation(request, invoice_id):
         'packed_images_list': packed_images_list, 
         'current_step': 4,
         'progress_percentage': 90, # Not 100 yet
-        'available_files': available_files
+        'available_files': available_files,
+        'linearize_default': getattr(settings, 'PDF_LINEARIZE', False),
     }
     return render(request, 'clientdoc/confirmation_checklist.html', context)
 
 
+def linearize_choice(request):
+    """Per-request override of PDF_LINEARIZE from a 'linearize' form field (None keeps the setting)."""
+    value = request.POST.get('linearize')
+    if value is None:
+        return None
+    return value in ('1', 'on', 'true', 'yes')
+
+@pin_primary
+# The first bundle after an upload saves derivatives once per packed image
+@query_budget(150, max_repeats=30)
 def finalize_invoice_pdf(request, invoice_id):
-    """Generates the final PDF based on user selected order."""
+    """Generates the final PDF based on user selected order.
+
+    Renders straight away when a render slot is free; otherwise queues the
+    request and sends the user to a status page that polls until its turn.
+    """
     invoice = get_object_or_404(SalesInvoice, id=invoice_id)
-    confirmation = get_object_or_404(ConfirmationDocument, invoice=invoice)
-    company_profile = OurCompanyProfile.objects.first()
-    
+    get_object_or_404(ConfirmationDocument, invoice=invoice)
+
     if request.method == 'POST':
+        from .bundles import DEFAULT_FILE_ORDER
         # Get order from POST
         # Valid separate IDs: invoice, dc, transport, po, email
         # We expect a comma separated string or list
-        file_order_str = request.POST.get('file_order', 'invoice,dc,transport,po,email') 
+        file_order_str = request.POST.get('file_order', ','.join(DEFAULT_FILE_ORDER)) 
         file_order = file_order_str.split(',')
-        
-        merger = PdfMerger()
-        
-        try:
-            for file_type in file_order:
-                if file_type == 'invoice':
-                    # Check for Uploaded Custom Invoice first
-                    if confirmation.uploaded_invoice:
-                        try:
-                            PdfReader(confirmation.uploaded_invoice.path)
-                            merger.append(confirmation.uploaded_invoice.path)
-                        except Exception:
-                            # Fallback if corrupt? Or just fail. Fallback to generate.
-                            invoice.calculate_total()
-                            merger.append(generate_invoice_pdf(invoice, company_profile))
-                    else:
-                        invoice.calculate_total()
-                        merger.append(generate_invoice_pdf(invoice, company_profile))
-                
-                elif file_type == 'dc':
-                    if confirmation.uploaded_dc:
-                        try:
-                            PdfReader(confirmation.uploaded_dc.path)
-                            merger.append(confirmation.uploaded_dc.path)
-                        except Exception:
-                             pass
-                    elif hasattr(invoice, 'deliverychallan'):
-                         merger.append(generate_dc_pdf(invoice, invoice.deliverychallan, company_profile))
-                
-                elif file_type == 'transport' and hasattr(invoice, 'transportcharges'):
-                     merger.append(generate_transport_pdf(invoice, invoice.transportcharges, company_profile))
-                
-                elif file_type == 'po' and confirmation.po_file:
-                    try:
-                        PdfReader(confirmation.po_file.path)
-                        merger.append(confirmation.po_file.path)
-                    except Exception:
-                        pass # Skip invalid
-                
-                elif file_type == 'email' and confirmation.approval_email_file:
-                    try:
-                        PdfReader(confirmation.approval_email_file.path)
-                        merger.append(confirmation.approval_email_file.path)
-                    except Exception:
-                        pass
-
-            # Always append images at the end
-            images_pdf_buffer = generate_packed_images_pdf(confirmation)
-            if images_pdf_buffer:
-                merger.append(images_pdf_buffer)
-            
-            output = BytesIO()
-            merger.write(output)
-            merger.close()
-            output.seek(0)
-            
-            # Save logic ...
-            filename_suffix = invoice.tally_invoice_number or invoice.app_invoice_number or str(invoice.id)
-            filename = f"confirmation_invoice_{filename_suffix}.pdf"
-            
-            # Preview vs Save
-            path = os.path.join(settings.MEDIA_ROOT, 'confirmations', filename)
-            os.makedirs(os.path.dirname(path), exist_ok=True) 
 
-            with open(path, 'wb') as f:
-                f.write(output.getvalue())
-            
-            confirmation.combined_pdf.name = f'confirmations/{filename}'
-            confirmation.save()
-            
-            invoice.status = 'FIN'
-            invoice.save()
-            log_activity("Finalize Invoice", f"Finalized Invoice {invoice.tally_invoice_number or invoice.id}")
-            
-            messages.success(request, f'Document Bundle Generated Successfully!')
-            return redirect('clientdoc:confirmation_list')
+        ticket = create_ticket('FIN', invoice, {'file_order': file_order, 'linearize': linearize_choice(request)})
+        if not try_admit(ticket):
+            return redirect('clientdoc:render_status', ticket_id=ticket.id)
+        return run_finalize_ticket(request, ticket)
 
-        except Exception as e:
-            logger.error(f"Error finalizing PDF: {e}")
-            messages.error(request, f"Error finalizing PDF: {e}")
-            return redirect('clientdoc:create_confirmation', invoice_id=invoice_id)
-            
     return redirect('clientdoc:create_confirmation', invoice_id=invoice_id)
 
+def run_finalize_ticket(request, ticket):
+    """Builds the bundle for an admitted finalize ticket, then releases its slot."""
+    from .bundles import write_combined_pdf
+    invoice = ticket.invoice
+    confirmation = get_object_or_404(ConfirmationDocument, invoice=invoice)
+    company_profile = OurCompanyProfile.objects.first()
+    started = time.perf_counter()
+    try:
+        with holding_slot(ticket):
+            write_combined_pdf(invoice, confirmation, company_profile, ticket.params['file_order'], linearize=ticket.params.get('linearize'))
+        metrics.finalize_seconds.observe(time.perf_counter() - started, result='ok')
+
+        invoice.status = 'FIN'
+        invoice.save()
+        log_activity("Finalize Invoice", f"Finalized Invoice {invoice.tally_invoice_number or invoice.id}")
+        finish(ticket)
+
+        messages.success(request, f'Document Bundle Generated Successfully!')
+        return redirect('clientdoc:confirmation_list')
+
+    except Exception as e:
+        metrics.finalize_seconds.observe(time.perf_counter() - started, result='error')
+        finish(ticket, error=e)
+        logger.error(f"Error finalizing PDF: {e}")
+        messages.error(request, f"Error finalizing PDF: {e}")
+        return redirect('clientdoc:create_confirmation', invoice_id=invoice.id)
+
+# The first bundle after an upload saves derivatives once per packed image
+@query_budget(150, max_repeats=30)
+def render_status(request, ticket_id):
+    """Queue page for a finalize waiting on a render slot; each poll tries to start it."""
+    ticket = get_object_or_404(RenderTicket.objects.select_related('invoice'), id=ticket_id, kind='FIN')
+    if ticket.status == 'WAI':
+        touch(ticket)
+        if try_admit(ticket):
+            return run_finalize_ticket(request, ticket)
+    if ticket.status in ('WAI', 'RUN'):
+        return render(request, 'clientdoc/render_status.html', {
+            'ticket': ticket,
+            'invoice': ticket.invoice,
+            'position': queue_position(ticket) if ticket.status == 'WAI' else None,
+            'title': 'Rendering Queued',
+        })
+    if ticket.status == 'DON':
+        return redirect('clientdoc:confirmation_list')
+    if ticket.status == 'ERR':
+        messages.error(request, f"Error finalizing PDF: {ticket.error}")
+    # Abandoned or failed: back to the checklist
+    return redirect('clientdoc:create_confirmation', invoice_id=ticket.invoice_id)
+
 # --- BULK UPLOAD VIEWS ---
 
+@pin_primary
+@query_budget(20 + 13 * BULK_UPLOAD_BUDGET_ROWS, max_repeats=BULK_UPLOAD_BUDGET_ROWS)
 def bulk_upload_page(request):
     """Page to upload excel and view history."""
     uploads = BulkInvoiceUpload.objects.order_by('-uploaded_at')
+    linearize_default = getattr(settings, 'PDF_LINEARIZE', False)
     
     if request.method == 'POST' and request.FILES.get('file'):
         file = request.FILES['file']
@@ -855,6 +860,7 @@ def bulk_upload_page(request):
         upload_record.log = f"Type: {upload_type.title()}\n"
         upload_record.save()
         
+        from .spreadsheets import process_buyer_upload, process_item_upload, process_location_upload, process_invoice_upload
         try:
             if upload_type == 'buyer':
                 process_buyer_upload(upload_record)
@@ -863,7 +869,7 @@ def bulk_upload_page(request):
             elif upload_type == 'location':
                 process_location_upload(upload_record)
             else:
-                process_invoice_upload(upload_record)
+                process_invoice_upload(upload_record, linearize=linearize_choice(request))
                 
             messages.success(request, f'{upload_type.title()} file uploaded and processed successfully.')
         except Exception as e:
@@ -878,194 +884,22 @@ def bulk_upload_page(request):
         
     return render(request, 'clientdoc/bulk_upload.html', {
         'uploads': uploads,
-        'title': 'Bulk Data Upload'
+        'title': 'Bulk Data Upload',
+        'linearize_default': linearize_default,
     })
 
+@reporting_view
+@query_budget(10)
 def download_sample_excel(request):
     """Generates a sample excel file based on type with formatting, optionally with data."""
     import datetime
-    from openpyxl.styles import Font, PatternFill, Alignment
-    from openpyxl.comments import Comment
+    from .spreadsheets import sample_workbook
     
     upload_type = request.GET.get('type', 'invoice')
     do_export = request.GET.get('export') == 'true'
     
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = f"{upload_type.title()} {'Data' if do_export else 'Template'}"
-    
-    # Define Headers based on Type
-    if upload_type == 'buyer':
-        headers = ["Buyer Name*", "Address", "GSTIN", "State", "Phone", "Email"]
-        widths = [30, 40, 20, 20, 20, 30]
-        
-    elif upload_type == 'item':
-        headers = ["Item Name*", "Category", "Article/SKU", "Description", "Price*", "GST Rate (0.18)*", "HSN Code", "Unit (Nos)"]
-        widths = [30, 20, 20, 40, 15, 15, 15, 15]
-        
-    elif upload_type == 'location':
-        headers = ["Location Name*", "Site Code", "Address", "City", "State", "GSTIN", "Priority"]
-        widths = [30, 15, 40, 20, 20, 20, 15]
-        
-    else: # Invoice
-        headers = [
-            'Buyer Name', 'Location Name', 'Item Name', 'Item Description', 'Quantity', 'Unit Rate', 
-            'SGST', 'CGST', 'IGST', 'Transport Charges', 'Total Amount', 
-            'Generate Invoice (Yes/No)', 'Generate PDF (Yes/No)', 
-            'Tally Invoice No. (Identifier)', 'Invoce Date', 
-            "Buyer's Order No.", "Buyer's Order Date (YYYY-MM-DD)", 
-            'Dispatch Doc No.', 'Dispatched Through', 'Destination', 
-            'Delivery Note', 'Delivery Note Date (YYYY-MM-DD)', 
-            'Mode/Terms of Payment', 'Reference No. & Date', 'Other References', 
-            'Terms of Delivery', 'Remarks', 'DC Notes', 'Transport Description', 
-            'Doc-1 Invoice (Path)', 'Doc-2 DC (Path)', 'Doc-3 Buyer Po (Path)', 'Doc 4 Email approal (Path)', 
-            'Doc-images-1', 'Doc-images-2', 'Doc-images-3', 'Doc-images-4', 'Doc-images-5'
-        ]
-        # Widths mostly uniform
-        widths = [25] * len(headers)
-        widths[0] = 30 # Buyer
-        widths[1] = 30 # Location
-        widths[2] = 30 # Item
-        widths[3] = 40 # Description
-
-    ws.append(headers)
-    
-    # Styles
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="808080", end_color="808080", fill_type="solid") # Grey
-    blue_fill = PatternFill(start_color="0070C0", end_color="0070C0", fill_type="solid") # Blue
-    
-    for cell in ws[1]:
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal='center')
-        
-    # Blue First Column Header
-    ws['A1'].fill = blue_fill
-    
-    # Add Comments for Guidance (Invoice Only)
-    if upload_type == 'invoice':
-        comments_map = {
-            'A1': "Select Buyer from dropdown or ensure exact name match.",
-            'B1': "Select Location (Ship To) from dropdown.",
-            'C1': "Select Item. Description/Price auto-fill if left blank.",
-            'J1': "Fill amount to auto-generate Transport Bill.",
-            'L1': "Must be 'Yes' to process row.",
-            'M1': "Must be 'Yes' to bundle PDFs.",
-            'N1': "Unique ID. Leave blank to auto-generate (Tsol-XXXXX). Use same ID on multiple rows to group items.",
-            'U1': "If filled, Delivery Challan (DC) is auto-created.",
-            'V1': "If filled, Delivery Challan (DC) is auto-created.",
-            'AB1': "Notes for DC. If filled, DC is auto-created.",
-            'AD1': "Absolute file path (e.g. C:\\Docs\\Inv.pdf). Overrides auto-gen invoice.",
-            'AG1': "Absolute file path for Approval Email PDF."
-        }
-        for cell_coord, note in comments_map.items():
-            if cell_coord in ws:
-                ws[cell_coord].comment = Comment(note, "System")
-
-    # Set Widths
-    for i, width in enumerate(widths, 1):
-        col_letter = openpyxl.utils.get_column_letter(i)
-        ws.column_dimensions[col_letter].width = width
-
-    # ---- EXPORT DATA LOGIC ----
-    if do_export:
-        if upload_type == 'buyer':
-            for obj in Buyer.objects.all():
-                ws.append([
-                    obj.name, obj.address, obj.gstin, obj.state, obj.phone, obj.email
-                ])
-        elif upload_type == 'item':
-            for obj in Item.objects.select_related('category').all():
-                ws.append([
-                    obj.name, 
-                    obj.category.name if obj.category else "", 
-                    obj.article_code, 
-                    obj.description, 
-                    obj.price, 
-                    float(obj.gst_rate) if obj.gst_rate else 0.00,
-                    obj.hsn_code, 
-                    obj.unit
-                ])
-        elif upload_type == 'location':
-            for obj in StoreLocation.objects.all():
-                ws.append([
-                    obj.name, obj.site_code, obj.address, obj.city, obj.state, obj.gstin, obj.priority
-                ])
-    
-    # Invoice Specific Logic (Dropdowns etc - Only for Templates/Invoice)
-    if upload_type == 'invoice':
-        # Add Data and Validations
-        data_ws = wb.create_sheet("Reference Data")
-        data_ws.sheet_state = 'hidden' 
-        
-        buyers = list(Buyer.objects.values_list('name', flat=True))
-        locations = list(StoreLocation.objects.values_list('name', flat=True))
-        
-        # Item Data for Auto-Fill (Name, Price, GST)
-        items_qs = Item.objects.all().values_list('name', 'price', 'gst_rate')
-        items = list(items_qs) # List of tuples
-        
-        for i, b in enumerate(buyers, 1): data_ws.cell(row=i, column=1, value=b)
-        for i, l in enumerate(locations, 1): data_ws.cell(row=i, column=2, value=l)
-        
-        # Items in Cols 3, 4, 5 (C, D, E) (Reference Sheet)
-        for i, (name, price, gst) in enumerate(items, 1): 
-            data_ws.cell(row=i, column=3, value=name)
-            data_ws.cell(row=i, column=4, value=price)
-            data_ws.cell(row=i, column=5, value=gst)
-
-        # Named Ranges for Robust Dropdowns
-        from openpyxl.workbook.defined_name import DefinedName
-        
-        # Helper to safer add named range
-        def create_named_range(name, sheet_title, range_ref):
-            d = DefinedName(name, attr_text=f"'{sheet_title}'!{range_ref}")
-            wb.defined_names.add(d)
-
-        if buyers:
-            create_named_range("BuyerList", "Reference Data", f"$A$1:$A${len(buyers)}")
-        if locations:
-            create_named_range("LocList", "Reference Data", f"$B$1:$B${len(locations)}")
-        if items:
-            create_named_range("ItemList", "Reference Data", f"$C$1:$C${len(items)}")
-        
-        def add_val(col, valid_formula):
-             dv = DataValidation(type="list", formula1=valid_formula, allow_blank=True)
-             ws.add_data_validation(dv)
-             dv.add(f"{col}2:{col}500")
-
-        if buyers: add_val('A', "=BuyerList")
-        if locations: add_val('B', "=LocList")
-        if items: add_val('C', "=ItemList")
-        
-        # VLOOKUP Formulas
-        # Item Name is C. Description is D (User fills). Quantity is E. Unit Rate is F.
-        # We want Unit Rate (F) to auto-fill from Reference Data D (Price) based on C (Item Name).
-        # Reference Data: C=Name, D=Price, E=GST
-        
-        nrows = 500
-        for r in range(2, nrows + 1):
-             # Price VLOOKUP
-             ws[f'F{r}'] = f"=IFERROR(VLOOKUP(C{r}, 'Reference Data'!$C$1:$E${len(items)+1}, 2, FALSE), \"\")"
-             
-        # Yes/No Dropdowns for L and M (Indices 11, 12)
-        # 0=A, 1=B, 2=C, 3=D, 4=E, 5=F, 6=G, 7=H, 8=I, 9=J, 10=K
-        # 11 = L (Gen Invoice)
-        # 12 = M (Gen PDF)
-        
-        dv_yn = DataValidation(type="list", formula1='"Yes,No"', allow_blank=False)
-        ws.add_data_validation(dv_yn)
-        dv_yn.add("L2:L500")
-        ws.add_data_validation(dv_yn) 
-        dv_yn.add("M2:M500")
-        
-        # Defaults
-        ws['L2'] = "Yes"
-        ws['M2'] = "Yes" 
-        ws['W2'] = "30 Days" # Mode/Terms (Shifted: Old was V(21). Now 22(W))
-        ws['Y2'] = "EMAIL Approval" # Other Ref (Old X(23). Now 24(Y))
-    
+    wb = sample_workbook(upload_type, do_export)
+
     # Timestamped Filename
     timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M")
     mode = "Export" if do_export else "Template"
@@ -1076,428 +910,8 @@ def download_sample_excel(request):
     wb.save(response)
     return response
 
-# --- PROCESSORS ---
-def process_buyer_upload(record):
-    ws = openpyxl.load_workbook(record.file.path, data_only=True).active
-    log = []
-    for idx, row in enumerate(ws.iter_rows(min_row=2, values_only=True), 2):
-        if not row or not row[0]: continue
-        name = str(row[0]).strip()
-        defaults = {
-            'address': row[1] or "",
-            'gstin': row[2] or "",
-            'state': row[3] or "Karnataka",
-            'phone': row[4] or "",
-            'email': row[5] or ""
-        }
-        obj, created = Buyer.objects.update_or_create(name=name, defaults=defaults)
-        log.append(f"Row {idx}: {'Created' if created else 'Updated'} Buyer '{name}'")
-    
-    record.log += "\n".join(log)
-    record.status = 'Processed'
-    record.save()
-
-def process_item_upload(record):
-    ws = openpyxl.load_workbook(record.file.path, data_only=True).active
-    log = []
-    from decimal import Decimal
-    for idx, row in enumerate(ws.iter_rows(min_row=2, values_only=True), 2):
-        if not row or not row[0]: continue
-        name = str(row[0]).strip()
-        
-        # Category Logic
-        cat_name = row[1]
-        category = None
-        if cat_name:
-            category, _ = ItemCategory.objects.get_or_create(name=str(cat_name).strip())
-            
-        price = 0.00
-        try: price = float(row[4]) if row[4] else 0.00
-        except: pass
-        
-        gst = 0.18
-        try: gst = float(row[5]) if row[5] else 0.18
-        except: pass
-
-        defaults = {
-            'category': category,
-            'article_code': row[2] or "",
-            'description': row[3] or "",
-            'price': Decimal(price),
-            'gst_rate': Decimal(gst),
-            'hsn_code': row[6] or "844311",
-            'unit': row[7] or "Nos"
-        }
-        obj, created = Item.objects.update_or_create(name=name, defaults=defaults)
-        log.append(f"Row {idx}: {'Created' if created else 'Updated'} Item '{name}'")
-        
-        record.log += "\n".join(log)
-        record.status = 'Processed'
-        record.save()
-
-def process_location_upload(record):
-    ws = openpyxl.load_workbook(record.file.path, data_only=True).active
-    log = []
-    for idx, row in enumerate(ws.iter_rows(min_row=2, values_only=True), 2):
-        if not row or not row[0]: continue
-        name = str(row[0]).strip()
-        defaults = {
-            'site_code': row[1] or "",
-            'address': row[2] or "",
-            'city': row[3] or "",
-            'state': row[4] or "Karnataka",
-            'gstin': row[5] or "",
-            'priority': row[6] or ""
-        }
-        obj, created = StoreLocation.objects.update_or_create(name=name, defaults=defaults)
-        log.append(f"Row {idx}: {'Created' if created else 'Updated'} Location '{name}'")
-        
-    record.log += "\n".join(log)
-    record.status = 'Processed'
-    record.save()
-
-def process_invoice_upload(upload_record):
-    """Parses Excel with support for Multiple Items per Invoice using Grouping - Updated Mapping & De-duplications"""
-    file_path = upload_record.file.path
-    wb = openpyxl.load_workbook(file_path, data_only=True)
-    ws = wb.active
-    
-    log = []
-    created_count = 0
-    updated_count = 0
-    error_count = 0
-    
-    from datetime import datetime
-    from decimal import Decimal
-    import uuid
-    from django.core.files import File
-    import os
-    
-    def parse_date(date_val):
-        if not date_val: return None
-        if isinstance(date_val, datetime): return date_val
-        try: return datetime.strptime(str(date_val).strip(), '%Y-%m-%d')
-        except ValueError: return None 
-
-    # --- 1. READ AND GROUP DATA ---
-    grouped_rows = {} 
-    
-    for index, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
-        if not row or not any(row): continue
-        
-        def get_col(idx): return row[idx] if idx < len(row) else None
-        
-        # Mappings Updated (Inserted Description @ 3)
-        # 0: Buyer, 1: Location, 2: Item, 3: DESC (NEW)
-        # 4: Qty, 5: Unit Rate, 6: SGST, 7: CGST, 8: IGST, 9: Trans Charges, 10: Total
-        # 11: Gen Inv, 12: Gen PDF
-        # 13: Tally Inv
-        # 14: Inv Date
-        
-        gen_invoice = get_col(11)
-        if not gen_invoice or str(gen_invoice).strip().lower() != 'yes':
-             log.append(f"Row {index}: Skipped (Generate != Yes)")
-             continue
-
-        location_name = get_col(1)
-        item_name = get_col(2)
-        qty = get_col(4)
-        
-        if not (location_name and item_name and qty):
-             log.append(f"Row {index}: Skipped (Missing essential Item/Location data)")
-             error_count += 1
-             continue
-             
-        tally_no = str(get_col(13)).strip() if get_col(13) else None
-        
-        if tally_no:
-            key = f"TALLY::{tally_no}"
-        else:
-            key = f"UNIQUE::{uuid.uuid4()}" 
-            
-        if key not in grouped_rows:
-            grouped_rows[key] = []
-        
-        row_data = {
-            'index': index,
-            'buyer_name': get_col(0),
-            'location_name': location_name,
-            'item_name': item_name,
-            'item_desc': get_col(3), # New Description
-            'qty': qty,
-            'unit_rate': get_col(5),
-            'trans_charges': get_col(9),
-            'gen_pdf': get_col(12),
-            'tally_no': tally_no,
-            'inv_date': parse_date(get_col(14)),
-            'buyer_ord_no': get_col(15),
-            'buyer_ord_date': parse_date(get_col(16)),
-            'disp_doc_no': get_col(17),
-            'disp_through': get_col(18),
-            'dest': get_col(19),
-            'del_note': get_col(20),
-            'del_note_date': parse_date(get_col(21)),
-            'pay_terms': get_col(22) or "30 Days",
-            'ref_no': get_col(23),
-            'other_ref': get_col(24) or "EMAIL Approval",
-            'terms_del': get_col(25),
-            'remark': get_col(26),
-            'dc_notes': get_col(27),
-            'trans_desc': get_col(28),
-            # File Paths
-            'doc_inv': get_col(29),
-            'doc_dc': get_col(30),
-            'doc_po': get_col(31),
-            'doc_email': get_col(32),
-            'doc_img_1': get_col(33),
-            'doc_img_2': get_col(34),
-            'doc_img_3': get_col(35),
-            'doc_img_4': get_col(36),
-            'doc_img_5': get_col(37),
-        }
-        grouped_rows[key].append(row_data)
-
-    # --- 2. PROCESS GROUPS ---
-    for key, rows in grouped_rows.items():
-        first_row = rows[0]
-        row_indices = [str(r['index']) for r in rows]
-        indices_str = ", ".join(row_indices)
-        
-        try:
-            with transaction.atomic():
-                loc_obj = StoreLocation.objects.filter(name__iexact=str(first_row['location_name']).strip()).first()
-                if not loc_obj:
-                    log.append(f"Rows {indices_str}: Failed - Location '{first_row['location_name']}' not found")
-                    error_count += 1
-                    continue
-                
-                buyer_obj = None
-                if first_row['buyer_name']:
-                    buyer_obj = Buyer.objects.filter(name__iexact=str(first_row['buyer_name']).strip()).first()
-                
-                invoice = None
-                is_update = False
-                
-                if first_row['tally_no']:
-                     invoice = SalesInvoice.objects.filter(tally_invoice_number__iexact=first_row['tally_no']).first()
-                     if invoice: is_update = True
-                
-                header_data = {
-                    'buyer': buyer_obj,
-                    'location': loc_obj,
-                    'tally_invoice_number': first_row['tally_no'],
-                    'buyers_order_no': first_row['buyer_ord_no'],
-                    'buyers_order_date': first_row['buyer_ord_date'] or datetime.now(),
-                    'dispatch_doc_no': first_row['disp_doc_no'],
-                    'dispatched_through': first_row['disp_through'],
-                    'destination': first_row['dest'],
-                    'delivery_note': first_row['del_note'],
-                    'delivery_note_date': first_row['del_note_date'] or datetime.now(),
-                    'mode_terms_payment': first_row['pay_terms'],
-                    'reference_no_date': first_row['ref_no'],
-                    'other_references': first_row['other_ref'],
-                    'terms_of_delivery': first_row['terms_del'],
-                    'remark': first_row['remark'],
-                }
-                
-                if first_row['inv_date']: header_data['date'] = first_row['inv_date']
-
-                if is_update and invoice:
-                     for k, v in header_data.items():
-                         if v is not None: setattr(invoice, k, v)
-                     invoice.save()
-                     log.append(f"Rows {indices_str}: Updated Invoice {invoice.app_invoice_number or invoice.id}")
-                     updated_count += 1
-                else:
-                    if 'date' not in header_data: header_data['date'] = datetime.now()
-                    header_data['status'] = 'DRF'
-                    invoice = SalesInvoice.objects.create(**header_data)
-                    log.append(f"Rows {indices_str}: Created Invoice #{invoice.id}")
-                    created_count += 1
-                    
-                # --- PROCESS ITEMS (Iterate ALL rows in group) ---
-                for r in rows:
-                    item_obj = Item.objects.filter(name__iexact=str(r['item_name']).strip()).first()
-                    if not item_obj:
-                         log.append(f"Row {r['index']}: Warning - Item '{r['item_name']}' not found. Skipped.")
-                         continue
-                    try: q = int(r['qty'])
-                    except: q = 1
-                    
-                    price = item_obj.price
-                    if r['unit_rate']:
-                        try: price = Decimal(str(r['unit_rate']).strip())
-                        except: pass
-                    
-                    # Prevent Duplicates and Fix "Returned more than one" error
-                    # If multiple items exist (from previous bad uploads), delete them first.
-                    existing_dupes = InvoiceItem.objects.filter(invoice=invoice, item=item_obj)
-                    if existing_dupes.count() > 1:
-                        existing_dupes.delete()
-
-                    # Update or Create based on Item
-                    InvoiceItem.objects.update_or_create(
-                        invoice=invoice,
-                        item=item_obj,
-                        defaults={
-                            'quantity': q,
-                            'quantity_billed': q,
-                            'quantity_shipped': q,
-                            'price': price,
-                            'gst_rate': item_obj.gst_rate,
-                            'description': r['item_desc'] 
-                        }
-                    )
-                
-                # Create DC if Notes OR Delivery Note details are present
-                if first_row['dc_notes'] or first_row['del_note'] or first_row['del_note_date']:
-                    dc, _ = DeliveryChallan.objects.get_or_create(invoice=invoice)
-                    if first_row['dc_notes']: 
-                        dc.notes = first_row['dc_notes']
-                    dc.save()
-                    if invoice.status == 'DRF': invoice.status = 'DC'
-                    
-                if first_row['trans_charges']:
-                     try:
-                         amt = Decimal(str(first_row['trans_charges']).strip()) 
-                         trp, _ = TransportCharges.objects.get_or_create(invoice=invoice)
-                         trp.charges = amt
-                         trp.description = first_row['trans_desc']
-                         trp.save()
-                         # Force invoice to be aware if needed or just status update
-                         if invoice.status in ['DRF', 'DC']: invoice.status = 'TRP'
-                     except Exception as e:
-                         log.append(f"Row {first_row['index']}: Warning - Invalid Transport Charge ({e})")
-                
-                invoice.save()
-                
-                # CRITICAL: Calculate total AFTER adding transport charges so Tax Matrix includes them
-                # refresh_from_db isn't strictly needed inside atomic for related objects unless cached, 
-                # but let's be safe for calculate logic.
-                if hasattr(invoice, 'transportcharges'): invoice.transportcharges.refresh_from_db()
-                invoice.calculate_total() 
-                
-                # --- FILE UPLOADS ---
-                # Fix: Check all_objects to handle soft-deleted records to prevent UNIQUE constraint error
-                conf = ConfirmationDocument.all_objects.filter(invoice=invoice).first()
-                if conf:
-                    if conf.is_deleted:
-                        conf.restore()
-                else:
-                    conf = ConfirmationDocument.objects.create(invoice=invoice)
-                
-                def save_file_from_path(path_val, target_field):
-                    if path_val:
-                         path_val = str(path_val).strip() # Clean path
-                         if os.path.exists(path_val):
-                             try:
-                                 with open(path_val, 'rb') as f:
-                                     fname = os.path.basename(path_val)
-                                     target_field.save(fname, File(f), save=True)
-                             except Exception as fe:
-                                 log.append(f" Failed to load file {path_val}: {fe}")
-                         else:
-                             log.append(f" File not found: {path_val}")
-                
-                save_file_from_path(first_row['doc_po'], conf.po_file)
-                save_file_from_path(first_row['doc_email'], conf.approval_email_file)
-                save_file_from_path(first_row['doc_inv'], conf.uploaded_invoice)
-                save_file_from_path(first_row['doc_dc'], conf.uploaded_dc)
-                
-                # --- PACKED IMAGES (Iterate 5 slots) ---
-                img_slots = [first_row[f'doc_img_{i}'] for i in range(1, 6)]
-                for img_path in img_slots:
-                    if img_path:
-                        img_path = str(img_path).strip()
-                        if os.path.exists(img_path):
-                            try:
-                                with open(img_path, 'rb') as f:
-                                    pi = PackedImage(confirmation=conf)
-                                    pi.image.save(os.path.basename(img_path), File(f), save=True)
-                            except Exception as ie:
-                               log.append(f" Failed to load image {img_path}: {ie}")
-                        else:
-                            log.append(f" Image not found: {img_path}")
-
-                # --- PDF GENERATION ---
-                should_gen_pdf = any(str(r['gen_pdf']).strip().lower() == 'yes' for r in rows if r['gen_pdf'])
-                if should_gen_pdf:
-                    try:
-                        company_profile = OurCompanyProfile.objects.first()
-                        merger = PdfMerger()
-                        
-                        # 1. Tax Invoice
-                        if conf.uploaded_invoice:
-                            try:
-                                PdfReader(conf.uploaded_invoice.path)
-                                merger.append(conf.uploaded_invoice.path)
-                            except: pass 
-                        else:
-                            # Re-Calculate to be 100% sure before PDF Gen
-                            invoice.calculate_total()
-                            merger.append(generate_invoice_pdf(invoice, company_profile))
-                            
-                        # 2. Delivery Note (DC)
-                        if conf.uploaded_dc:
-                            try:
-                                PdfReader(conf.uploaded_dc.path)
-                                merger.append(conf.uploaded_dc.path)
-                            except: pass
-                        elif hasattr(invoice, 'deliverychallan'):
-                            merger.append(generate_dc_pdf(invoice, invoice.deliverychallan, company_profile))
-                            
-                        # 3. Transport Charges
-                        if hasattr(invoice, 'transportcharges'):
-                             # Ensure the relation is accessible
-                             merger.append(generate_transport_pdf(invoice, invoice.transportcharges, company_profile))
-                        
-                        # 4. Email Approval / Buyer PO
-                        # User requested "Email Approval / Buyer PO". We'll append Email first, then PO if desired, or prioritized.
-                        # Assuming they map to the same conceptual "Approval" step. 
-                        conf.refresh_from_db() 
-                        
-                        if conf.approval_email_file:
-                             try: merger.append(conf.approval_email_file.path)
-                             except: pass
-                             
-                        if conf.po_file:
-                             try: merger.append(conf.po_file.path)
-                             except: pass
-
-                        # 5. Images (1-5)
-                        images_pdf_buffer = generate_packed_images_pdf(conf)
-                        if images_pdf_buffer:
-                            merger.append(images_pdf_buffer)
-
-                        output = BytesIO()
-                        merger.write(output)
-                        merger.close()
-                        output.seek(0)
-                        
-                        suffix = invoice.tally_invoice_number or invoice.app_invoice_number or str(invoice.id)
-                        filename = f"confirmation_invoice_{suffix}.pdf"
-                        
-                        from django.core.files.base import ContentFile
-                        conf.combined_pdf.save(filename, ContentFile(output.getvalue()), save=True)
-                        invoice.status = 'FIN'
-                        invoice.save()
-                        log.append(f" Invoice #{invoice.id}: PDF Generated (Bundled)")
-                    except Exception as pdf_err:
-                        logger.error(f"Bulk PDF Error: {pdf_err}")
-                        log.append(f" Invoice #{invoice.id}: PDF Failed ({str(pdf_err)})")
-
-        except Exception as e:
-            log.append(f"Rows {indices_str}: Group Error - {str(e)}")
-            error_count += 1
-            import traceback
-            logger.error(traceback.format_exc())
-
-    upload_record.log = "\n".join(log)
-    upload_record.status = 'Processed'
-    upload_record.save()
-    
-    return redirect('clientdoc:dashboard')
-
+@pin_primary
+@query_budget(15)
 def create_buyer(request):
     if request.method == 'POST':
         form = BuyerForm(request.POST) 
@@ -1510,20 +924,20 @@ def create_buyer(request):
         form = BuyerForm()
     return render(request, 'clientdoc/form.html', {'form': form, 'title': 'Create Buyer'})
 
+@reporting_view
+@query_budget(10)
 def buyer_list(request):
     search_fields = ['name', 'address', 'gstin', 'state']
-    buyers = get_filtered_queryset(Buyer, request, search_fields)
-    
-    paginator = Paginator(buyers, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    
+    table = cached_list_table(request, 'buyer_list', Buyer, search_fields,
+                              'clientdoc/includes/buyer_table.html', [Buyer])
     return render(request, 'clientdoc/buyer_list.html', {
-        'page_obj': page_obj, 
+        'table': table,
         'title': 'Buyer List',
         'list_type': 'buyer'
     })
 
+@pin_primary
+@query_budget(15)
 def edit_buyer(request, pk):
     buyer = get_object_or_404(Buyer, pk=pk)
     if request.method == 'POST':
@@ -1537,11 +951,14 @@ def edit_buyer(request, pk):
         form = BuyerForm(instance=buyer)
     return render(request, 'clientdoc/form.html', {'form': form, 'title': 'Edit Buyer'})
 
+@reporting_view
+@query_budget(5)
 def buyer_detail(request, pk):
     buyer = get_object_or_404(Buyer, pk=pk)
     return render(request, 'clientdoc/buyer_detail.html', {'buyer': buyer})
 
 
+@pin_primary
 def delete_packed_image(request, image_id):
     """Handles the deletion of a specific packed image, ensuring file removal."""
     image = get_object_or_404(PackedImage, id=image_id)
@@ -1550,6 +967,7 @@ def delete_packed_image(request, image_id):
     if request.method == 'POST':
         if image.image:
             image.image.delete(save=False) 
+        delete_derivatives(image)
         
         image.delete()
         messages.success(request, 'Image successfully removed.')
@@ -1558,90 +976,154 @@ def delete_packed_image(request, image_id):
         
     return redirect('clientdoc:create_confirmation', invoice_id=invoice_id)
 
+# Everything the printed invoice shows: its lines and their items, transport charges (in the totals),
+# the buyer, the location and our company
+PRINT_MODELS = [SalesInvoice, InvoiceItem, Item, TransportCharges, Buyer, StoreLocation, OurCompanyProfile]
+
+@reporting_view
+@query_budget(20)
 def print_invoice(request, invoice_id):
     """Renders the print-friendly invoice template."""
-    invoice = get_object_or_404(SalesInvoice, id=invoice_id)
-    company_profile = OurCompanyProfile.objects.first()
-    
-    # Ensure totals are calculated
-    invoice.calculate_gst_totals()
-    
-    display_invoice_number = invoice.tally_invoice_number if invoice.tally_invoice_number else invoice.app_invoice_number
-    
-    # Determine IGST vs CGST/SGST based on model's calculated fields
-    # Logic: If igst_total > 0, it's Inter-state. Or check place_of_supply vs company state.
-    # However, model stores totals now.
-    
-    comp_state_code = company_profile.state_code if company_profile else '29'
-    # Fallback to model POS if set, else Location state
-    pos_code = invoice.place_of_supply if invoice.place_of_supply else (invoice.location.state_code if invoice.location else '29')
-    
-    is_igst = (pos_code != comp_state_code)
-    
-    # Re-sum taxable for display if needed, or rely on grand total - tax? 
-    # Better to sum line items for the "Taxable Value" column/row in template.
-    taxable_val = sum(item.taxable_value for item in invoice.invoiceitem_set.all())
-    
-    if hasattr(invoice, 'transportcharges') and invoice.transportcharges and invoice.transportcharges.charges > 0:
-        taxable_val += invoice.transportcharges.charges
-
-    return render(request, 'clientdoc/invoice_print_template.html', {
-        'invoice': invoice,
-        'company': company_profile,
-        'display_invoice_number': display_invoice_number,
-        'taxable_val': taxable_val,
-        'tax_amt': (invoice.cgst_total + invoice.sgst_total + invoice.igst_total),
-        'cgst_amt': invoice.cgst_total,
-        'sgst_amt': invoice.sgst_total,
-        'igst_amt': invoice.igst_total,
-        'is_igst': is_igst,
-    })
-
+    def page():
+        invoice = get_object_or_404(SalesInvoice, id=invoice_id)
+        company_profile = OurCompanyProfile.objects.first()
+        return render_to_string('clientdoc/invoice_print_template.html', invoice_print_context(invoice, company_profile), request)
+    return HttpResponse(cached_fragment('print_invoice', PRINT_MODELS, invoice_id, page))
+
+@reporting_view
+@query_budget(20)
 def print_dc(request, invoice_id):
     """Renders the print-friendly Delivery Challan template."""
-    invoice = get_object_or_404(SalesInvoice, id=invoice_id)
-    # Get the associated Delivery Challan
-    dc = get_object_or_404(DeliveryChallan, invoice=invoice)
-    company_profile = OurCompanyProfile.objects.first()
-    
-    # Calculate total quantity
-    total_qty = sum(item.quantity for item in invoice.invoiceitem_set.all())
-    display_invoice_number = invoice.tally_invoice_number if invoice.tally_invoice_number else invoice.app_invoice_number
-    
-    return render(request, 'clientdoc/dc_print_template.html', {
-        'invoice': invoice,
-        'dc': dc,
-        'company': company_profile,
-        'total_qty': total_qty,
-        'display_invoice_number': display_invoice_number
-    })
-
+    def page():
+        invoice = get_object_or_404(SalesInvoice, id=invoice_id)
+        # Get the associated Delivery Challan
+        dc = get_object_or_404(DeliveryChallan, invoice=invoice)
+        company_profile = OurCompanyProfile.objects.first()
+        return render_to_string('clientdoc/dc_print_template.html', dc_print_context(invoice, dc, company_profile), request)
+    return HttpResponse(cached_fragment('print_dc', PRINT_MODELS + [DeliveryChallan], invoice_id, page))
+
+@reporting_view
+@query_budget(20)
 def print_transport(request, invoice_id):
     """Renders the print-friendly Transport Charges template."""
+    def page():
+        invoice = get_object_or_404(SalesInvoice, id=invoice_id)
+        # Get the associated Transport Charges
+        transport = get_object_or_404(TransportCharges, invoice=invoice)
+        company_profile = OurCompanyProfile.objects.first()
+        return render_to_string('clientdoc/transport_print_template.html', transport_print_context(invoice, transport, company_profile), request)
+    return HttpResponse(cached_fragment('print_transport', PRINT_MODELS, invoice_id, page))
+
+@query_budget(40)
+def download_document(request, invoice_id, doc_type):
+    """Streams a generated PDF (invoice, dc, transport) or the combined bundle.
+
+    Supports Range requests so viewers can fetch pages on demand, and answers
+    If-None-Match/If-Modified-Since with 304 before anything is rendered or read.
+    """
     invoice = get_object_or_404(SalesInvoice, id=invoice_id)
-    # Get the associated Transport Charges
-    transport = get_object_or_404(TransportCharges, invoice=invoice)
-    company_profile = OurCompanyProfile.objects.first()
-    
-    display_invoice_number = invoice.tally_invoice_number if invoice.tally_invoice_number else invoice.app_invoice_number
-    
-    return render(request, 'clientdoc/transport_print_template.html', {
-        'invoice': invoice,
-        'transport': transport,
-        'company': company_profile,
-        'display_invoice_number': display_invoice_number
-    })
+    display_number = invoice.tally_invoice_number or invoice.app_invoice_number or str(invoice.id)
+
+    if doc_type == 'combined':
+        confirmation = get_object_or_404(ConfirmationDocument, invoice=invoice)
+        if not confirmation.combined_pdf or not confirmation.combined_pdf.storage.exists(confirmation.combined_pdf.name):
+            raise Http404("Combined PDF has not been generated")
+        path = confirmation.combined_pdf.path
+        etag = confirmation.bundle_fingerprint
+        last_modified = os.path.getmtime(path)
+    elif doc_type in GENERATED_SECTIONS:
+        if doc_type == 'dc' and not hasattr(invoice, 'deliverychallan'):
+            raise Http404("No delivery challan for this invoice")
+        if doc_type == 'transport' and not hasattr(invoice, 'transportcharges'):
+            raise Http404("No transport charges for this invoice")
+        company_profile = OurCompanyProfile.objects.first()
+        etag = section_fingerprint(invoice, doc_type, company_profile)
+        path = None
+        last_modified = None
+    else:
+        raise Http404("Unknown document type")
+
+    not_modified = get_conditional_response(
+        request,
+        etag=quote_etag(etag) if etag else None,
+        last_modified=int(last_modified) if last_modified else None,
+    )
+    if not_modified is not None:
+        # A 304 repeats the validators and caching rules the full response would carry
+        if etag:
+            not_modified['ETag'] = quote_etag(etag)
+        not_modified['Cache-Control'] = 'private, no-cache'
+        return not_modified
+
+    if path is None:
+        path, etag = cached_section(invoice, doc_type, company_profile, fingerprint=etag)
+    filename = f"{doc_type}_{display_number}.pdf".replace('/', '-')
+    return ranged_file_response(request, path, 'application/pdf', filename, etag=etag, last_modified=last_modified)
+
+@query_budget(5)
 def project_guide(request):
     """Serves the Project Guide PDF."""
-    import os
-    from django.conf import settings
-    from django.http import HttpResponse, Http404
-
     file_path = os.path.join(settings.BASE_DIR, 'Project guide', 'Project Guide.pdf')
-    if os.path.exists(file_path):
-        with open(file_path, 'rb') as pdf:
-            response = HttpResponse(pdf.read(), content_type='application/pdf')
-            response['Content-Disposition'] = 'inline; filename="Project Guide.pdf"'
-            return response
-    else:
+    if not os.path.exists(file_path):
         raise Http404("Project Guide not found")
+    return ranged_file_response(request, file_path, 'application/pdf', 'Project Guide.pdf')
+
+# --- REQUEST PROFILES (staff only) ---
+
+@staff_member_required
+@query_budget(10)
+def profile_list(request):
+    """Recent request profiles captured by ProfilingMiddleware."""
+    profiles = RequestProfile.objects.select_related('invoice').order_by('-created_at', '-id')
+    paginator = Paginator(profiles, 50)
+    return render(request, 'clientdoc/profile_list.html', {
+        'page_obj': paginator.get_page(request.GET.get('page')),
+        'title': 'Request Profiles',
+        'profiling_enabled': getattr(settings, 'PROFILING_ENABLED', False),
+        'profiling_header': getattr(settings, 'PROFILING_HEADER', 'X-Profile'),
+        'profiling_query_flag': getattr(settings, 'PROFILING_QUERY_FLAG', '_profile'),
+    })
+
+@staff_member_required
+@query_budget(10)
+def profile_detail(request, pk):
+    """Top functions of one profile by cumulative time."""
+    profile = get_object_or_404(RequestProfile.objects.select_related('invoice'), pk=pk)
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 40)), 500))
+    except ValueError:
+        limit = 40
+    try:
+        rows, total_seconds = top_functions(profile.file_name, limit)
+    except (OSError, EOFError, ValueError) as e:
+        logger.error(f"Cannot read profile {profile.file_name}: {e}")
+        rows, total_seconds = None, None
+    return render(request, 'clientdoc/profile_detail.html', {
+        'profile': profile,
+        'rows': rows,
+        'total_seconds': total_seconds,
+        'limit': limit,
+        'title': f'Profile #{profile.id}',
+    })
+
+@staff_member_required
+@query_budget(5)
+def download_profile(request, pk):
+    """The raw .prof file, for snakeviz / pstats."""
+    profile = get_object_or_404(RequestProfile, pk=pk)
+    path = profile_path(profile.file_name)
+    if not os.path.exists(path):
+        raise Http404("Profile file is missing")
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=profile.file_name, content_type='application/octet-stream')
+
+# --- METRICS ---
+
+@query_budget(5)
+def metrics_view(request):
+    """Prometheus scrape endpoint; open to METRICS_ALLOWED_IPS and staff users."""
+    if not getattr(settings, 'METRICS_ENABLED', True):
+        raise Http404("Metrics are disabled")
+    allowed = request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', ['127.0.0.1', '::1'])
+    if not allowed and not request.user.is_staff:
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(metrics.exposition(), content_type=metrics.CONTENT_TYPE)
@@ -59,7 +59,13 @@ REM Start browser in background
 timeout /t 5 >nul
 start "" "http://127.0.0.1:8000/"
 
-python manage.py runserver
+REM Set TRANSOL_SERVER=serve to use the multi-threaded server (manage.py serve) instead of runserver
+if /I "%TRANSOL_SERVER%"=="serve" (
+    python -c "import waitress" >nul 2>&1 || pip install -r requirements.txt
+    python manage.py serve
+) else (
+    python manage.py runserver
+)
 
 popd
 pause
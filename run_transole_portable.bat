@@ -53,6 +53,12 @@ echo.
 echo =====================================================
 echo Server is running. Close this window to stop the app.
 echo =====================================================
-python manage.py runserver
+REM Set TRANSOL_SERVER=serve to use the multi-threaded server (manage.py serve) instead of runserver
+if /I "%TRANSOL_SERVER%"=="serve" (
+    python -c "import waitress" >nul 2>&1 || pip install -r requirements.txt
+    python manage.py serve
+) else (
+    python manage.py runserver
+)
 
 pause
@@ -48,11 +48,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'clientdoc.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'clientdoc.querybudget.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'clientdoc.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -81,15 +84,92 @@ WSGI_APPLICATION = 'transol.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-        'OPTIONS': {
-            'timeout': 30,
+# DB_ENGINE=postgres switches to PostgreSQL (the production recommendation) using the DB_* settings.
+# Otherwise clientdoc.sqlite is Django's SQLite backend with WAL, tuned pragmas and BEGIN IMMEDIATE
+# transactions (see clientdoc/sqlite/base.py); an optional 'PRAGMAS' dict here overrides its defaults
+DB_ENGINE = config('DB_ENGINE', default='sqlite')
+
+if DB_ENGINE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config('DB_NAME', default='transol_db'),
+            'USER': config('DB_USER', default=''),
+            'PASSWORD': config('DB_PASSWORD', default=''),
+            'HOST': config('DB_HOST', default='localhost'),
+            'PORT': config('DB_PORT', default='5432'),
+            # Each worker thread keeps its connection between requests instead of reconnecting every time
+            'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=60, cast=int),
+            # A kept connection the server has dropped (restart, idle timeout) is replaced, not reused
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'connect_timeout': config('DB_CONNECT_TIMEOUT', default=10, cast=int),
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'clientdoc.sqlite',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                'timeout': 30,
+            },
+        }
+    }
+
+# Read-only 'reporting' alias used by list, dashboard, export and print views (see clientdoc/routers.py).
+# SQLite: a query_only connection to the same file. PostgreSQL: DB_REPORTING_HOST/PORT (a replica; the
+# primary by default) in read-only transactions, with a statement timeout so runaway reports give up.
+REPORTING_DB = config('REPORTING_DB', default=True, cast=bool)
+REPORTING_PIN_SECONDS = config('REPORTING_PIN_SECONDS', default=5, cast=int)
+
+if REPORTING_DB:
+    DATABASES['reporting'] = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+    if DB_ENGINE == 'postgres':
+        DATABASES['reporting'].update({
+            'HOST': config('DB_REPORTING_HOST', default=DATABASES['default']['HOST']),
+            'PORT': config('DB_REPORTING_PORT', default=DATABASES['default']['PORT']),
+            'OPTIONS': dict(
+                DATABASES['default']['OPTIONS'],
+                options='-c default_transaction_read_only=on -c statement_timeout={}'.format(
+                    config('DB_REPORTING_STATEMENT_TIMEOUT_MS', default=120000, cast=int)),
+            ),
+        })
+    else:
+        DATABASES['reporting']['PRAGMAS'] = {'query_only': 'ON'}
+
+DATABASE_ROUTERS = ['clientdoc.routers.ReportingRouter']
+
+# Cache for rendered list/dashboard/print fragments (clientdoc/fragments.py). 'file' (default) is shared
+# by every worker process and management command; 'locmem' only suits a single process; 'redis' needs
+# the redis package and CACHE_URL.
+CACHE_BACKEND = config('CACHE_BACKEND', default='file')
+
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': config('CACHE_URL', default='redis://127.0.0.1:6379/1'),
         }
     }
-}
+elif CACHE_BACKEND == 'locmem':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': config('CACHE_DIR', default=os.path.join(BASE_DIR, 'cache')),
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+FRAGMENT_CACHE_ENABLED = config('FRAGMENT_CACHE_ENABLED', default=True, cast=bool)
+FRAGMENT_CACHE_SECONDS = config('FRAGMENT_CACHE_SECONDS', default=600, cast=int)
 
 
 # Password validation
@@ -135,6 +215,76 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 # Media files (uploads)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# An uploaded document no row references any more is kept this long after its last upload
+MEDIA_BLOB_GRACE_SECONDS = config('MEDIA_BLOB_GRACE_SECONDS', default=600, cast=int)
+
+# PDF rendering
+# Generated PDFs stay in memory up to this size, then spill to a temp file
+PDF_SPOOL_MAX_BYTES = config('PDF_SPOOL_MAX_BYTES', default=8 * 1024 * 1024, cast=int)
+# Write combined bundles linearized ("fast web view"); needs pikepdf, can be overridden per bundle
+PDF_LINEARIZE = config('PDF_LINEARIZE', default=False, cast=bool)
+# Renderer per generated document, e.g. "invoice=weasyprint,dc=weasyprint"; unlisted ones use reportlab
+PDF_ENGINES = dict(entry.split('=', 1) for entry in config('PDF_ENGINES', default='', cast=Csv()))
+# Rendered invoice/DC/transport PDFs, keyed by an input fingerprint (safe to delete)
+RENDER_CACHE_DIR = config('RENDER_CACHE_DIR', default=os.path.join(BASE_DIR, 'render_cache'))
+# Renders (finalize, bulk upload, pre-render) allowed to run at once across all worker processes
+RENDER_CONCURRENCY = config('RENDER_CONCURRENCY', default=2, cast=int)
+# A queued finalize whose browser stopped polling for this long loses its place
+RENDER_TICKET_STALE_SECONDS = config('RENDER_TICKET_STALE_SECONDS', default=30, cast=int)
+# Finished render tickets (queue and render timings) are deleted after this long
+RENDER_TICKET_KEEP_HOURS = config('RENDER_TICKET_KEEP_HOURS', default=24, cast=int)
+# A crashed render's lease on an invoice expires after this long (running renders keep renewing theirs)
+RENDER_LEASE_TTL_SECONDS = config('RENDER_LEASE_TTL_SECONDS', default=60, cast=int)
+# Run jobs on a thread of every web/import process instead of in `manage.py prerender_worker`
+PRERENDER_IN_PROCESS = config('PRERENDER_IN_PROCESS', default=False, cast=bool)
+# Render invoice/DC/transport sections in the background as invoices move through the workflow.
+# Off unless something consumes the jobs: set it when running `manage.py prerender_worker`
+PRERENDER_ENABLED = config('PRERENDER_ENABLED', default=PRERENDER_IN_PROCESS, cast=bool)
+# Edits within this window are rendered once
+PRERENDER_DEBOUNCE_SECONDS = config('PRERENDER_DEBOUNCE_SECONDS', default=5, cast=float)
+# Resolution of the packed-image derivatives embedded in bundles
+PACKED_IMAGE_DPI = config('PACKED_IMAGE_DPI', default=200, cast=int)
+# Max differing bits (of 64) between perceptual hashes for two photos to count as duplicates
+PACKED_IMAGE_DUPLICATE_DISTANCE = config('PACKED_IMAGE_DUPLICATE_DISTANCE', default=6, cast=int)
+
+# Query budgets: count each request's queries against its view's @query_budget and flag N+1 patterns
+QUERY_BUDGET_ENABLED = config('QUERY_BUDGET_ENABLED', default=True, cast=bool)
+# Budget for views that don't declare one
+QUERY_BUDGET_DEFAULT = config('QUERY_BUDGET_DEFAULT', default=60, cast=int)
+# The same query (up to its parameters) running more often than this in one request is reported as N+1
+QUERY_BUDGET_MAX_REPEATS = config('QUERY_BUDGET_MAX_REPEATS', default=5, cast=int)
+# Raise instead of logging a warning (tests and benchmarks)
+QUERY_BUDGET_STRICT = config('QUERY_BUDGET_STRICT', default=False, cast=bool)
+
+# Request profiling: when off the middleware is not loaded at all
+PROFILING_ENABLED = config('PROFILING_ENABLED', default=False, cast=bool)
+# Staff requests carrying this header or query parameter are profiled
+PROFILING_HEADER = 'X-Profile'
+PROFILING_QUERY_FLAG = '_profile'
+# Fraction of all requests profiled at random (0 for on-demand only)
+PROFILING_SAMPLE_RATE = config('PROFILING_SAMPLE_RATE', default=0.0, cast=float)
+# .prof files; only the most recent PROFILING_KEEP are kept
+PROFILE_DIR = config('PROFILE_DIR', default=os.path.join(BASE_DIR, 'profiles'))
+PROFILING_KEEP = config('PROFILING_KEEP', default=200, cast=int)
+
+# Prometheus metrics at /metrics: request, render, bundle and import timings of all worker processes
+METRICS_ENABLED = config('METRICS_ENABLED', default=True, cast=bool)
+# Running totals shared by the workers (safe to delete, which resets them)
+METRICS_DB = config('METRICS_DB', default=os.path.join(BASE_DIR, 'metrics.sqlite3'))
+# Each worker adds its buffered increments to METRICS_DB at most this often (and on every scrape)
+METRICS_FLUSH_SECONDS = config('METRICS_FLUSH_SECONDS', default=5, cast=float)
+# Clients allowed to scrape without logging in; staff users always may
+METRICS_ALLOWED_IPS = config('METRICS_ALLOWED_IPS', default='127.0.0.1,::1', cast=Csv())
+
+# `manage.py serve`: waitress with SERVE_WORKERS processes (POSIX only) of SERVE_THREADS threads each
+SERVE_HOST = config('SERVE_HOST', default='127.0.0.1')
+SERVE_PORT = config('SERVE_PORT', default=8000, cast=int)
+SERVE_WORKERS = config('SERVE_WORKERS', default=1, cast=int)
+SERVE_THREADS = config('SERVE_THREADS', default=8, cast=int)
+# On shutdown, running requests get this long to finish
+SERVE_GRACEFUL_TIMEOUT = config('SERVE_GRACEFUL_TIMEOUT', default=30, cast=float)
+# Browser cache lifetime of static files served by `serve` (media is always revalidated)
+SERVE_STATIC_MAX_AGE = config('SERVE_STATIC_MAX_AGE', default=3600, cast=int)
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field